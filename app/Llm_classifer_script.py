@@ -1,9 +1,16 @@
-import ollama
 from Prosses_user_input import ProssesUserInput as PUI
 import json
+import math
 import re
-from typing import List, Tuple, Dict, Optional
+from collections import defaultdict, deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, NamedTuple, Sequence, Tuple, Dict, Optional
 from calibration_api import auto_fit_and_save, load_manager
+from result_cache import ResultCache, stable_hash, text_id
+from example_index import ExampleIndex, load_examples
+from prompt_compiler import PromptCompiler
+from inference_backends import InferenceBackend, make_backend
 import os
 import numpy as np
 
@@ -107,6 +114,13 @@ DEFAULT_SYSTEM_PROMPT = """
 
 
 
+# System prompt for scoring="logprobs": the model only has to produce the label digit
+LABEL_SYSTEM_PROMPT = """
+        You are a highly accurate text classifier.
+        Reply with exactly one character: 1 if the question needs external, fresh or
+        volatile information (a web search), 0 if it can be answered from stable knowledge.
+    """
+
 # Iteratively tuned defaults for qwen2.5:0.5b-instruct for classification task
 DEFAULT_OPTIONS = {
     "format": "json", 
@@ -118,17 +132,36 @@ DEFAULT_OPTIONS = {
     "raw": True
 }
 DEFAULT_MODEL = "qwen2.5:0.5b-instruct"
+# Bump when _build_prompt's template changes so cached results from the old prompt stop matching
+PROMPT_VERSION = "2shot-v1"
+# Alternatives requested for the label token in logprobs mode
+LABEL_TOP_LOGPROBS = 10
+# Output tokens budgeted per question in packed mode ({"search_needed":0,"confidence":0.65}, )
+PACKED_TOKENS_PER_ITEM = 24
+
+class _PackItem(NamedTuple):
+    # slot for one question of a packed request: position `pos` of fut.result()
+    fut: Future
+    pos: int
 
 class llmClassifier:
     def __init__(self, model: str = DEFAULT_MODEL, system_prompt: str = DEFAULT_SYSTEM_PROMPT,
                     options: dict = DEFAULT_OPTIONS, gpu: Optional[str] = False,
-                    calib_path: str = r"app/app_data/Calibration_data/calibrators.json"):
+                    calib_path: str = r"app/app_data/Calibration_data/calibrators.json",
+                    cache_path: Optional[str] = None, cache_max_entries: int = 1_000_000,
+                    examples_path: Optional[str] = None, pack_size: int = 1,
+                    scoring: str = "json", backend=None):
+        if scoring not in ("json", "logprobs"):
+            raise ValueError(f"Unknown scoring mode {scoring!r} (expected 'json' or 'logprobs')")
         self.model = model
+        self.scoring = scoring
+        if scoring == "logprobs" and system_prompt is DEFAULT_SYSTEM_PROMPT:
+            system_prompt = LABEL_SYSTEM_PROMPT
         self.system_prompt = system_prompt
         self.options = options or {}
-        self.client = ollama
+        # an InferenceBackend, or a backend name for make_backend ("ollama", "llamacpp", "fake")
+        self.backend: InferenceBackend = backend if isinstance(backend, InferenceBackend) else make_backend(backend or "ollama")
         self.pui = PUI()
-        self.retry_attempts = 0  # Number of retry attempts for model query
         self.options.setdefault("raw", True)
         if gpu:
             self.options.setdefault("gpu_layers",-1)
@@ -138,19 +171,28 @@ class llmClassifier:
         self.calib_path = calib_path
         self.mgr = self._init_calibrators()
 
+        # Optional on-disk cache of raw (pre-calibration) results
+        self.cache = ResultCache(cache_path, cache_max_entries) if cache_path else None
+        self._model_key = self.backend.cache_identity(self.model)
+
+        # Few-shot bank compiled once (built-in EXAMPLES unless a bank file is given)
+        bank = load_examples(examples_path) if examples_path else EXAMPLES
+        self.examples = ExampleIndex(bank)
+        self.prompts = PromptCompiler(bank)
+        self._examples_hash = stable_hash(bank) if examples_path else None
+
+        # >1: classify_batch sends up to pack_size questions of one domain per generation
+        # (json scoring only; logprobs mode always scores one question per request)
+        self.pack_size = max(1, int(pack_size))
+        if scoring == "logprobs":
+            self._check_logprob_support()
+
 
     def _ensure_model(self):
         try:
             print(f"Checking if model '{self.model}' is installed...")
-            try:
-                # Attempt to show details for the model
-                self.client.show(model=self.model)
-
-            except ollama.ResponseError as e:
-                print(f"Model '{self.model}' not found locally. Installing now...")
-                self.client.pull(self.model)
-                print(f"Model '{self.model}' installed successfully.\n")
-            ollama.generate(model=self.model, prompt='')  # Warm up the model
+            self.backend.ensure_model(self.model)
+            self.backend.warmup(self.model)  # Warm up the model
             print(f"Model '{self.model}' is ready to use.\n")     
         except Exception as e:
             raise RuntimeError(f"Failed to pull model '{self.model}': {e}")
@@ -177,63 +219,400 @@ class llmClassifier:
         print(report)
         return mgr
     
+    def _cache_key(self, user_input: str, domain_tag: str):
+        # domain picks the few-shot examples, so it is part of the prompt identity
+        ident = [PROMPT_VERSION, self.system_prompt, domain_tag]
+        if self._examples_hash:
+            ident.append(self._examples_hash)  # a custom bank changes which examples are shown
+        if self.scoring != "json":
+            ident.append(self.scoring)  # different prompt, and a probability instead of a stated confidence
+        elif self.pack_size > 1:
+            ident.append(f"packed-{self.pack_size}")  # answers shift when questions share a prompt
+        prompt_hash = stable_hash(ident)
+        # the backend's identity, not just the model name: a fake or GGUF answer must never
+        # come back as a hit for an Ollama run of the same name (or vice versa)
+        return (text_id(user_input), self._model_key, prompt_hash, stable_hash(self.options))
+
+    def cached_result(self, user_input: str, domain_tag: str = "general") -> Optional[dict]:
+        """
+        Returns the calibrated result for `user_input` if the cache has it, else None.
+        """
+        if self.cache is None:
+            return None
+        hit = self.cache.get(self._cache_key(user_input, domain_tag))
+        if hit is None:
+            return None
+        search_needed, raw_conf = hit
+        return {"search_needed": search_needed,
+                "confidence": self.mgr.calibrate_confidence(domain_tag, raw_conf)}
+
     def classify(self, user_input: str, domain_tag: str = "general"):
+        cached = self.cached_result(user_input, domain_tag)
+        if cached is not None:
+            return cached
         processed_input = self.pui.process_user_input(user_input)
+        return self.classify_processed(processed_input, domain_tag, user_input=user_input)
 
-        if len(processed_input.get("tokenized", [])) == 0:
+    def classify_processed(self, processed_input: dict, domain_tag: str = "general",
+                           user_input: Optional[str] = None):
+        """
+        Classifies an input that already went through ProssesUserInput.
+        Keeps no per-call state on the instance so it can be called from several threads at once.
+        Pass the original `user_input` to have a successful result stored in the cache.
+        """
+        try:
+            raw = self._score(processed_input, domain_tag)
+        except ValueError:
             return {"search_needed": 0, "confidence": 0.0}
-        if len(processed_input["tokenized"]) > 512:
+        if raw is None:
             return {"search_needed": 0, "confidence": 0.0}
 
-        prompt = self._build_prompt(processed_input, domain_tag)
+        search_needed, raw_conf = raw
+        if self.cache is not None and user_input is not None:
+            self.cache.put(self._cache_key(user_input, domain_tag), search_needed, raw_conf)
+        confidence = self.mgr.calibrate_confidence(domain_tag, raw_conf)
+        print(f"Raw confidence: {raw_conf} calibrated: {confidence}") # to high currently fix later
+        return {"search_needed": search_needed, "confidence": confidence}
+
+    def _classify_raw(self, processed_input: dict, domain_tag: str = "general") -> Optional[Tuple[int, float]]:
+        """
+        Asks the model (up to 3 attempts) and returns (search_needed, raw confidence) before
+        calibration, or None for inputs that are never sent (empty, or over 512 tokens).
+        Raises ValueError when no attempt produced usable JSON.
+        """
+        if len(processed_input.get("tokenized", [])) == 0:
+            return None
+        if len(processed_input["tokenized"]) > 512:
+            return None
+
+        request = self._json_request(processed_input, domain_tag)
 
-        if self.options is None:
-            response = self.client.generate(model=self.model, prompt=prompt, system=self.system_prompt)
-        else:
-            response = self.client.generate(model=self.model, prompt=prompt, system=self.system_prompt, options=self.options)
+        last_error = None
+        for attempt in range(1, 4):
+            response = self.backend.generate(**request)
 
-        try:
-            if response.get("response") is None:
-                raise TypeError("No response from model")
-
-            response_data = self._load_json_or_raise(response["response"])
-
-            if "search_needed" not in response_data: raise KeyError("search_needed")
-            if "confidence"   not in response_data: raise KeyError("confidence")
-
-            # normalize types/ranges
-            response_data["search_needed"] = 1 if int(response_data["search_needed"]) >= 1 else 0
-            response_data["confidence"]    = max(0.0, min(1.0, float(response_data["confidence"])))
-            print(f"Raw confidence: {response_data['confidence']}", end="")
-            response_data["confidence"] = self.mgr.calibrate_confidence(domain_tag, response_data["confidence"])
-            print(f" calibrated: {response_data['confidence']}") # to high currently fix later
-            self.retry_attempts = 0
-            return response_data
-
-        except (TypeError, KeyError, ValueError) as e:
-            print(f"Error processing response for '{processed_input.get('BERT_Input','<unknown>')}': {e}")
-            print(f"Model output: {response}")
-            self.retry_attempts += 1
-            if self.retry_attempts < 3:
-                print(f"Retrying... Attempt {self.retry_attempts}")
-                return self.classify(user_input, domain_tag=domain_tag)
-            else:
-                self.retry_attempts = 0
-                return {"search_needed": 0, "confidence": 0.0}
+            try:
+                if response.get("response") is None:
+                    raise TypeError("No response from model")
 
-        except Exception as e:
-            print(f"Unexpected error for '{processed_input.get('BERT_Input','<unknown>')}': {e}")
+                return self._parse_item(self._load_json_or_raise(response["response"]))
+
+            except (TypeError, KeyError, ValueError) as e:
+                last_error = e
+                print(f"Error processing response for '{processed_input.get('BERT_Input','<unknown>')}': {e}")
+                print(f"Model output: {response}")
+
+            except Exception as e:
+                last_error = e
+                print(f"Unexpected error for '{processed_input.get('BERT_Input','<unknown>')}': {e}")
+                try:
+                    print(f"Model raw: {response.get('response')}\n")
+                except Exception:
+                    pass
+
+            if attempt < 3:
+                print(f"Retrying... Attempt {attempt}")
+
+        raise ValueError(f"No usable model output after 3 attempts: {last_error}")
+
+    def _json_request(self, processed_input: dict, domain_tag: str) -> dict:
+        request = {"model": self.model, "prompt": self._build_prompt(processed_input, domain_tag),
+                   "system": self.system_prompt}
+        if self.options is not None:
+            request["options"] = self.options
+        return request
+
+    def _score(self, processed_input: dict, domain_tag: str = "general") -> Optional[Tuple[int, float]]:
+        if self.scoring == "logprobs":
+            return self._classify_logprobs(processed_input, domain_tag)
+        return self._classify_raw(processed_input, domain_tag)
+
+    def _score_batch(self, processed: List[dict], domain_tag: str = "general") -> list:
+        """
+        Scores several preprocessed inputs of one domain with one backend.generate_batch call
+        (one request per input, as _score would send it). Returns entries as _classify_pack
+        does; JSON answers that don't parse are retried one at a time with _classify_raw.
+        Errors of the batch call itself propagate.
+        """
+        out: list = [None] * len(processed)
+        sendable = [i for i, p in enumerate(processed) if 0 < len(p.get("tokenized", [])) <= 512]
+        if not sendable:
+            return out
+        build = self._label_request if self.scoring == "logprobs" else self._json_request
+        responses = self.backend.generate_batch([build(processed[i], domain_tag) for i in sendable])
+        for i, response in zip(sendable, responses):
+            try:
+                if self.scoring == "logprobs":
+                    out[i] = self._label_result(response)
+                else:
+                    out[i] = self._parse_item(self._load_json_or_raise(response.get("response")))
+                continue
+            except ValueError as e:
+                if self.scoring == "logprobs":
+                    out[i] = e
+                    continue
+            except (TypeError, KeyError):
+                pass
+            try:
+                out[i] = self._classify_raw(processed[i], domain_tag)
+            except ValueError as e:
+                out[i] = e
+        return out
+
+    @staticmethod
+    def _parse_item(response_data) -> Tuple[int, float]:
+        if not isinstance(response_data, dict): raise TypeError(f"expected a JSON object, got {type(response_data).__name__}")
+        if "search_needed" not in response_data: raise KeyError("search_needed")
+        if "confidence"   not in response_data: raise KeyError("confidence")
+
+        # normalize types/ranges
+        search_needed = 1 if int(response_data["search_needed"]) >= 1 else 0
+        return search_needed, max(0.0, min(1.0, float(response_data["confidence"])))
+
+    # ---------- logprobs mode ----------
+    def _check_logprob_support(self):
+        if not self.backend.supports_logprobs:
+            raise RuntimeError(f"scoring='logprobs' needs a backend that returns logprobs "
+                               f"({self.backend.name} does not; for ollama, a recent package and server; "
+                               f"for llamacpp, build it with logprobs=True)")
+
+    def _label_options(self) -> dict:
+        opts = dict(self.options or {})
+        opts.pop("format", None)  # a bare digit is not a JSON object
+        opts["num_predict"] = 1
+        return opts
+
+    def _classify_logprobs(self, processed_input: dict, domain_tag: str = "general") -> Optional[Tuple[int, float]]:
+        """
+        Single-token scoring: asks for the label digit only (num_predict 1) and reads
+        P(search) from the log-probabilities of "1" and "0" among the first token's top
+        alternatives. Returns (label, P(label)) before calibration, None for inputs that
+        are never sent, and raises ValueError when neither digit is among the alternatives.
+        """
+        if len(processed_input.get("tokenized", [])) == 0:
+            return None
+        if len(processed_input["tokenized"]) > 512:
+            return None
+
+        return self._label_result(self.backend.generate(**self._label_request(processed_input, domain_tag)))
+
+    def _label_request(self, processed_input: dict, domain_tag: str) -> dict:
+        question = processed_input["BERT_Input"]
+        shots = self._pick_two_balanced_examples(domain_tag, len(question))
+        return {"model": self.model, "prompt": self.prompts.render_label(question, domain_tag, shots),
+                "system": self.system_prompt, "options": self._label_options(), "logprobs": True,
+                "top_logprobs": LABEL_TOP_LOGPROBS}
+
+    @classmethod
+    def _label_result(cls, response) -> Tuple[int, float]:
+        p_search = cls._search_probability(response)
+        search_needed = 1 if p_search >= 0.5 else 0
+        return search_needed, p_search if search_needed else 1.0 - p_search
+
+    @staticmethod
+    def _search_probability(response) -> float:
+        logprobs = response.get("logprobs") if response is not None else None
+        if not logprobs:
+            raise ValueError("Response carries no logprobs (backend does not expose them?)")
+        first = logprobs[0]
+        alternatives = list(first.get("top_logprobs") or []) or [first]
+        mass = {"0": 0.0, "1": 0.0}
+        for alt in alternatives:
+            tok = str(alt.get("token", "")).strip()
+            if tok in mass:
+                mass[tok] += math.exp(float(alt.get("logprob")))  # " 1" and "1" both count
+        total = mass["0"] + mass["1"]
+        if total <= 0.0:
+            raise ValueError(f"Neither '0' nor '1' among the top tokens: {[a.get('token') for a in alternatives]}")
+        return mass["1"] / total
+
+    # ---------- packed mode ----------
+    def _build_packed_prompt(self, processed: List[dict], domain_tag: str = "general") -> str:
+        questions = [p["BERT_Input"] for p in processed]
+        # one shared pair of examples, picked for the pack's mean question length
+        target_len = sum(len(q) for q in questions) // len(questions)
+        shots = self._pick_two_balanced_examples(domain_tag, target_len)
+        return self.prompts.render_packed(questions, domain_tag, shots)
+
+    def _packed_options(self, k: int) -> dict:
+        opts = dict(self.options or {})
+        # Ollama's "json" format only admits a top-level object; the array is parsed leniently instead
+        opts.pop("format", None)
+        opts["num_predict"] = PACKED_TOKENS_PER_ITEM * k + 8
+        return opts
+
+    def _classify_pack(self, processed: List[dict], domain_tag: str = "general") -> list:
+        """
+        Classifies several preprocessed inputs of one domain with a single generation.
+
+        Returns one entry per input: (search_needed, raw confidence), None for inputs that
+        are never sent (as in _classify_raw), or the exception of a failed fallback call.
+        Answers missing from or unusable in the returned array are retried one at a time
+        with _classify_raw. Errors of the packed request itself propagate.
+        """
+        out: list = [None] * len(processed)
+        sendable = [i for i, p in enumerate(processed) if 0 < len(p.get("tokenized", [])) <= 512]
+        if len(sendable) < 2:
+            for i in sendable:
+                try:
+                    out[i] = self._classify_raw(processed[i], domain_tag)
+                except ValueError as e:
+                    out[i] = e
+            return out
+
+        items = [processed[i] for i in sendable]
+        prompt = self._build_packed_prompt(items, domain_tag)
+        response = self.backend.generate(model=self.model, prompt=prompt, system=self.system_prompt,
+                                        options=self._packed_options(len(items)))
+        try:
+            answers = self._load_json_list(response.get("response"))
+        except ValueError as e:
+            print(f"Packed response unusable ({len(items)} questions, falling back to single calls): {e}")
+            answers = []
+        truncated = response.get("done_reason") == "length" and len(answers) < len(items)
+        if answers and len(answers) != len(items) and not truncated:
+            # counts disagree, so positions can't be trusted (a cut-off array keeps its head)
+            print(f"Packed response has {len(answers)} answers for {len(items)} questions; falling back to single calls")
+            answers = []
+
+        for j, i in enumerate(sendable):
             try:
-                print(f"Model raw: {response.get('response')}\n")
-            except Exception:
+                out[i] = self._parse_item(answers[j])
+                continue
+            except (IndexError, TypeError, KeyError, ValueError):
                 pass
-            self.retry_attempts += 1
-            if self.retry_attempts < 3:
-                print(f"Retrying... Attempt {self.retry_attempts}")
-                return self.classify(user_input, domain_tag=domain_tag)
+            try:
+                out[i] = self._classify_raw(processed[i], domain_tag)
+            except ValueError as e:
+                out[i] = e
+        return out
+
+    # ---------- batched API ----------
+    def classify_batch(self, texts: Sequence[str], domains: Optional[Sequence[Optional[str]]] = None,
+                       chunk_size: int = 64, max_concurrency: int = 4,
+                       executor: Optional[Executor] = None) -> List[dict]:
+        """
+        Classifies many texts at once; returns one result per text, in input order.
+        `domains` is parallel to `texts` (None or a missing entry means "general").
+        See classify_iter for how the work is batched and how failures are reported.
+        """
+        domains = list(domains) if domains is not None else []
+        items = ((t, domains[i] if i < len(domains) else None) for i, t in enumerate(texts))
+        return list(self.classify_iter(items, chunk_size, max_concurrency, executor))
+
+    def classify_iter(self, items: Iterable[Tuple[str, Optional[str]]], chunk_size: int = 64,
+                      max_concurrency: int = 4, executor: Optional[Executor] = None) -> Iterator[dict]:
+        """
+        Streaming form of classify_batch over (text, domain) pairs; yields in input order.
+
+        Per chunk of `chunk_size` items: cache lookups, one nlp.pipe pass over the misses,
+        model calls on `executor` (or an internal pool of `max_concurrency` threads, capped by
+        the backend's max_concurrency), then one vectorized calibration per domain. The next
+        chunk is preprocessed while the previous chunk's requests are still in flight. An item that fails yields
+        {"search_needed": 0, "confidence": 0.0, "error": "<reason>"} (plus "retryable": True
+        when the call itself failed rather than the model's output); the rest of the batch
+        is unaffected.
+
+        With pack_size > 1 the misses of each domain are sent pack_size per request (see
+        _classify_pack); `max_concurrency` then bounds packed requests, not questions.
+        Otherwise, a backend with supports_batch gets each domain's misses of a chunk as one
+        generate_batch call (see _score_batch).
+        """
+        own_pool = executor is None
+        workers = max(1, min(max_concurrency, self.backend.max_concurrency))
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="clf") if own_pool else executor
+        chunk_size = max(1, chunk_size)
+        pending = deque()
+        try:
+            it = iter(items)
+            while True:
+                chunk = [(t, d or "general") for t, d in islice(it, chunk_size)]
+                if not chunk:
+                    break
+                pending.append(self._submit_chunk(chunk, pool))
+                # keep the newest chunk in flight, finish everything older
+                while len(pending) > 1:
+                    yield from self._finish_chunk(*pending.popleft())
+            while pending:
+                yield from self._finish_chunk(*pending.popleft())
+        finally:
+            if own_pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit_chunk(self, chunk: List[Tuple[str, str]], pool: Executor):
+        # slot per item: cached (search_needed, raw_conf), the Future of its model call,
+        # or a _PackItem pointing into a packed call's result list
+        slots: list = [None] * len(chunk)
+        misses: List[int] = []
+        for i, (text, domain) in enumerate(chunk):
+            hit = self.cache.get(self._cache_key(text, domain)) if self.cache is not None else None
+            if hit is not None:
+                slots[i] = hit
+            else:
+                misses.append(i)
+        processed = self.pui.process_many([chunk[i][0] for i in misses], batch_size=max(1, len(misses)))
+        packed = self.pack_size > 1 and self.scoring == "json"
+        if not packed and not self.backend.supports_batch:
+            for i, p in zip(misses, processed):
+                slots[i] = pool.submit(self._score, p, chunk[i][1])
+            return chunk, slots
+
+        # packs of pack_size questions per generation, or (batching backend) one
+        # generate_batch call per domain and chunk
+        job, size = (self._classify_pack, self.pack_size) if packed else (self._score_batch, len(misses))
+        by_domain: Dict[str, List[Tuple[int, dict]]] = defaultdict(list)
+        for i, p in zip(misses, processed):
+            by_domain[chunk[i][1]].append((i, p))
+        for domain, group in by_domain.items():
+            for lo in range(0, len(group), size):
+                pack = group[lo:lo + size]
+                fut = pool.submit(job, [p for _, p in pack], domain)
+                for pos, (i, _) in enumerate(pack):
+                    slots[i] = _PackItem(fut, pos)
+        return chunk, slots
+
+    def _finish_chunk(self, chunk: List[Tuple[str, str]], slots: list) -> Iterator[dict]:
+        raws: List[Optional[Tuple[int, float]]] = []
+        errors: Dict[int, dict] = {}
+        for i, slot in enumerate(slots):
+            if isinstance(slot, (Future, _PackItem)):
+                try:
+                    if isinstance(slot, _PackItem):
+                        slot = slot.fut.result()[slot.pos]
+                        if isinstance(slot, Exception):
+                            raise slot
+                    else:
+                        slot = slot.result()
+                except ValueError as e:  # the model answered, but never usably
+                    errors[i] = {"error": str(e)}
+                    slot = None
+                except Exception as e:   # transport / server failure
+                    errors[i] = {"error": f"{type(e).__name__}: {e}", "retryable": True}
+                    slot = None
+                else:
+                    if slot is not None and self.cache is not None:
+                        self.cache.put(self._cache_key(*chunk[i]), *slot)
+            raws.append(slot)
+
+        # one calibrate() call per domain over all of the chunk's raw confidences
+        calibrated: Dict[int, float] = {}
+        by_domain: Dict[str, List[int]] = defaultdict(list)
+        for i, raw in enumerate(raws):
+            if raw is not None:
+                by_domain[chunk[i][1]].append(i)
+        for domain, idxs in by_domain.items():
+            out = np.asarray(self.mgr.calibrate(domain, np.array([raws[i][1] for i in idxs], dtype=float))).ravel()
+            for i, c in zip(idxs, out):
+                # same as calibrate_confidence: an exact 1.0 stays 1.0
+                calibrated[i] = 1.0 if raws[i][1] == 1.0 else float(c)
+
+        for i, raw in enumerate(raws):
+            if i in errors:
+                yield {"search_needed": 0, "confidence": 0.0, **errors[i]}
+            elif raw is None:
+                yield {"search_needed": 0, "confidence": 0.0}
             else:
-                self.retry_attempts = 0
-                return {"search_needed": 0, "confidence": 0.0}
+                yield {"search_needed": raw[0], "confidence": calibrated[i]}
 
     def _load_json_or_raise(self, text: str):
         """
@@ -276,6 +655,53 @@ class llmClassifier:
             raise ValueError(f"Invalid JSON: {e}") from e
 
         return obj
+
+    def _load_json_list(self, text: str) -> list:
+        """
+        Packed-mode loader: the list of answer objects in `text`.
+        Accepts a JSON array, an object wrapping one (e.g. {"results": [...]}), or a bare
+        sequence of objects; an array cut short by num_predict keeps its complete objects.
+        Raises ValueError if no object can be recovered.
+        """
+        obj = None
+        t = str(text or "").strip()
+        if t.startswith("```"):
+            t = re.sub(r"^```[^\n]*\n", "", t, count=1)
+            t = re.sub(r"\n```$", "", t, count=1).strip()
+        # only a "[" that opens a list of objects counts as the array ("Answer [1]: ..." does not)
+        for m in re.finditer(r"\[\s*(?=\{|\])", t):
+            try:
+                obj, _ = json.JSONDecoder().raw_decode(t, m.start())
+                break
+            except json.JSONDecodeError:
+                continue  # e.g. cut off by num_predict; salvaged below
+        if obj is None:
+            try:
+                obj = self._load_json_or_raise(t)
+            except ValueError:
+                obj = None
+        if isinstance(obj, list):
+            return obj
+        if isinstance(obj, dict):
+            lists = [v for v in obj.values() if isinstance(v, list)]
+            if len(lists) == 1:
+                return lists[0]
+
+        # salvage: decode objects one after another ({...}, {...} / truncated arrays)
+        t = str(text or "")
+        decoder = json.JSONDecoder()
+        found, pos = [], t.find("{")
+        while pos != -1:
+            try:
+                item, end = decoder.raw_decode(t, pos)
+            except json.JSONDecodeError:
+                break
+            if isinstance(item, dict):
+                found.append(item)
+            pos = t.find("{", end)
+        if not found:
+            raise ValueError("No JSON objects found in packed response")
+        return found
     def _closest_examples(
         self,
         domain: str,
@@ -289,60 +715,7 @@ class llmClassifier:
         - Top up from 'general' if needed
         - If still short, fill with nearest remaining regardless of label
         """
-
-        def scored(pool: List[Tuple[str, dict]]):
-            # list[(q, a, distance)]
-            return sorted(
-                [(q, a, abs(len(q) - target_len)) for (q, a) in pool],
-                key=lambda t: t[2]
-            )
-
-        chosen: List[Tuple[str, dict]] = []
-        already_q: set = set()  # track by question text only
-
-        def take_by_label(scored_list, label_val: int, k: int) -> List[Tuple[str, dict]]:
-            picked: List[Tuple[str, dict]] = []
-            for q, a, _dist in scored_list:
-                if a.get("search_needed") == label_val and q not in already_q:
-                    picked.append((q, a))
-                    already_q.add(q)
-                    if len(picked) == k:
-                        break
-            return picked
-
-        domain_pool = EXAMPLES.get(domain, [])
-        general_pool = EXAMPLES.get("general", [])
-
-        scored_domain = scored(domain_pool)
-        scored_general = scored(general_pool)
-
-        # Try YES/NO from domain
-        yes_picked = take_by_label(scored_domain, 1, need_yes)
-        no_picked  = take_by_label(scored_domain, 0, need_no)
-
-        # Top up from general if short
-        if len(yes_picked) < need_yes:
-            yes_picked += take_by_label(scored_general, 1, need_yes - len(yes_picked))
-        if len(no_picked) < need_no:
-            no_picked  += take_by_label(scored_general, 0, need_no - len(no_picked))
-
-        chosen = yes_picked + no_picked
-
-        # If still < need_yes+need_no, fill with nearest remaining (any label)
-        if len(chosen) < (need_yes + need_no):
-            for q, a, _d in scored_domain + scored_general:
-                if q not in already_q:
-                    chosen.append((q, a))
-                    already_q.add(q)
-                if len(chosen) == (need_yes + need_no):
-                    break
-
-        # Order chosen by global distance (tidy)
-        chosen_scored = sorted(
-            [(q, a, abs(len(q) - target_len)) for (q, a) in chosen],
-            key=lambda t: t[2]
-        )
-        return [(q, a) for (q, a, _d) in chosen_scored]
+        return self.examples.closest(domain, target_len, need_yes, need_no)
 
     def _pick_two_balanced_examples(self, domain: str, target_len: int):
         """
@@ -351,69 +724,7 @@ class llmClassifier:
         Falls back to 'general' then to any domain if needed.
         Returns: List[Tuple[str, dict]]  -> [(question, label_dict), ...]
         """
-        def collect(domain_name: str):
-            # self.EXAMPLES is assumed like: Dict[str, List[Tuple[str, {"search_needed": int, "confidence": float, "reason": str}]]]
-            return EXAMPLES.get(domain_name.lower(), [])
-
-        # Try domain, then 'general', then flatten all
-        pool = collect(domain)
-        if not pool:
-            pool = collect("general")
-        if not pool:
-            # Flatten everything if still empty
-            pool = [item for items in EXAMPLES.values() for item in items]
-
-        # Partition by label
-        yes = []
-        no = []
-        for q, meta in pool:
-            lbl = meta.get("search_needed", 0)
-            (yes if lbl == 1 else no).append((q, meta))
-
-        # Score by closeness to target_len
-        def closest_one(items):
-            if not items:
-                return None
-            return min(items, key=lambda t: abs(len(t[0]) - target_len))
-
-        picked = []
-        y = closest_one(yes)
-        n = closest_one(no)
-        if y:
-            picked.append(y)
-        if n:
-            picked.append(n)
-
-        # If domain didn’t have both, try broader fallback for the missing side(s)
-        if len(picked) < 2:
-            # Build global yes/no pools
-            all_yes = []
-            all_no = []
-            for d_items in EXAMPLES.values():
-                for q, meta in d_items:
-                    (all_yes if meta.get("search_needed", 0) == 1 else all_no).append((q, meta))
-
-            have_yes = any(m.get("search_needed", 0) == 1 for _, m in picked)
-            have_no  = any(m.get("search_needed", 0) == 0 for _, m in picked)
-
-            if not have_yes and all_yes:
-                y2 = min(all_yes, key=lambda t: abs(len(t[0]) - target_len))
-                if y2 and y2 not in picked:
-                    picked.append(y2)
-            if not have_no and all_no:
-                n2 = min(all_no, key=lambda t: abs(len(t[0]) - target_len))
-                if n2 and n2 not in picked:
-                    picked.append(n2)
-
-        # De-dup if somehow same example got chosen twice
-        seen = set()
-        unique = []
-        for q, meta in picked:
-            if q not in seen:
-                unique.append((q, meta))
-                seen.add(q)
-
-        return unique[:2]
+        return self.examples.balanced_pair(domain, target_len)
 
 
     def _build_prompt(self, processed_input: dict, domain_tag: str = "general") -> str:
@@ -425,48 +736,21 @@ class llmClassifier:
         - final question to classify
 
         Expects processed_input['BERT_Input'] to hold the normalized question text.
+        The static part comes from PromptCompiler.prefix(domain_tag) (see stable_prefix).
         """
-        # i have no idea why i added this import but it works so im leaving it
-        import json as _json
-
         question = processed_input["BERT_Input"]
-        qlen = len(question)
-
         # Get balanced two-shot examples (closest length)
-        shots = self._pick_two_balanced_examples(domain_tag, qlen)
-
-        # Only expose the required JSON fields in examples (schema!), but show reason separately
-        def example_block(q, meta):
-            # keep only schema fields in the example JSON
-            ej = {"search_needed": int(meta.get("search_needed", 0)),
-                "confidence": float(meta.get("confidence", 0.0))}
-            reason = meta.get("reason", "")
-            return f"Q: {q}\nA: {_json.dumps(ej, ensure_ascii=False)}\nReason: {reason}"
-
-        examples_str = "\n\n".join(example_block(q, a) for q, a in shots)
-
-        # Build the final instruction
-        return f"""
-    You are a highly accurate text classifier.
-
-    TASK:
-    - Decide if the input question REQUIRES an external web search.
-    - 1 means search needed, 0 means not needed. return as integer.
-    - Output ONLY valid JSON with fields EXACTLY as specified:
-    - "search_needed": 1 or 0
-    - "confidence": float between 0 and 0.7
-
-    RULES:
-    - DO NOT include any field other than the two specified.
-    - Ignore any 'Reason:' lines in the examples; they are for illustration only.
-    - KEEP FORMAT CONSISTENT. ONE line ONLY. THIS EXACT SCHEMA. {{"search_needed":0,"confidence":0.2}}
-    - Heuristics:
-    - 1: needs fresh or volatile info (weather, news, prices, schedules, leadership, “latest”, “current”, release dates).
-    - 0: stable facts, definitions, math, basic programming or best-practice guidance you can answer without lookup.
-    - Confidence: start at 0.50, adjust up/down in 0.05 or 0.10 increments based on certainty.
-    Examples ({domain_tag} domain; closest in length to the input):
-    {examples_str}
-
-    Now classify this:
-    {question}
-    A(PICK THE CORRECT CLASSIFICATION BUT PICK A LOWER CONFIDANCE SCORE):""".strip()
+        shots = self._pick_two_balanced_examples(domain_tag, len(question))
+        return self.prompts.render(question, domain_tag, shots)
+
+    def stable_prefix(self, domain_tag: str = "general") -> Tuple[str, str]:
+        """
+        (system, prompt prefix) shared by every request for `domain_tag`; the server can
+        keep their KV cache between requests because only what follows changes.
+        """
+        return self.system_prompt, self.prompts.prefix(domain_tag)
+
+    def warm_prefix(self, domain_tag: str = "general"):
+        """Evaluates the stable prefix once so the first real request finds it cached."""
+        system, prefix = self.stable_prefix(domain_tag)
+        self.backend.warmup(self.model, prompt=prefix, system=system, options=self.options)
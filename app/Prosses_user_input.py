@@ -75,9 +75,10 @@ class ProssesUserInput:
                 output_dict[row[fieldnames[0]]] = row[fieldnames[1]]
         return output_dict
 
-    def _process_entities(self, user_input: str, standardized_tokens: list):
+    def _process_entities(self, user_input: str, standardized_tokens: list, doc=None):
         """
         Extracts entities from user input and maps them to standardized tokens.
+        Reuses `doc` when the caller already parsed the input.
         """
         useful_entity_labels = [
         "ORG",          # Companies, agencies, institutions
@@ -91,11 +92,13 @@ class ProssesUserInput:
         "NORP",         # Nationalities, religious, or political groups
         "DATE"          # Absolute or relative dates or periods (for experimentation)
      ]
-        self._set_nlp(user_input)
-        
+        if doc is None:
+            self._set_nlp(user_input)
+            doc = self.doc
+
         entities_defs = []
         
-        for word in self.doc.ents:
+        for word in doc.ents:
             # Check if the entity label is in the list of useful labels
             if word.label_ in useful_entity_labels:
                 
@@ -147,25 +150,31 @@ class ProssesUserInput:
 
         return bert_input
 
-    def process_user_input(self, raw_user_input: str):
+    def _empty_result(self):
+        return {
+            "tokenized": [],
+            "standardized": "",
+            "entities": [],
+            "BERT_Input": ""
+        }
+
+    def _process_doc(self, raw_user_input: str, doc):
         """
-        Processes the user query by tokenizing, standardizing, and extracting entities.
+        Runs standardization, entity extraction and segmentation on an already parsed Doc.
         """
+        if self._get_token_processing_limit(raw_user_input) == -1:
+            return self._empty_result()
+
         # Tokenization
-        tokenized_user_input = self._tokenize(raw_user_input)
-        
+        tokenized_user_input = [token.text for token in doc]
+
         if not tokenized_user_input:
-            return {
-                "tokenized": [],
-                "standardized": "",
-                "entities": [],
-                "BERT_Input": ""
-            }
+            return self._empty_result()
         # Standardization
         standardized_input = self._standardize_user_input(tokenized_user_input)
         
-        # Entity Extraction
-        entities_and_indexes = self._process_entities(raw_user_input, standardized_input)
+        # Entity Extraction (same Doc, no second parse)
+        entities_and_indexes = self._process_entities(raw_user_input, standardized_input, doc=doc)
 
         # BERT segmentation
         bert_input = self._bert_segment(standardized_input, entities_and_indexes)
@@ -175,4 +184,29 @@ class ProssesUserInput:
             "standardized": " ".join(standardized_input),
             "entities": entities_and_indexes,
             "BERT_Input": bert_input
-        }
\ No newline at end of file
+        }
+
+    def process_user_input(self, raw_user_input: str):
+        """
+        Processes the user query by tokenizing, standardizing, and extracting entities.
+        """
+        if self._get_token_processing_limit(raw_user_input) == -1:
+            return self._empty_result()
+        self._set_nlp(raw_user_input)
+        return self._process_doc(raw_user_input, self.doc)
+
+    def process_many(self, texts, batch_size: int = 64, n_process: int = 1):
+        """
+        Batch version of process_user_input. Each text is parsed exactly once via nlp.pipe
+        and the resulting dicts are returned in input order.
+        """
+        texts = list(texts)
+        results = [self._empty_result() for _ in texts]
+
+        # Over-limit inputs come back empty anyway, don't spend a parse on them
+        todo = [i for i, t in enumerate(texts) if self._get_token_processing_limit(t) != -1]
+        docs = self.nlp.pipe((texts[i] for i in todo), batch_size=batch_size, n_process=n_process)
+        for i, doc in zip(todo, docs):
+            results[i] = self._process_doc(texts[i], doc)
+
+        return results
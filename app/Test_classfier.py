@@ -1,11 +1,14 @@
+import math
 import random
 import time
 import ollama
 from Llm_classifer_script import llmClassifier as classifier
+from inference_backends import FakeBackend, InferenceBackend, make_backend
+from fast_classifier import CALIBRATION_CSVS, DEFAULT_MODEL_PATH, FastClassifier, load_labeled_csvs
 import os
 import json
 import csv
-from typing import Optional, Dict, Any
+from typing import Optional
 
 
 
@@ -135,7 +138,6 @@ def _test_model(model, system_prompt: Optional[str] = None, options: Optional[di
     dataset = _flatten_labeled_data(labeled_data)
     total_q = len(dataset)
 
-    model_times = []
     start_cpu_time = time.process_time()
 
     no_search_count = 0
@@ -153,7 +155,14 @@ def _test_model(model, system_prompt: Optional[str] = None, options: Optional[di
     #   "delta_confs": [float, ...],   # result_conf - gold_conf for discrepant items
     # }
 
-    for domain, question, gold in dataset:
+    # one batched pass (bulk preprocessing, concurrent model calls, vectorized calibration);
+    # requests overlap, so only the batch wall time is measured, and the per-question figure
+    # is that time amortized over the questions, not a single request's latency
+    batch_start = time.perf_counter()
+    batch_results = classifying_model.classify_batch([q for _, q, _ in dataset])
+    total_time = time.perf_counter() - batch_start
+
+    for (domain, question, gold), result in zip(dataset, batch_results):
         if domain not in per_domain:
             per_domain[domain] = {
                 "results": {},
@@ -164,11 +173,6 @@ def _test_model(model, system_prompt: Optional[str] = None, options: Optional[di
                 "delta_confs": [],
             }
 
-        loop_start = time.perf_counter()
-        result = classifying_model.classify(question)
-        loop_end = time.perf_counter()
-        model_times.append(loop_end - loop_start)
-
         if result is None:
             print("\n\n\n\n")
             print(f"Model returned None for '{question}'")
@@ -180,6 +184,12 @@ def _test_model(model, system_prompt: Optional[str] = None, options: Optional[di
             print("\n\n\n\n")
             return None  # keep your early exit behavior
 
+        if "error" in result:
+            print(f"Classification failed for '{question}': {result['error']}")
+            errors += 1
+            per_domain[domain]["errors"] += 1
+            continue
+
         try:
             if result["search_needed"] == 1:
                 search_count += 1
@@ -209,15 +219,14 @@ def _test_model(model, system_prompt: Optional[str] = None, options: Optional[di
     end_cpu_time = time.process_time()
 
     cpu_time = end_cpu_time - start_cpu_time
-    total_time = sum(model_times)
     avg_conf_overall = (avg_confidence / total_q) if total_q else 0.0
 
     print(f"--- {model} Performance Metrics ---")
     print(f"CPU time for {total_q} questions: {cpu_time:.2f} s")
-    print(f"Total generation time for {total_q} questions: {total_time:.2f} s")
+    print(f"Batch wall time for {total_q} questions: {total_time:.2f} s")
     print()
     print(f"Average CPU time per question: {cpu_time/total_q:.4f} s")
-    print(f"Average generation time per question: {total_time/len(model_times):.4f} s")
+    print(f"Amortized generation time per question: {total_time/total_q:.4f} s")
     print()
     print(f"Questions needing search: {search_count} ({(search_count/total_q)*100:.2f}%)")
     print(f"Questions NOT needing search: {no_search_count} ({(no_search_count/total_q)*100:.2f}%)")
@@ -307,7 +316,7 @@ def _test_model(model, system_prompt: Optional[str] = None, options: Optional[di
         "cpu_time_total": cpu_time,
         "gen_time_total": total_time,
         "cpu_time_avg": cpu_time/total_q if total_q else 0.0,
-        "gen_time_avg": total_time/total_q if total_q else 0.0,
+        "gen_time_amortized": total_time/total_q if total_q else 0.0,
         "search_count": search_count,
         "no_search_count": no_search_count,
         "avg_confidence": avg_conf_overall,
@@ -330,9 +339,9 @@ def _append_metrics_csv(csv_path: str, metrics: dict, fieldnames: list = CSV_HEA
         "total_questions": metrics.get("total_questions"),
         "cpu_time_total": f"{metrics.get('cpu_time_total', 0.0):.6f}",
         "cpu_time_avg": f"{metrics.get('cpu_time_avg', 0.0):.6f}",
-        # map gen_time_* to latency_* in CSV
+        # map gen_time_* to latency_* in CSV (column names kept so old results.csv files still append)
         "latency_total": f"{metrics.get('gen_time_total', 0.0):.6f}",
-        "latency_avg": f"{metrics.get('gen_time_avg', 0.0):.6f}",
+        "latency_avg": f"{metrics.get('gen_time_amortized', 0.0):.6f}",
         "search_count": metrics.get("search_count"),
         "no_search_count": metrics.get("no_search_count"),
         "avg_confidence": f"{metrics.get('avg_confidence', 0.0):.6f}",
@@ -360,8 +369,9 @@ Each row in results.csv corresponds to one model run with one parameter set.
 Columns:
     model              : The Ollama model name (e.g. "phi4-mini-reasoning:3.8b")
     options            : JSON string of decoding options (temperature, top_p, etc.)
-    latency_avg        : Average generation latency per question (seconds)
-    latency_total      : Total latency across all questions (seconds)
+    latency_avg        : Amortized generation time per question: batch wall time / questions
+                         (seconds; requests run concurrently, so not a single request's latency)
+    latency_total      : Wall time of the batched run across all questions (seconds)
     cpu_time_avg       : Average CPU time per question (seconds)
     cpu_time_total     : Total CPU time (seconds)
     discrepancies_total: Number of mismatches between model output and ground truth
@@ -527,11 +537,11 @@ def log_discrepancies(
 
             # Iterate labeled data
             dataset = _flatten_labeled_data(labeled_questions)
-            for domain, question, gold in dataset:
+            batch_results = clf.classify_batch([q for _, q, _ in dataset])
+            for (domain, question, gold), result in zip(dataset, batch_results):
                 ts = time.strftime("%Y-%m-%d %H:%M:%S")
                 try:
-                    result: Dict[str, Any] = clf.classify(question)
-                    if not isinstance(result, dict):
+                    if not isinstance(result, dict) or "error" in result:
                         # Skip malformed returns
                         continue
                     pred_need = result.get("search_needed", None)
@@ -543,7 +553,7 @@ def log_discrepancies(
                     # Only log discrepancies where labels differ and prediction is usable
                     if pred_need is None or gold_need is None:
                         continue
-                    if pred_need != gold_need:
+                    if pred_need == gold_need:
                         continue
 
                     # Confidence deltas (handle None safely)
@@ -575,6 +585,238 @@ def log_discrepancies(
         print(f"[ERROR] Could not write discrepancies CSV '{results_path}': {e}")
         
 
+class _TokenCountingBackend(InferenceBackend):
+    """Wraps a backend and adds up prompt/output token counts from each response."""
+
+    def __init__(self, inner: InferenceBackend):
+        self._inner = inner
+        self.name = inner.name
+        self.max_concurrency = inner.max_concurrency
+        self.supports_logprobs = inner.supports_logprobs
+        self.supports_batch = inner.supports_batch
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.eval_tokens = 0
+
+    def _count(self, response: dict) -> dict:
+        self.calls += 1
+        self.prompt_tokens += int(response.get("prompt_eval_count") or 0)
+        self.eval_tokens += int(response.get("eval_count") or 0)
+        return response
+
+    def generate(self, *args, **kwargs):
+        return self._count(self._inner.generate(*args, **kwargs))
+
+    def generate_batch(self, requests):
+        return [self._count(r) for r in self._inner.generate_batch(requests)]
+
+    def health(self) -> dict:
+        return self._inner.health()
+
+    def cache_identity(self, model: str) -> str:
+        return self._inner.cache_identity(model)
+
+    def ensure_model(self, model: str):
+        self._inner.ensure_model(model)
+
+    def warmup(self, *args, **kwargs):
+        self._inner.warmup(*args, **kwargs)  # not counted
+
+
+def compare_packed_vs_single(
+    model: Optional[str] = None,
+    pack_size: int = 4,
+    labeled_data: Optional[dict] = labeled_questions,
+    gpu: bool = False,
+) -> dict:
+    """
+    Classifies the labeled set once per question (single mode) and once with pack_size
+    questions per generation (packed mode), then prints and returns, per mode: accuracy
+    against the gold labels, errors, wall time, rows/sec, LLM calls and prompt/output
+    tokens per row (as reported by Ollama).
+    """
+    args = [model] if model is not None else []
+    clf = classifier(*args, gpu=gpu)
+    dataset = _flatten_labeled_data(labeled_data)
+    texts = [q for _, q, _ in dataset]
+    domains = [d for d, _, _ in dataset]
+
+    backend = clf.backend
+    metrics = {}
+    for mode, k in (("single", 1), ("packed", pack_size)):
+        clf.pack_size = k
+        counter = clf.backend = _TokenCountingBackend(backend)
+        start = time.perf_counter()
+        results = clf.classify_batch(texts, domains)
+        wall = time.perf_counter() - start
+
+        correct = errors = 0
+        for (_, _, gold), res in zip(dataset, results):
+            if "error" in res:
+                errors += 1
+            elif res["search_needed"] == gold.get("search_needed"):
+                correct += 1
+        n = len(dataset) or 1
+        metrics[mode] = {
+            "pack_size": k,
+            "accuracy": correct / n,
+            "errors": errors,
+            "wall_time": wall,
+            "rows_per_sec": len(dataset) / wall if wall > 0 else 0.0,
+            "llm_calls": counter.calls,
+            "prompt_tokens_per_row": counter.prompt_tokens / n,
+            "eval_tokens_per_row": counter.eval_tokens / n,
+        }
+    clf.backend = backend
+    clf.pack_size = 1
+
+    print(f"--- {clf.model}: single vs packed (K={pack_size}) over {len(dataset)} questions ---")
+    print(f"{'mode':<8}{'acc':>8}{'errors':>8}{'calls':>7}{'rows/s':>9}{'prompt tok/row':>16}{'out tok/row':>13}")
+    for mode, m in metrics.items():
+        print(f"{mode:<8}{m['accuracy']:>8.3f}{m['errors']:>8}{m['llm_calls']:>7}{m['rows_per_sec']:>9.2f}"
+              f"{m['prompt_tokens_per_row']:>16.1f}{m['eval_tokens_per_row']:>13.1f}")
+    return metrics
+
+
+def compare_scoring_modes(model: Optional[str] = None, labeled_data: Optional[dict] = labeled_questions,
+                          gpu: bool = False, offline: bool = False) -> dict:
+    """
+    JSON generation vs single-token logprob scoring on the labeled set. Per mode: accuracy,
+    errors, rows/sec, output tokens per row, and the Brier score / log loss of the calibrated
+    P(search) against the gold labels. offline=True runs both against FakeBackend instead
+    of Ollama (checks the plumbing, not the model).
+    """
+    dataset = _flatten_labeled_data(labeled_data)
+    texts = [q for _, q, _ in dataset]
+    domains = [d for d, _, _ in dataset]
+    gold = [int(g.get("search_needed", 0)) for _, _, g in dataset]
+
+    metrics = {}
+    for scoring in ("json", "logprobs"):
+        counter = _TokenCountingBackend(FakeBackend() if offline else make_backend("ollama"))
+        args = [model] if model is not None else []
+        clf = classifier(*args, gpu=gpu, scoring=scoring, backend=counter)
+
+        start = time.perf_counter()
+        results = clf.classify_batch(texts, domains)
+        wall = time.perf_counter() - start
+
+        ok = [(r, y) for r, y in zip(results, gold) if "error" not in r]
+        p_search = [r["confidence"] if r["search_needed"] == 1 else 1.0 - r["confidence"] for r, _ in ok]
+        ys = [y for _, y in ok]
+        n = len(ok) or 1
+        eps = 1e-6
+        metrics[scoring] = {
+            "accuracy": sum(r["search_needed"] == y for r, y in ok) / (len(dataset) or 1),
+            "errors": len(dataset) - len(ok),
+            "rows_per_sec": len(dataset) / wall if wall > 0 else 0.0,
+            "eval_tokens_per_row": counter.eval_tokens / (len(dataset) or 1),
+            "brier": sum((p - y) ** 2 for p, y in zip(p_search, ys)) / n,
+            "log_loss": -sum(y * math.log(max(p, eps)) + (1 - y) * math.log(max(1 - p, eps))
+                             for p, y in zip(p_search, ys)) / n,
+        }
+
+    print(f"--- scoring modes over {len(dataset)} questions{' (offline)' if offline else ''} ---")
+    print(f"{'mode':<10}{'acc':>8}{'errors':>8}{'rows/s':>9}{'out tok/row':>13}{'brier':>8}{'logloss':>9}")
+    for mode, m in metrics.items():
+        print(f"{mode:<10}{m['accuracy']:>8.3f}{m['errors']:>8}{m['rows_per_sec']:>9.2f}"
+              f"{m['eval_tokens_per_row']:>13.1f}{m['brier']:>8.3f}{m['log_loss']:>9.3f}")
+    return metrics
+
+
+def benchmark_backend(backend: str = "fake", n_rows: int = 2000, latency_sec: float = 0.0,
+                      pack_size: int = 1, scoring: str = "json", max_concurrency: int = 4,
+                      model: Optional[str] = None, model_path: Optional[str] = None) -> dict:
+    """
+    Throughput of classify_batch over n_rows synthetic questions (the labeled set repeated,
+    each copy made distinct) on the given backend. With backend="fake" this needs no model
+    server and measures everything around the model; latency_sec imitates the model.
+    """
+    inner = make_backend(backend, latency_sec=latency_sec, max_concurrency=max_concurrency,
+                         model_path=model_path)
+    counter = _TokenCountingBackend(inner)
+    args = [model] if model is not None else []
+    clf = classifier(*args, backend=counter, pack_size=pack_size, scoring=scoring)
+
+    base = _flatten_labeled_data(labeled_questions)
+    rows = [(d, f"{q} #{i}") for i in range(n_rows // len(base) + 1) for d, q, _ in base][:n_rows]
+
+    start = time.perf_counter()
+    results = clf.classify_batch([q for _, q in rows], [d for d, _ in rows], max_concurrency=max_concurrency)
+    wall = time.perf_counter() - start
+
+    metrics = {
+        "backend": backend,
+        "rows": len(rows),
+        "pack_size": pack_size,
+        "scoring": scoring,
+        "wall_time": wall,
+        "rows_per_sec": len(rows) / wall if wall > 0 else 0.0,
+        "llm_calls": counter.calls,
+        "errors": sum("error" in r for r in results),
+    }
+    print(f"--- {backend}: {metrics['rows']} rows in {wall:.2f} s ({metrics['rows_per_sec']:.1f} rows/s, "
+          f"{counter.calls} calls, {metrics['errors']} errors) ---")
+    return metrics
+
+
+def evaluate_fast_path(fast_model_path: str = DEFAULT_MODEL_PATH,
+                       thresholds=(0.6, 0.7, 0.8, 0.9, 0.95),
+                       model: Optional[str] = None, backend: str = "ollama",
+                       labeled_data: Optional[dict] = labeled_questions, gpu: bool = False) -> dict:
+    """
+    Fast-path cascade vs. LLM only on the labeled set. The LLM labels every question once
+    and the fast model scores every question once; per threshold the cascade takes the
+    fast answer where its confidence reaches the threshold and the LLM's elsewhere.
+    Reports, per threshold, the fraction of rows served by the fast path, the fast model's
+    accuracy on those rows, and cascade accuracy next to full-LLM accuracy.
+    Trains the fast model from the calibration CSVs if `fast_model_path` does not exist.
+    """
+    if os.path.exists(fast_model_path):
+        fast = FastClassifier.load(fast_model_path)
+    else:
+        texts, domains, labels = zip(*load_labeled_csvs(CALIBRATION_CSVS))
+        fast = FastClassifier().fit(texts, labels, domains)
+
+    dataset = _flatten_labeled_data(labeled_data)
+    texts = [q for _, q, _ in dataset]
+    domains = [d for d, _, _ in dataset]
+    gold = [int(g.get("search_needed", 0)) for _, _, g in dataset]
+    n = len(dataset) or 1
+
+    args = [model] if model is not None else []
+    clf = classifier(*args, gpu=gpu, backend=backend)
+    start = time.perf_counter()
+    llm = [r["search_needed"] for r in clf.classify_batch(texts, domains)]
+    llm_time = time.perf_counter() - start
+    start = time.perf_counter()
+    p = fast.predict_proba(texts, domains)
+    fast_time = time.perf_counter() - start
+
+    llm_acc = sum(a == y for a, y in zip(llm, gold)) / n
+    metrics = {"llm_accuracy": llm_acc, "llm_sec_per_row": llm_time / n,
+               "fast_sec_per_row": fast_time / n, "thresholds": {}}
+    print(f"--- fast path vs LLM over {len(dataset)} questions (LLM accuracy {llm_acc:.3f}; "
+          f"{llm_time / n * 1000:.1f} ms/row LLM, {fast_time / n * 1000:.3f} ms/row fast) ---")
+    print(f"{'threshold':>10}{'fast share':>12}{'fast acc':>10}{'cascade acc':>13}")
+    for t in thresholds:
+        served = [max(pi, 1 - pi) >= t for pi in p]
+        fast_pred = [1 if pi >= 0.5 else 0 for pi in p]
+        cascade = [f if s_ else l for f, l, s_ in zip(fast_pred, llm, served)]
+        n_fast = sum(served)
+        fast_acc = (sum(f == y for f, y, s_ in zip(fast_pred, gold, served) if s_) / n_fast) if n_fast else None
+        m = {"fast_fraction": n_fast / n, "fast_accuracy": fast_acc,
+             "cascade_accuracy": sum(c == y for c, y in zip(cascade, gold)) / n}
+        metrics["thresholds"][t] = m
+        print(f"{t:>10.2f}{m['fast_fraction']:>12.1%}"
+              f"{(f'{fast_acc:.3f}' if fast_acc is not None else '-'):>10}{m['cascade_accuracy']:>13.3f}")
+    return metrics
+
+
 # log_discrepancies()
+# compare_packed_vs_single("qwen2.5:0.5b-instruct", pack_size=4, gpu=True)
+# compare_scoring_modes("qwen2.5:0.5b-instruct", gpu=True)
+# benchmark_backend("fake", n_rows=5000, latency_sec=0.01)
+# evaluate_fast_path(thresholds=(0.8, 0.9, 0.95))
 # _test_model("qwen2.5:0.5b-instruct", gpu=True)
 # _test_model("gemma3:270m", gpu=True)
\ No newline at end of file
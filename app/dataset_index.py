@@ -0,0 +1,357 @@
+import csv
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process build lock (single-node dev only)
+    fcntl = None
+
+INDEX_VERSION = 2
+FINGERPRINT_BYTES = 1 << 16  # head and tail bytes hashed into the index fingerprint
+
+# ---------- CSV scanning ----------
+class _LineFeed:
+    """
+    Feeds decoded lines from a binary file to csv.reader while tracking the byte
+    position (and optionally a running hash) of everything consumed so far.
+    csv.reader pulls lines lazily, so after it yields a record `pos` is exactly
+    the byte offset where the next record starts.
+    """
+
+    def __init__(self, f, hasher=None):
+        self.f = f
+        self.hasher = hasher
+        self.pos = f.tell()
+
+    def __iter__(self):
+        for raw in self.f:
+            if self.hasher is not None:
+                self.hasher.update(raw)
+            self.pos += len(raw)
+            yield raw.decode("utf-8")
+
+def _iter_records(f, hasher=None) -> Iterator[Tuple[int, List[str]]]:
+    """Yields (byte_offset, fields) for each non-empty CSV record read from `f`."""
+    feed = _LineFeed(f, hasher)
+    start = feed.pos
+    for fields in csv.reader(feed):
+        if fields:  # csv.DictReader skips blank lines too
+            yield start, fields
+        start = feed.pos
+
+def _column_positions(fieldnames: List[str]) -> Tuple[int, Optional[int]]:
+    if "text" not in fieldnames:
+        raise ValueError("CSV must have a 'text' column.")
+    dom_pos = fieldnames.index("domain") if "domain" in fieldnames else None
+    return fieldnames.index("text"), dom_pos
+
+def _field(fields: List[str], pos: Optional[int]) -> Optional[str]:
+    if pos is None or pos >= len(fields):
+        return None
+    return fields[pos]
+
+def _make_row(fields: List[str], text_pos: int, dom_pos: Optional[int]) -> Dict[str, Optional[str]]:
+    txt = (_field(fields, text_pos) or "").strip()
+    dom = (_field(fields, dom_pos) or "").lower() if dom_pos is not None else None
+    _id = hashlib.sha1(txt.encode("utf-8")).hexdigest()
+    return {"id": _id, "text": txt, "domain": dom}
+
+def _index_key(csv_path: str) -> str:
+    return hashlib.sha1(os.path.abspath(csv_path).encode("utf-8")).hexdigest()[:16]
+
+def _fingerprint(csv_path: str, size: int) -> str:
+    """SHA1 of the size plus the first and last FINGERPRINT_BYTES: catches a replaced CSV with the same size/mtime."""
+    h = hashlib.sha1(str(size).encode("ascii"))
+    with open(csv_path, "rb") as f:
+        h.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            h.update(f.read(FINGERPRINT_BYTES))
+    return h.hexdigest()
+
+def _stat_matches(meta: dict, st, csv_path: str) -> bool:
+    return (meta.get("version") == INDEX_VERSION and meta.get("size") == st.st_size
+            and meta.get("mtime_ns") == st.st_mtime_ns
+            and meta.get("fingerprint") == _fingerprint(csv_path, st.st_size))
+
+def _mkstemp(path: str) -> Tuple[int, str]:
+    # unique per writer: several containers (all PID 1) may share STATE_DIR
+    return tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+
+def _atomic_write(path: str, data: bytes):
+    fd, tmp = _mkstemp(path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+@contextmanager
+def _build_lock(path: str):
+    """Exclusive lock on `path` (a .lock file next to the index) held while one process builds it."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+# ---------- row-offset index ----------
+class CsvRowIndex:
+    """
+    Random access to the rows of a CSV without holding them in memory.
+
+    One pass over the file records the byte offset of every record and the file's
+    SHA1 at the same time. The offsets are persisted under `index_dir` and reused
+    while the CSV's size, mtime and head/tail fingerprint are unchanged; any change
+    triggers a rebuild (and therefore a fresh hash). Nodes sharing `index_dir` build
+    under a file lock, so only one of them scans the CSV. Rows come back as the same
+    {"id", "text", "domain"} dicts node.py always used.
+    """
+
+    def __init__(self, csv_path: str, index_dir: str):
+        self.csv_path = csv_path
+        st = os.stat(csv_path)  # FileNotFoundError propagates to the caller
+        key = _index_key(csv_path)
+        self.meta_path = os.path.join(index_dir, f"rows_{key}.json")
+        self.offsets_path = os.path.join(index_dir, f"rows_{key}.idx")
+
+        meta = self._load_meta(st)
+        if meta is None:
+            with _build_lock(os.path.join(index_dir, f"rows_{key}.lock")):
+                meta = self._load_meta(st)  # another node may have built it while we waited
+                if meta is None:
+                    meta = self._build(st)
+        self.sha1: str = meta["sha1"]
+        self.fieldnames: List[str] = meta["fieldnames"]
+        self.has_domain: bool = "domain" in self.fieldnames
+        self._text_pos, self._dom_pos = _column_positions(self.fieldnames)
+
+    # --- build / load ---
+    def _load_meta(self, st) -> Optional[dict]:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if not _stat_matches(meta, st, self.csv_path):
+                return None
+            offsets = array("Q")
+            with open(self.offsets_path, "rb") as f:
+                offsets.frombytes(f.read())
+            if len(offsets) != meta["rows"]:
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        self.offsets = offsets
+        return meta
+
+    def _build(self, st) -> dict:
+        hasher = hashlib.sha1()
+        offsets = array("Q")
+        with open(self.csv_path, "rb") as f:
+            records = _iter_records(f, hasher)
+            try:
+                _, fieldnames = next(records)
+            except StopIteration:
+                fieldnames = []
+            _column_positions(fieldnames)  # fail fast before scanning millions of rows
+            for off, _fields in records:
+                offsets.append(off)
+
+        meta = {
+            "version": INDEX_VERSION,
+            "csv_path": os.path.abspath(self.csv_path),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "fingerprint": _fingerprint(self.csv_path, st.st_size),
+            "sha1": hasher.hexdigest(),
+            "fieldnames": fieldnames,
+            "rows": len(offsets),
+        }
+        _atomic_write(self.offsets_path, offsets.tobytes())
+        _atomic_write(self.meta_path, json.dumps(meta).encode("utf-8"))
+        self.offsets = offsets
+        return meta
+
+    # --- access ---
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, idx: int) -> Dict[str, Optional[str]]:
+        return self.rows(idx, idx)[0]
+
+    def rows(self, start: int, end: int) -> List[Dict[str, Optional[str]]]:
+        """Materializes rows start..end (inclusive) with one seek and a sequential read."""
+        if start < 0 or end >= len(self.offsets) or start > end:
+            raise IndexError(f"row range {start}-{end} out of bounds (rows={len(self.offsets)})")
+        out: List[Dict[str, Optional[str]]] = []
+        want = end - start + 1
+        with open(self.csv_path, "rb") as f:
+            f.seek(self.offsets[start])
+            for _off, fields in _iter_records(f):
+                out.append(_make_row(fields, self._text_pos, self._dom_pos))
+                if len(out) == want:
+                    break
+        return out
+
+# ---------- columnar, memory-mapped layout ----------
+class ColumnarDataset:
+    """
+    Compact columnar copy of the input CSV behind the same interface as CsvRowIndex.
+
+    Columns live in flat files under `index_dir` and are mmap'd read-only:
+      .text  UTF-8 texts back to back
+      .offs  uint64 offsets into .text (rows + 1 entries)
+      .sha1  20-byte binary SHA1 per row
+      .dom   uint16 domain code per row (codes index meta["domains"])
+    That is ~30 bytes of overhead per row instead of a dict, and several node
+    processes on one host share the same pages through the OS cache.
+    """
+
+    NO_DOMAIN = 0xFFFF
+
+    def __init__(self, csv_path: str, index_dir: str):
+        self.csv_path = csv_path
+        st = os.stat(csv_path)  # FileNotFoundError propagates to the caller
+        base = os.path.join(index_dir, f"cols_{_index_key(csv_path)}")
+        self.meta_path = base + ".json"
+        self._paths = {col: f"{base}.{col}" for col in ("text", "offs", "sha1", "dom")}
+
+        meta = self._load_meta(st)
+        if meta is None:
+            with _build_lock(base + ".lock"):
+                meta = self._load_meta(st)  # another node may have built it while we waited
+                if meta is None:
+                    meta = self._build(st)
+        self.sha1: str = meta["sha1"]
+        self.fieldnames: List[str] = meta["fieldnames"]
+        self.has_domain: bool = "domain" in self.fieldnames
+        self.domains: List[str] = meta["domains"]
+        self._rows: int = meta["rows"]
+        self._open_columns()
+
+    # --- build / load ---
+    def _load_meta(self, st) -> Optional[dict]:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if not _stat_matches(meta, st, self.csv_path):
+                return None
+            n = meta["rows"]
+            expected = {"offs": 8 * (n + 1), "sha1": 20 * n, "dom": 2 * n}
+            for col, size in expected.items():
+                if os.path.getsize(self._paths[col]) != size:
+                    return None
+            if not os.path.exists(self._paths["text"]):
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return meta
+
+    def _build(self, st) -> dict:
+        hasher = hashlib.sha1()
+        offs = array("Q", [0])
+        digests = bytearray()
+        dom_codes = array("H")
+        domains: List[str] = []
+        dom_lookup: Dict[str, int] = {}
+
+        fd, text_tmp = _mkstemp(self._paths["text"])
+        with open(self.csv_path, "rb") as f, os.fdopen(fd, "wb") as text_out:
+            records = _iter_records(f, hasher)
+            try:
+                _, fieldnames = next(records)
+            except StopIteration:
+                fieldnames = []
+            text_pos, dom_pos = _column_positions(fieldnames)
+            for _off, fields in records:
+                raw = (_field(fields, text_pos) or "").strip().encode("utf-8")
+                text_out.write(raw)
+                offs.append(offs[-1] + len(raw))
+                digests += hashlib.sha1(raw).digest()
+                if dom_pos is None:
+                    dom_codes.append(self.NO_DOMAIN)
+                    continue
+                dom = (_field(fields, dom_pos) or "").lower()
+                code = dom_lookup.get(dom)
+                if code is None:
+                    code = dom_lookup[dom] = len(domains)
+                    domains.append(dom)
+                    if code >= self.NO_DOMAIN:
+                        raise ValueError(f"Too many distinct domains (> {self.NO_DOMAIN - 1}).")
+                dom_codes.append(code)
+        os.replace(text_tmp, self._paths["text"])
+
+        _atomic_write(self._paths["offs"], offs.tobytes())
+        _atomic_write(self._paths["sha1"], bytes(digests))
+        _atomic_write(self._paths["dom"], dom_codes.tobytes())
+        meta = {
+            "version": INDEX_VERSION,
+            "csv_path": os.path.abspath(self.csv_path),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "fingerprint": _fingerprint(self.csv_path, st.st_size),
+            "sha1": hasher.hexdigest(),
+            "fieldnames": fieldnames,
+            "domains": domains,
+            "rows": len(dom_codes),
+        }
+        _atomic_write(self.meta_path, json.dumps(meta).encode("utf-8"))
+        return meta
+
+    def _open_columns(self):
+        self._maps = []
+
+        def view(col: str, fmt: str):
+            with open(self._paths[col], "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:  # mmap refuses empty files
+                    return memoryview(b"").cast(fmt)
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.append(m)
+            return memoryview(m).cast(fmt)
+
+        self._text = view("text", "B")
+        self._offs = view("offs", "Q")
+        self._sha1 = view("sha1", "B")
+        self._dom = view("dom", "H")
+
+    # --- access ---
+    def __len__(self) -> int:
+        return self._rows
+
+    def id_digest(self, idx: int) -> bytes:
+        return bytes(self._sha1[20 * idx: 20 * idx + 20])
+
+    def __getitem__(self, idx: int) -> Dict[str, Optional[str]]:
+        if idx < 0 or idx >= self._rows:
+            raise IndexError(f"row {idx} out of bounds (rows={self._rows})")
+        code = self._dom[idx]
+        return {
+            "id": self.id_digest(idx).hex(),
+            "text": bytes(self._text[self._offs[idx]: self._offs[idx + 1]]).decode("utf-8"),
+            "domain": None if code == self.NO_DOMAIN else self.domains[code],
+        }
+
+    def rows(self, start: int, end: int) -> List[Dict[str, Optional[str]]]:
+        if start < 0 or end >= self._rows or start > end:
+            raise IndexError(f"row range {start}-{end} out of bounds (rows={self._rows})")
+        return [self[idx] for idx in range(start, end + 1)]
+
+def open_dataset(csv_path: str, index_dir: str, layout: str = "offsets"):
+    """Returns the dataset for `csv_path` in the requested layout ("offsets" or "columnar")."""
+    if layout == "columnar":
+        return ColumnarDataset(csv_path, index_dir)
+    if layout == "offsets":
+        return CsvRowIndex(csv_path, index_dir)
+    raise ValueError(f"Unknown dataset layout '{layout}' (expected 'offsets' or 'columnar').")
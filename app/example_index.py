@@ -0,0 +1,210 @@
+import csv
+import json
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+Example = Tuple[str, dict]  # (question, {"search_needed", "confidence", "reason"})
+
+# ---------- length-sorted example arrays ----------
+class _LengthIndex:
+    """
+    Examples sorted by (question length, position in the source pool). Walking outward
+    from bisect(target_len) yields them in (|len - target|, position) order, which is
+    exactly what min()/sorted() over the pool with a distance key return, ties included.
+    """
+
+    def __init__(self, items: List[Example]):
+        ranked = sorted(range(len(items)), key=lambda i: (len(items[i][0]), i))
+        self._lens = [len(items[i][0]) for i in ranked]
+        self._order = ranked
+        self._items = [items[i] for i in ranked]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _group(self, start: int) -> range:
+        # positions sharing the length at `start` (already sorted by pool order)
+        end = start
+        while end < len(self._lens) and self._lens[end] == self._lens[start]:
+            end += 1
+        return range(start, end)
+
+    def closest(self, target_len: int) -> Optional[Example]:
+        """Same result as min(pool, key=lambda t: abs(len(t[0]) - target_len))."""
+        if not self._items:
+            return None
+        hi = bisect_left(self._lens, target_len)
+        best = hi if hi < len(self._lens) else None
+        if hi > 0:
+            lo = bisect_left(self._lens, self._lens[hi - 1])  # first item of the next shorter length
+            if best is None:
+                best = lo
+            else:
+                d_lo, d_hi = target_len - self._lens[lo], self._lens[hi] - target_len
+                if d_lo < d_hi or (d_lo == d_hi and self._order[lo] < self._order[hi]):
+                    best = lo
+        return self._items[best]
+
+    def nearest(self, target_len: int) -> Iterator[Example]:
+        """All examples by distance to target_len, ties in pool order (a stable sort by distance)."""
+        hi = bisect_left(self._lens, target_len)
+        lo = hi - 1
+        while lo >= 0 or hi < len(self._lens):
+            d_lo = target_len - self._lens[lo] if lo >= 0 else None
+            d_hi = self._lens[hi] - target_len if hi < len(self._lens) else None
+            group: List[int] = []
+            if d_lo is not None and (d_hi is None or d_lo <= d_hi):
+                g = self._group(bisect_left(self._lens, self._lens[lo]))
+                group += g
+                lo = g.start - 1
+            if d_hi is not None and (d_lo is None or d_hi <= d_lo):
+                g = self._group(hi)
+                group += g
+                hi = g.stop
+            group.sort(key=self._order.__getitem__)
+            for i in group:
+                yield self._items[i]
+
+def _split(items: List[Example], pred: Callable[[dict], bool]) -> _LengthIndex:
+    return _LengthIndex([it for it in items if pred(it[1])])
+
+# ---------- per-domain / per-label index ----------
+class ExampleIndex:
+    """
+    Few-shot example bank compiled once for O(log n) selection by question length.
+
+    For every domain (and for all domains flattened in bank order) it keeps
+    length-sorted arrays of the whole pool and of its yes (search_needed == 1) and
+    no (everything else) examples; the flattened arrays also back the fallback when
+    a domain lacks one side.
+    """
+
+    def __init__(self, bank: Dict[str, List[Example]]):
+        self.bank = bank
+        flat = [it for items in bank.values() for it in items]
+        self._pools = {name: self._compile(items) for name, items in bank.items()}
+        self._all = self._compile(flat)
+        self._empty = self._compile([])
+
+    @staticmethod
+    def _compile(items: List[Example]) -> Dict[str, _LengthIndex]:
+        return {
+            "any": _LengthIndex(items),
+            "yes": _split(items, lambda m: m.get("search_needed", 0) == 1),
+            "no":  _split(items, lambda m: m.get("search_needed", 0) != 1),
+        }
+
+    def __len__(self) -> int:
+        return len(self._all["any"])
+
+    def balanced_pair(self, domain: str, target_len: int) -> List[Example]:
+        """
+        The closest yes and the closest no by question length from `domain`, falling back
+        to 'general' and then to every domain; a side the pool lacks is filled from all
+        domains.
+        """
+        pool = self._pools.get(domain.lower())
+        if not pool or not len(pool["any"]):
+            pool = self._pools.get("general")
+        if not pool or not len(pool["any"]):
+            pool = self._all
+
+        picked = [ex for ex in (pool["yes"].closest(target_len), pool["no"].closest(target_len)) if ex]
+        if len(picked) < 2:
+            have_yes = any(m.get("search_needed", 0) == 1 for _, m in picked)
+            have_no = any(m.get("search_needed", 0) == 0 for _, m in picked)
+            if not have_yes:
+                y2 = self._all["yes"].closest(target_len)
+                if y2 and y2 not in picked:
+                    picked.append(y2)
+            if not have_no:
+                n2 = self._all["no"].closest(target_len)
+                if n2 and n2 not in picked:
+                    picked.append(n2)
+
+        seen, unique = set(), []
+        for ex in picked:
+            if ex[0] not in seen:
+                unique.append(ex)  # the bank's own tuples, not copies
+                seen.add(ex[0])
+        return unique[:2]
+
+    def closest(self, domain: str, target_len: int, need_yes: int = 2, need_no: int = 2) -> List[Example]:
+        """
+        need_yes/need_no examples closest in length: from `domain` first, topped up from
+        'general', then filled with the nearest remaining of any label; ordered by distance.
+        """
+        dom = self._pools.get(domain, self._empty)
+        gen = self._pools.get("general", self._empty)
+        taken: set = set()
+
+        def take(index: _LengthIndex, label_val: int, k: int) -> List[Example]:
+            picked: List[Example] = []
+            if k <= 0:
+                return picked
+            for ex in index.nearest(target_len):
+                q, a = ex
+                if a.get("search_needed") == label_val and q not in taken:
+                    picked.append(ex)
+                    taken.add(q)
+                    if len(picked) == k:
+                        break
+            return picked
+
+        yes = take(dom["yes"], 1, need_yes)
+        no = take(dom["no"], 0, need_no)
+        yes += take(gen["yes"], 1, need_yes - len(yes))
+        no += take(gen["no"], 0, need_no - len(no))
+        chosen = yes + no
+
+        want = need_yes + need_no
+        for index in (dom["any"], gen["any"]):
+            if len(chosen) >= want:
+                break
+            for ex in index.nearest(target_len):
+                if ex[0] not in taken:
+                    chosen.append(ex)
+                    taken.add(ex[0])
+                if len(chosen) == want:
+                    break
+
+        return sorted(chosen, key=lambda t: abs(len(t[0]) - target_len))
+
+# ---------- loading larger banks ----------
+def load_examples(path: str) -> Dict[str, List[Example]]:
+    """
+    Loads an example bank shaped like EXAMPLES from:
+      .json   {"domain": [[question, {"search_needed", "confidence", "reason"}], ...], ...}
+      .jsonl  one {"domain", "text", "search_needed", "confidence", "reason"} object per line
+      .csv    the same columns as .jsonl
+    Domains are lower-cased; examples keep file order within a domain.
+    """
+    bank: Dict[str, List[Example]] = {}
+
+    def add(row: dict):
+        text = (row.get("text") or row.get("question") or "").strip()
+        if not text:
+            return
+        meta = {"search_needed": int(float(row.get("search_needed") or 0)),
+                "confidence": float(row.get("confidence") or 0.0),
+                "reason": row.get("reason") or ""}
+        bank.setdefault((row.get("domain") or "general").strip().lower(), []).append((text, meta))
+
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        for domain, items in raw.items():
+            for q, meta in items:
+                bank.setdefault(domain.lower(), []).append((q, dict(meta)))
+    elif path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    add(json.loads(line))
+    elif path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                add(row)
+    else:
+        raise ValueError(f"Unsupported example bank format: {path} (expected .json, .jsonl or .csv)")
+    return bank
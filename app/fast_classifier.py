@@ -0,0 +1,240 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import pickle
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from shard_store import open_shard
+
+try:
+    from sklearn.calibration import CalibratedClassifierCV
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import FeatureUnion, make_pipeline
+except ImportError:  # optional; only needed to train or use the fast path
+    LogisticRegression = None
+
+CALIBRATION_CSVS = {
+    "general":     os.path.join("app", "app_data", "Calibration_data", "general_labled.csv"),
+    "programming": os.path.join("app", "app_data", "Calibration_data", "programing_labled.csv"),
+}
+DEFAULT_MODEL_PATH = os.path.join("app", "app_data", "fast_classifier.pkl")
+MODEL_VERSION = 1
+
+def _normalize(text: str, domain: Optional[str]) -> str:
+    # the domain becomes one more token, so the model can learn per-domain priors
+    return f"__domain_{(domain or 'general').lower()}__ " + " ".join(str(text).lower().split())
+
+# ---------- training data ----------
+def load_labeled_csvs(domain_to_csv: Dict[str, str]) -> List[Tuple[str, str, int]]:
+    """(text, domain, search_needed) rows from the calibration CSVs (text, search_needed, ...)."""
+    rows = []
+    for domain, path in domain_to_csv.items():
+        if not os.path.exists(path):
+            print(f"[fast] skipping missing CSV {path}")
+            continue
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for r in csv.DictReader(f):
+                text = (r.get("text") or "").strip()
+                if text and r.get("search_needed") not in (None, ""):
+                    rows.append((text, domain, 1 if int(float(r["search_needed"])) == 1 else 0))
+    return rows
+
+def load_gold(paths: Iterable[str], min_confidence: float = 0.0) -> List[Tuple[str, str, int]]:
+    """
+    (text, domain, label_id) rows from gold.jsonl and/or label shards (raw, .gz or .zst;
+    globs allowed). Rows below `min_confidence` are skipped: they are the LLM's least
+    certain labels and the noisiest to distil from.
+    """
+    rows = []
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if not os.path.exists(path):
+                print(f"[fast] skipping missing gold file {path}")
+                continue
+            with open_shard(path) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    text = rec.get("text")
+                    if not text or rec.get("label_id") is None:
+                        continue
+                    if float(rec.get("confidence") or 0.0) < min_confidence:
+                        continue
+                    rows.append((text, rec.get("domain") or "general", 1 if int(rec["label_id"]) == 1 else 0))
+    return rows
+
+# ---------- model ----------
+class FastClassifier:
+    """
+    Hashed word (1-2) and character (3-5) n-grams into a logistic regression, with
+    sigmoid-calibrated probabilities (5-fold CalibratedClassifierCV when both classes have
+    enough rows). Hashing keeps the model a fixed size and needs no vocabulary, so it
+    trains in seconds and scores thousands of rows per second on one core.
+    """
+
+    def __init__(self, n_features: int = 1 << 20, C: float = 4.0):
+        if LogisticRegression is None:
+            raise RuntimeError("the fast path needs the 'scikit-learn' package")
+        self.n_features = int(n_features)
+        self.C = float(C)
+        self.model = None
+        self.meta: dict = {}
+
+    def _pipeline(self):
+        features = FeatureUnion([
+            ("word", HashingVectorizer(analyzer="word", ngram_range=(1, 2), n_features=self.n_features,
+                                       alternate_sign=False)),
+            ("char", HashingVectorizer(analyzer="char_wb", ngram_range=(3, 5), n_features=self.n_features,
+                                       alternate_sign=False)),
+        ])
+        return make_pipeline(features, LogisticRegression(C=self.C, max_iter=2000, class_weight="balanced"))
+
+    def fit(self, texts: Sequence[str], labels: Sequence[int], domains: Optional[Sequence[str]] = None):
+        domains = domains or ["general"] * len(texts)
+        X = [_normalize(t, d) for t, d in zip(texts, domains)]
+        y = np.asarray(labels, dtype=int)
+        minority = int(min((y == 0).sum(), (y == 1).sum()))
+        if minority == 0:
+            raise ValueError("training data needs both labels")
+        if minority >= 10:
+            self.model = CalibratedClassifierCV(self._pipeline(), method="sigmoid", cv=5).fit(X, y)
+        else:  # too few rows to hold any out; fall back to the regression's own probabilities
+            self.model = self._pipeline().fit(X, y)
+        self.meta = {"rows": len(X), "positives": int(y.sum()), "calibrated": minority >= 10}
+        return self
+
+    def predict_proba(self, texts: Sequence[str], domains: Optional[Sequence[str]] = None) -> np.ndarray:
+        """P(search needed) per text."""
+        if self.model is None:
+            raise RuntimeError("FastClassifier is not trained")
+        if not len(texts):
+            return np.zeros(0)
+        domains = domains or ["general"] * len(texts)
+        return self.model.predict_proba([_normalize(t, d) for t, d in zip(texts, domains)])[:, 1]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"version": MODEL_VERSION, "n_features": self.n_features, "C": self.C,
+                         "meta": self.meta, "model": self.model}, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "FastClassifier":
+        with open(path, "rb") as f:
+            obj = pickle.load(f)
+        if obj.get("version") != MODEL_VERSION:
+            raise ValueError(f"{path}: unsupported fast classifier version {obj.get('version')}")
+        fc = cls(obj["n_features"], obj["C"])
+        fc.model, fc.meta = obj["model"], obj.get("meta", {})
+        return fc
+
+# ---------- cascade ----------
+class CascadeClassifier:
+    """
+    Fast path in front of an llmClassifier: rows whose fast-model confidence
+    (max(p, 1 - p)) reaches `threshold` are answered locally, the rest go to the LLM.
+    Same classify_batch / classify_iter interface and result dicts as llmClassifier; fast
+    answers also carry "source": "fast". Running totals are in stats().
+    """
+
+    def __init__(self, fast: FastClassifier, llm, threshold: float = 0.9):
+        self.fast = fast
+        self.llm = llm
+        self.threshold = float(threshold)
+        self._lock = threading.Lock()
+        self._rows = 0
+        self._fast_rows = 0
+
+    def classify(self, user_input: str, domain_tag: str = "general") -> dict:
+        return self.classify_batch([user_input], [domain_tag])[0]
+
+    def classify_batch(self, texts: Sequence[str], domains: Optional[Sequence[Optional[str]]] = None,
+                       chunk_size: int = 64, max_concurrency: int = 4, executor=None) -> List[dict]:
+        domains = list(domains) if domains is not None else []
+        items = ((t, domains[i] if i < len(domains) else None) for i, t in enumerate(texts))
+        return list(self.classify_iter(items, chunk_size, max_concurrency, executor))
+
+    def classify_iter(self, items: Iterable[Tuple[str, Optional[str]]], chunk_size: int = 64,
+                      max_concurrency: int = 4, executor=None) -> Iterator[dict]:
+        """
+        Scores each chunk with the fast model, hands the uncertain rows to
+        llm.classify_iter (which keeps its own pipelining) and yields in input order.
+        """
+        chunk_size = max(1, chunk_size)
+        fast_results: List[Optional[dict]] = []  # None = waiting for the LLM, in input order
+        items = iter(items)
+
+        def score_chunks():
+            # runs lazily inside llm.classify_iter's pull loop; fills fast_results as it goes
+            while True:
+                chunk = []
+                for text, domain in items:
+                    chunk.append((text, domain or "general"))
+                    if len(chunk) == chunk_size:
+                        break
+                if not chunk:
+                    return
+                p = self.fast.predict_proba([t for t, _ in chunk], [d for _, d in chunk])
+                for (text, domain), ps in zip(chunk, p):
+                    conf = max(ps, 1.0 - ps)
+                    if conf >= self.threshold:
+                        fast_results.append({"search_needed": 1 if ps >= 0.5 else 0,
+                                             "confidence": float(conf), "source": "fast"})
+                    else:
+                        fast_results.append(None)
+                        yield text, domain
+                with self._lock:
+                    self._rows += len(chunk)
+                    self._fast_rows += sum(1 for r in fast_results[-len(chunk):] if r is not None)
+
+        llm_results = self.llm.classify_iter(score_chunks(), chunk_size, max_concurrency, executor)
+        pos = 0
+        for llm_result in llm_results:
+            # emit fast answers queued before this deferred row, then the row itself
+            while fast_results[pos] is not None:
+                yield fast_results[pos]
+                pos += 1
+            yield llm_result
+            pos += 1
+        yield from fast_results[pos:]
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows, fast = self._rows, self._fast_rows
+        return {"threshold": self.threshold, "rows": rows, "fast_rows": fast, "llm_rows": rows - fast,
+                "fast_fraction": fast / rows if rows else 0.0}
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Train the fast-path classifier from the labeled CSVs and gold output.")
+    ap.add_argument("--out", default=DEFAULT_MODEL_PATH, help="where to write the model")
+    ap.add_argument("--gold", action="append", default=[],
+                    help="gold.jsonl or label shards (glob ok); repeatable")
+    ap.add_argument("--min-confidence", type=float, default=0.0,
+                    help="skip gold rows the LLM labeled below this confidence")
+    ap.add_argument("--no-csvs", action="store_true", help="train on gold only")
+    a = ap.parse_args(argv)
+
+    rows = [] if a.no_csvs else load_labeled_csvs(CALIBRATION_CSVS)
+    n_csv = len(rows)
+    rows += load_gold(a.gold, a.min_confidence)
+    if not rows:
+        raise SystemExit("no training rows")
+    texts, domains, labels = zip(*rows)
+    fc = FastClassifier().fit(texts, labels, domains)
+    fc.save(a.out)
+    print(f"[fast] trained on {len(rows)} rows ({n_csv} from CSVs, {len(rows) - n_csv} from gold, "
+          f"{fc.meta['positives']} search) -> {a.out}")
+
+if __name__ == "__main__":
+    main()
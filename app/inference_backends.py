@@ -0,0 +1,245 @@
+import hashlib
+import inspect
+import os
+import threading
+import time
+from typing import List, Optional
+
+from local_client import LocalClient
+
+try:
+    import ollama
+except ImportError:  # optional; only needed for backend="ollama"
+    ollama = None
+
+try:
+    import llama_cpp
+except ImportError:  # optional; only needed for backend="llamacpp"
+    llama_cpp = None
+
+# ---------- interface ----------
+class InferenceBackend:
+    """
+    What llmClassifier needs from a model runtime.
+
+    generate() takes Ollama-style arguments (model, prompt, system, options with
+    num_predict / temperature / top_p / top_k / repeat_penalty / format, plus logprobs and
+    top_logprobs) and returns an Ollama-shaped mapping: "response", "done_reason",
+    "prompt_eval_count", "eval_count" and, when asked for, "logprobs"
+    ([{"token", "logprob", "top_logprobs": [{"token", "logprob"}, ...]}, ...]).
+    """
+
+    name = "base"
+    max_concurrency = 1         # requests worth having in flight at once
+    supports_logprobs = False
+    supports_batch = False      # generate_batch beats the same generate() calls one by one
+
+    def generate(self, model: str, prompt: str, system: str = "", options: Optional[dict] = None,
+                 logprobs: bool = False, top_logprobs: int = 0) -> dict:
+        raise NotImplementedError
+
+    def generate_batch(self, requests: List[dict]) -> List[dict]:
+        """generate(**r) for every request (keyword dicts), results in request order."""
+        return [self.generate(**r) for r in requests]
+
+    def health(self) -> dict:
+        return {"backend": self.name, "ok": True}
+
+    def cache_identity(self, model: str) -> str:
+        """Names what actually answers for `model`; results cached under one identity never serve another."""
+        return f"{self.name}:{model}"
+
+    def ensure_model(self, model: str):
+        """Makes `model` available (download / load); raises if it can't be."""
+
+    def warmup(self, model: str, prompt: str = "", system: str = "", options: Optional[dict] = None):
+        """Runs one request so weights (and a shared prompt prefix, if given) are loaded before real traffic."""
+        self.generate(model=model, prompt=prompt, system=system, options=dict(options or {}, num_predict=1))
+
+# ---------- Ollama (HTTP) ----------
+class OllamaBackend(InferenceBackend):
+    """The Ollama server, through the ollama package (the module-level client unless `host` is given)."""
+
+    name = "ollama"
+
+    def __init__(self, host: Optional[str] = None, max_concurrency: int = 4):
+        if ollama is None:
+            raise RuntimeError("backend='ollama' needs the 'ollama' package")
+        self.client = ollama.Client(host=host) if host else ollama
+        self.max_concurrency = max(1, int(max_concurrency))
+        params = inspect.signature(self.client.generate).parameters
+        self.supports_logprobs = "logprobs" in params or any(p.kind is p.VAR_KEYWORD for p in params.values())
+
+    def generate(self, model: str, prompt: str, system: str = "", options: Optional[dict] = None,
+                 logprobs: bool = False, top_logprobs: int = 0):
+        kwargs = {"model": model, "prompt": prompt, "system": system}
+        if options is not None:
+            kwargs["options"] = options
+        if logprobs:
+            kwargs.update(logprobs=True, top_logprobs=top_logprobs)
+        return self.client.generate(**kwargs)
+
+    def cache_identity(self, model: str) -> str:
+        return model  # the plain model name, as before backends existed, so existing caches stay valid
+
+    def health(self) -> dict:
+        try:
+            models = self.client.list()
+        except Exception as e:
+            return {"backend": self.name, "ok": False, "error": str(e)}
+        return {"backend": self.name, "ok": True, "models": len(models.get("models") or [])}
+
+    def ensure_model(self, model: str):
+        try:
+            self.client.show(model=model)
+        except ollama.ResponseError:
+            print(f"Model '{model}' not found locally. Installing now...")
+            self.client.pull(model)
+            print(f"Model '{model}' installed successfully.\n")
+
+    def warmup(self, model: str, prompt: str = "", system: str = "", options: Optional[dict] = None):
+        if not prompt and options is None:
+            self.client.generate(model=model, prompt="")  # loads the model without generating
+        else:
+            super().warmup(model, prompt, system, options)
+
+# ---------- llama.cpp (in-process) ----------
+def _file_fingerprint(path: str, nbytes: int = 1 << 20) -> str:
+    # size plus the first MiB (GGUF header and metadata): cheap even for multi-GB weights
+    h = hashlib.sha1(str(os.path.getsize(path)).encode("ascii"))
+    with open(path, "rb") as f:
+        h.update(f.read(nbytes))
+    return h.hexdigest()[:16]
+
+class LlamaCppBackend(InferenceBackend):
+    """
+    A GGUF model run in this process through llama-cpp-python: no server, no HTTP or JSON
+    round trip per row. One model per backend, so the `model` argument of generate() is
+    ignored. Calls are serialized (a llama.cpp context is not thread-safe); generate_batch
+    runs its requests back to back under one lock, so nothing interleaves with them and
+    llama.cpp keeps reusing the KV cache of their shared prompt prefix.
+
+    llama.cpp only returns logprobs when the model keeps logits for every position
+    (logits_all), which costs memory and some speed, so that is opt-in: pass logprobs=True
+    for scoring="logprobs".
+    """
+
+    name = "llamacpp"
+    max_concurrency = 1
+    supports_batch = True
+
+    def __init__(self, model_path: str, n_ctx: int = 4096, n_threads: Optional[int] = None,
+                 n_gpu_layers: int = 0, seed: int = 0, logprobs: bool = False):
+        if llama_cpp is None:
+            raise RuntimeError("backend='llamacpp' needs the 'llama-cpp-python' package")
+        if not model_path or not os.path.exists(model_path):
+            raise RuntimeError(f"llama.cpp model file not found: {model_path!r}")
+        self.model_path = model_path
+        self._identity = f"{self.name}:{os.path.basename(model_path)}:{_file_fingerprint(model_path)}"
+        self.supports_logprobs = bool(logprobs)
+        self._lock = threading.Lock()
+        self.llm = llama_cpp.Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads,
+                                   n_gpu_layers=n_gpu_layers, seed=seed, logits_all=self.supports_logprobs,
+                                   verbose=False)
+
+    def generate(self, model: str, prompt: str, system: str = "", options: Optional[dict] = None,
+                 logprobs: bool = False, top_logprobs: int = 0) -> dict:
+        with self._lock:
+            return self._generate(prompt, system, options, logprobs, top_logprobs)
+
+    def generate_batch(self, requests: List[dict]) -> List[dict]:
+        with self._lock:
+            return [self._generate(r["prompt"], r.get("system", ""), r.get("options"),
+                                   r.get("logprobs", False), r.get("top_logprobs", 0)) for r in requests]
+
+    def _generate(self, prompt: str, system: str, options: Optional[dict], logprobs: bool,
+                  top_logprobs: int) -> dict:
+        # caller holds self._lock
+        options = options or {}
+        messages = ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": prompt}]
+        kwargs = {
+            "messages": messages,
+            "max_tokens": int(options.get("num_predict", 128)),
+            "temperature": float(options.get("temperature", 0.8)),
+            "top_p": float(options.get("top_p", 0.95)),
+            "top_k": int(options.get("top_k", 40)),
+            "repeat_penalty": float(options.get("repeat_penalty", 1.1)),
+        }
+        if options.get("format") == "json":
+            kwargs["response_format"] = {"type": "json_object"}
+        if logprobs:
+            if not self.supports_logprobs:
+                raise RuntimeError("LlamaCppBackend was built without logprobs=True")
+            kwargs.update(logprobs=True, top_logprobs=max(1, int(top_logprobs)))
+        out = self.llm.create_chat_completion(**kwargs)
+
+        choice = out["choices"][0]
+        usage = out.get("usage") or {}
+        response = {
+            "model": self.model_path,
+            "response": choice["message"].get("content") or "",
+            "done": True,
+            "done_reason": choice.get("finish_reason") or "stop",
+            "prompt_eval_count": usage.get("prompt_tokens", 0),
+            "eval_count": usage.get("completion_tokens", 0),
+        }
+        content = (choice.get("logprobs") or {}).get("content")
+        if logprobs and content:
+            response["logprobs"] = [{"token": t["token"], "logprob": t["logprob"],
+                                     "top_logprobs": [{"token": a["token"], "logprob": a["logprob"]}
+                                                      for a in t.get("top_logprobs") or []]}
+                                    for t in content]
+        return response
+
+    def cache_identity(self, model: str) -> str:
+        return self._identity  # the GGUF file answers, whatever `model` says
+
+    def health(self) -> dict:
+        return {"backend": self.name, "ok": True, "model_path": self.model_path}
+
+# ---------- deterministic fake ----------
+class FakeBackend(InferenceBackend):
+    """
+    No model at all: answers come from local_client.LocalClient (keyword scoring, stable per
+    question), optionally after `latency_sec` per request to imitate a model. For tests and
+    offline benchmarks of everything around the model (preprocessing, batching, cache,
+    calibration, shard writing).
+    """
+
+    name = "fake"
+    supports_logprobs = True
+
+    def __init__(self, latency_sec: float = 0.0, max_concurrency: int = 4, supports_batch: bool = False):
+        self.latency_sec = float(latency_sec)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.supports_batch = bool(supports_batch)  # to exercise the classifier's batch path
+        self.calls = 0
+        self._client = LocalClient()
+        self._lock = threading.Lock()
+
+    def generate(self, model: str, prompt: str, system: str = "", options: Optional[dict] = None,
+                 logprobs: bool = False, top_logprobs: int = 0) -> dict:
+        with self._lock:
+            self.calls += 1
+        if self.latency_sec > 0:
+            time.sleep(self.latency_sec)
+        return self._client.generate(model=model, prompt=prompt, system=system, options=options,
+                                     logprobs=logprobs, top_logprobs=top_logprobs)
+
+    def health(self) -> dict:
+        return {"backend": self.name, "ok": True, "calls": self.calls}
+
+# ---------- factory ----------
+BACKENDS = ("ollama", "llamacpp", "fake")
+
+def make_backend(name: str = "ollama", **kwargs) -> InferenceBackend:
+    """
+    Backend by name. Keyword arguments go to its constructor: host / max_concurrency
+    (ollama), model_path / n_ctx / n_threads / n_gpu_layers / logprobs (llamacpp), latency_sec /
+    max_concurrency / supports_batch (fake); ones that don't apply are ignored.
+    """
+    cls = {"ollama": OllamaBackend, "llamacpp": LlamaCppBackend, "fake": FakeBackend}.get(name)
+    if cls is None:
+        raise ValueError(f"Unknown backend {name!r} (expected one of {', '.join(BACKENDS)})")
+    accepted = inspect.signature(cls.__init__).parameters
+    return cls(**{k: v for k, v in kwargs.items() if k in accepted and v is not None})
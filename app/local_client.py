@@ -0,0 +1,81 @@
+import json
+import math
+import re
+import zlib
+from typing import List, Optional
+
+# ---------- offline stand-in for the ollama client ----------
+# Words that usually mean the answer changes over time (the prompt's own heuristics) and
+# phrasings that usually mean a self-contained answer.
+_FRESH = ("weather", "news", "price", "prices", "latest", "current", "currently", "today",
+          "tomorrow", "tonight", "schedule", "release", "released", "ceo", "president",
+          "revenue", "stock", "score", "election", "version", "2024", "2025", "2026",
+          "who is", "when is", "where is", "how many", "record")
+_STABLE = ("what is", "what are", "define", "definition", "explain", "how to", "how do",
+           "why does", "meaning of", "difference between", "i feel", "my ", "should i")
+
+_SINGLE_Q = re.compile(r"classify this:\n\s*(.*?)\n\s*A[(:]", re.S)
+_PACKED_Q = re.compile(r"^\s*\d+\.\s(.*)$", re.M)
+
+def search_probability(question: str) -> float:
+    """Deterministic P(search needed) from keywords, with a small per-question jitter."""
+    q = " ".join(question.lower().split())
+    score = 0.9 * sum(w in q for w in _FRESH) - 0.8 * sum(w in q for w in _STABLE)
+    jitter = (zlib.crc32(q.encode("utf-8")) % 1000) / 1000.0 - 0.5  # [-0.5, 0.5)
+    return 1.0 / (1.0 + math.exp(-(score + 0.6 * jitter)))
+
+class LocalClient:
+    """
+    Stands in for the ollama module when no model server is available (tests, dry runs):
+    generate() answers classification prompts from search_probability() instead of a model.
+
+    Mirrors the response fields the classifier reads: "response", "done_reason",
+    "prompt_eval_count"/"eval_count" (approximate) and, when asked with logprobs=True,
+    "logprobs" for the first generated token with its top alternatives ("1" / "0").
+    Single, packed (JSON array) and single-token label prompts are recognised.
+    """
+
+    def show(self, model: str):
+        return {"model": model}
+
+    def pull(self, model: str):
+        return {"status": "success"}
+
+    def generate(self, model: str = "", prompt: str = "", system: str = "",
+                 options: Optional[dict] = None, logprobs: bool = False,
+                 top_logprobs: int = 0, **_):
+        options = options or {}
+        packed = _PACKED_Q.findall(prompt) if "separately" in prompt else []
+        single = _SINGLE_Q.search(prompt)
+        questions: List[str] = packed or ([single.group(1)] if single else [])
+        probs = [search_probability(q) for q in questions]
+
+        if options.get("num_predict") == 1:
+            p = probs[0] if probs else 0.5
+            token = "1" if p >= 0.5 else "0"
+            text = token
+        elif packed:
+            text = json.dumps([self._answer(p) for p in probs], separators=(",", ":"))
+        else:
+            text = json.dumps(self._answer(probs[0]), separators=(",", ":")) if probs else ""
+
+        response = {
+            "model": model,
+            "response": text,
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": (len(system) + len(prompt)) // 4,
+            "eval_count": max(1, len(text) // 3) if text else 0,
+        }
+        if logprobs and options.get("num_predict") == 1:
+            p = min(max(probs[0] if probs else 0.5, 1e-6), 1 - 1e-6)
+            alts = sorted([{"token": "1", "logprob": math.log(p)},
+                           {"token": "0", "logprob": math.log(1 - p)}],
+                          key=lambda a: -a["logprob"])
+            chosen = alts[0]
+            response["logprobs"] = [dict(chosen, top_logprobs=alts[:max(1, top_logprobs)])]
+        return response
+
+    @staticmethod
+    def _answer(p: float) -> dict:
+        return {"search_needed": 1 if p >= 0.5 else 0, "confidence": round(max(p, 1 - p), 2)}
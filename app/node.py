@@ -1,12 +1,19 @@
-import argparse, csv, hashlib, json, os, socket, sys, threading, time, glob, datetime
+import argparse, hashlib, json, os, re, socket, sys, threading, time, zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import List, Optional, Dict
 import httpx
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 import signal
 from Llm_classifer_script import llmClassifier as classifier
+from inference_backends import BACKENDS, make_backend
+from fast_classifier import CascadeClassifier, FastClassifier
+from dataset_index import open_dataset
+from work_claims import ClaimSizer, LeaseTable
+from shard_store import ShardManifest, ShardWriter
 # Custom LLM classifer api, constructor needs no arugments at initlization (unless gpu is enabled) call with classifer.classify(question , domain-defult is general)
 # returns dict with {"search_needed": int 0 or 1, "confidence": float 0-1.0}
 
@@ -15,7 +22,29 @@ DEFAULT_BATCH = int(os.getenv("BATCH", "128"))
 HEARTBEAT_SEC = float(os.getenv("HEARTBEAT_SEC", "1.0"))
 STALE_SEC     = float(os.getenv("STALE_SEC", "5.0"))
 REPL_INTERVAL = float(os.getenv("REPL_INTERVAL", "10.0"))
+REPL_FACTOR   = int(os.getenv("REPL_FACTOR", "0"))     # copies of each shard beyond the producer's; 0 = every node
 PEER_TIMEOUT  = float(os.getenv("PEER_TIMEOUT", "2.0"))
+PEER_MAX_CONN = int(os.getenv("PEER_MAX_CONN", "4"))     # pooled keep-alive connections per peer
+PEER_ROUND_DEADLINE = float(os.getenv("PEER_ROUND_DEADLINE", os.getenv("PEER_TIMEOUT", "2.0")))  # max wait per poll round
+CONCURRENCY   = int(os.getenv("CONCURRENCY", "1"))     # in-flight LLM requests per node
+PREPROC_BATCH = int(os.getenv("PREPROC_BATCH", "16"))  # rows per nlp.pipe batch in process_range
+PACK_SIZE     = int(os.getenv("PACK_SIZE", "1"))       # questions per LLM generation (1 = one prompt per row)
+SCORING       = os.getenv("SCORING", "json")            # json | logprobs (one label token, P from logprobs)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000000"))
+CLAIM_TARGET_SEC = float(os.getenv("CLAIM_TARGET_SEC", "30.0"))  # wall time a claim should take
+CLAIM_MIN     = int(os.getenv("CLAIM_MIN", "8"))
+CLAIM_MAX     = int(os.getenv("CLAIM_MAX", "4096"))
+LEASE_SEC     = float(os.getenv("LEASE_SEC", "60.0"))  # claim lease; workers renew every LEASE_SEC/3
+LEASE_SYNC_SEC = float(os.getenv("LEASE_SYNC_SEC", "15.0"))  # followers re-mirror the leader's leases this often
+SHARD_GROUP_ROWS  = int(os.getenv("SHARD_GROUP_ROWS", "256"))     # group commit: rows ...
+SHARD_GROUP_BYTES = int(os.getenv("SHARD_GROUP_BYTES", "1048576")) # ... or bytes ...
+SHARD_GROUP_SEC   = float(os.getenv("SHARD_GROUP_SEC", "1.0"))     # ... or age of oldest buffered row
+SHARD_FSYNC       = os.getenv("SHARD_FSYNC", "range")              # none | group | range
+SHARD_MAX_ROWS    = int(os.getenv("SHARD_MAX_ROWS", "50000"))      # rotate shards by rows ...
+SHARD_MAX_BYTES   = int(os.getenv("SHARD_MAX_BYTES", str(64 << 20)))  # ... size ...
+SHARD_MAX_SEC     = float(os.getenv("SHARD_MAX_SEC", "60.0"))      # ... or age
+SHARD_COMPRESSION = os.getenv("SHARD_COMPRESSION", "none")         # none | gzip | zstd (applied when sealing)
+SHARD_ARROW       = os.getenv("SHARD_ARROW", "0") == "1"           # also write an Arrow IPC copy of sealed shards
 
 # ---------------- CLI ----------------------------
 parser = argparse.ArgumentParser()
@@ -24,6 +53,9 @@ parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8001")))
 parser.add_argument("--peers", default=os.getenv("PEERS", "node1:8001"))
 parser.add_argument("--worker-id", default=os.getenv("WORKER_ID"))
 parser.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+parser.add_argument("--backend", choices=list(BACKENDS), default=os.getenv("BACKEND", "ollama"))
+parser.add_argument("--layout", choices=["offsets","columnar"], default=os.getenv("DATASET_LAYOUT","offsets"))
 parser.add_argument("--mode", choices=["auto","server","client"], default=os.getenv("MODE","auto"))
 parser.add_argument("--prefer-leader", action="store_true")
 args = parser.parse_args()
@@ -32,6 +64,7 @@ WORKER_ID = args.worker_id or f"{socket.gethostname()}:{args.port}"
 PEERS: List[str] = [p.strip() for p in args.peers.split(",") if p.strip()]
 CSV_PATH = args.csv
 BATCH_SIZE = args.batch
+LLM_CONCURRENCY = max(1, args.concurrency)
 
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/output")
 STATE_DIR  = os.getenv("STATE_DIR",  "/state")
@@ -43,8 +76,29 @@ os.makedirs(REPL_DIR,   exist_ok=True)
 
 RESULTS_BASENAME = f"labels_{WORKER_ID.replace(':','_')}"
 STATE_PATH       = os.path.join(STATE_DIR,  f"state_{WORKER_ID.replace(':','_')}.json")
-
-clf = classifier(gpu = True)
+MANIFEST_PATH    = os.path.join(OUTPUT_DIR, f"manifest_{WORKER_ID.replace(':','_')}.jsonl")
+REPL_STATE_PATH  = os.path.join(REPL_DIR,   f"cursors_{WORKER_ID.replace(':','_')}.json")
+HELD_PATH        = os.path.join(REPL_DIR,   f"held_{WORKER_ID.replace(':','_')}.jsonl")
+
+CACHE_PATH = os.getenv("CACHE_PATH", os.path.join(STATE_DIR, "llm_cache.sqlite"))  # "" disables
+EXAMPLES_PATH = os.getenv("EXAMPLES_PATH") or None  # few-shot bank (.json/.jsonl/.csv); built-in if unset
+LLAMA_MODEL_PATH = os.getenv("LLAMA_MODEL_PATH")       # GGUF file for --backend llamacpp
+LLAMA_THREADS = int(os.getenv("LLAMA_THREADS", "0")) or None
+FAKE_LATENCY_SEC = float(os.getenv("FAKE_LATENCY_SEC", "0"))  # --backend fake: simulated model time
+FAST_PATH_MODEL = os.getenv("FAST_PATH_MODEL", "")           # trained fast_classifier.py model; "" = LLM only
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.9"))  # fast-model confidence that skips the LLM
+
+backend = make_backend(args.backend, max_concurrency=LLM_CONCURRENCY, model_path=LLAMA_MODEL_PATH,
+                       n_threads=LLAMA_THREADS, logprobs=SCORING == "logprobs", latency_sec=FAKE_LATENCY_SEC)
+clf = classifier(gpu = True, cache_path=CACHE_PATH or None, cache_max_entries=CACHE_MAX_ENTRIES,
+                 examples_path=EXAMPLES_PATH, pack_size=PACK_SIZE,
+                 scoring=SCORING, backend=backend)
+# rows the fast model is sure about skip the LLM
+fast_path = (CascadeClassifier(FastClassifier.load(FAST_PATH_MODEL), clf, FAST_PATH_THRESHOLD)
+             if FAST_PATH_MODEL else None)
+labeler = fast_path or clf
+# more threads than the backend can serve at once would only queue inside it
+llm_pool = ThreadPoolExecutor(max_workers=min(LLM_CONCURRENCY, backend.max_concurrency), thread_name_prefix="llm")
 # -------------- Graceful stop ---------------------
 stop_flag = {"stop": False}
 def handle_sig(*_): stop_flag["stop"] = True
@@ -52,40 +106,29 @@ signal.signal(signal.SIGINT, handle_sig)
 signal.signal(signal.SIGTERM, handle_sig)
 
 # -------------- Load CSV ---------------------
-DATA: List[Dict[str, str]] = []
+# Rows are read on demand through an index persisted in STATE_DIR; the CSV's SHA1 is
+# computed in the same pass that builds it. "offsets" seeks into the CSV itself,
+# "columnar" keeps an mmap'd compact copy (shared between processes on one host).
 try:
-    with open(CSV_PATH, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        if "text" not in (reader.fieldnames or []):
-            print("CSV must have a 'text' column.", file=sys.stderr); sys.exit(1)
-        has_domain = "domain" in (reader.fieldnames or [])
-        for row in reader:
-            txt = (row["text"] or "").strip()
-            dom = (row["domain"] or "").lower() if has_domain else None
-            _id = hashlib.sha1(txt.encode("utf-8")).hexdigest()
-            DATA.append({"id": _id, "text": txt, "domain": dom})
-except FileNotFoundError:
-    print(f"CSV not found at {CSV_PATH}", file=sys.stderr); sys.exit(1)
-
-# after loading CSV_PATH, before "loaded N rows" print:
-import hashlib
-
-def _sha1_file(path):
-    h = hashlib.sha1()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1024*1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-CSV_SHA1 = _sha1_file(CSV_PATH)
-
-
-N = len(DATA)
-print(f"[{WORKER_ID}] loaded {N} rows (domain col present: {has_domain})")
+    DATASET = open_dataset(CSV_PATH, STATE_DIR, args.layout)
+except FileNotFoundError as e:
+    msg = f"CSV not found at {CSV_PATH}" if not os.path.isfile(CSV_PATH) else f"Dataset index error: {e}"
+    print(msg, file=sys.stderr); sys.exit(1)
+except ValueError as e:
+    print(str(e), file=sys.stderr); sys.exit(1)
+has_domain = DATASET.has_domain
+CSV_SHA1 = DATASET.sha1
+
+N = len(DATASET)
+print(f"[{WORKER_ID}] loaded {N} rows (domain col present: {has_domain}, layout: {args.layout})")
 print(f"[{WORKER_ID}] CSV path={CSV_PATH} sha1={CSV_SHA1} rows={N}")
 
 # -------------- State -----------------------------
-state_lock = threading.Lock()
+# --batch is the size for workers the leader has no throughput estimate for yet
+claim_sizer = ClaimSizer(BATCH_SIZE, target_sec=CLAIM_TARGET_SEC, min_size=CLAIM_MIN, max_size=CLAIM_MAX)
+leases = LeaseTable(LEASE_SEC)
+
+state_lock = threading.RLock()  # save_state() is called with the lock already held
 state = {
     "worker_id": WORKER_ID,
     "current_index": 0,    # furthest end+1 processed locally
@@ -94,6 +137,8 @@ state = {
     "last_heartbeat": 0.0,
     "known_leader": None,
     "next_index": 0,       # leader-only pointer
+    # leader: its lease table; follower: last mirrored copy of the leader's (None until synced)
+    "lease_table": None,
 }
 
 def save_state():
@@ -115,22 +160,35 @@ def load_state():
             print(f"[{WORKER_ID}] failed to load state: {e}")
 load_state()
 
-# -------------- Shards (minute rotation) ----------
-def minute_stamp(ts=None):
-    dt = datetime.datetime.utcfromtimestamp(ts or time.time())
-    return dt.strftime("%Y%m%dT%H%M")  # minute granularity
-
-def shard_name(worker_id: str, stamp: str):
-    wid = worker_id.replace(":","_")
-    return f"labels_{wid}_{stamp}.jsonl"
-
-def current_local_shard_path() -> str:
-    return os.path.join(OUTPUT_DIR, shard_name(WORKER_ID, minute_stamp()))
-
-def list_completed_local_shards() -> List[str]:
-    cur = os.path.basename(current_local_shard_path())
-    files = [os.path.basename(p) for p in glob.glob(os.path.join(OUTPUT_DIR, "labels_*.jsonl"))]
-    return sorted([f for f in files if f != cur])
+def become_leader(fallback_next: int):
+    """
+    Caller holds state_lock. Adopts the persisted/mirrored lease table if there is one,
+    so only unacknowledged ranges are handed out again; otherwise restarts from fallback_next.
+    """
+    state["leader"] = True
+    state["epoch"] += 1
+    if state.get("lease_table") is not None:
+        leases.load(state["lease_table"])
+        leases.extend_all()  # give live workers time to find the new leader and renew
+    else:
+        leases.load(None)
+        state["next_index"] = fallback_next
+    state["lease_table"] = leases.to_dict()
+
+# -------------- Shards (size/rows/time rotation) --
+# Sealed shards are listed in MANIFEST_PATH (name, rows, bytes, sha256, idx range);
+# /shards serves that list instead of globbing OUTPUT_DIR.
+manifest = ShardManifest(MANIFEST_PATH)
+# only worker_loop's thread writes; replication_loop just triggers time-based rotation
+shard_writer = ShardWriter(OUTPUT_DIR, RESULTS_BASENAME, manifest,
+                           group_rows=SHARD_GROUP_ROWS, group_bytes=SHARD_GROUP_BYTES,
+                           group_sec=SHARD_GROUP_SEC, fsync=SHARD_FSYNC,
+                           max_rows=SHARD_MAX_ROWS, max_bytes=SHARD_MAX_BYTES, max_sec=SHARD_MAX_SEC,
+                           compression=SHARD_COMPRESSION, arrow_sidecar=SHARD_ARROW)
+
+# replicas this node holds in REPL_DIR (producer's manifest entry + "producer"); advertised
+# in /shards so a shard stays pullable from its replicas after the producer is gone
+held = ShardManifest(HELD_PATH)
 
 # -------------- API schema ------------------------
 class Status(BaseModel):
@@ -144,6 +202,8 @@ class ClaimResp(BaseModel):
     epoch: int
     start: int
     end: int
+    lease_id: str = ""
+    deadline: float = 0.0
 
 # -------------- FastAPI app -----------------------
 app = FastAPI()
@@ -166,13 +226,26 @@ def progress():
     all_idx = alive + [my_idx]
     max_idx = max(all_idx) if all_idx else my_idx
     pct = (max_idx / max(1, N)) * 100.0
-    return {"rows_total": N, "max_current_index": max_idx, "percent_done": round(pct, 2)}
+    with state_lock:
+        workers = claim_sizer.stats() if state["leader"] else None
+    return {"rows_total": N, "max_current_index": max_idx, "percent_done": round(pct, 2),
+            "cache": clf.cache.stats() if clf.cache else None, "workers": workers}
+
+@app.get("/metrics")
+def metrics():
+    return {"heartbeat": dict(heartbeat_metrics), "heartbeat_sec": HEARTBEAT_SEC,
+            "peer_round_deadline": PEER_ROUND_DEADLINE,
+            "fast_path": fast_path.stats() if fast_path else None}
 
 @app.get("/ping")
 def ping():
     with state_lock:
         return {"ok": True, "epoch": state["epoch"], "leader": state["leader"], "id": state["worker_id"]}
 
+@app.get("/backend")
+def backend_health():
+    return clf.backend.health()
+
 @app.get("/status", response_model=Status)
 def get_status():
     with state_lock:
@@ -180,53 +253,217 @@ def get_status():
                       epoch=state["epoch"], leader=state["leader"], ts=time.time())
 
 @app.post("/claim", response_model=ClaimResp)
-def claim():
+def claim(worker: Optional[str] = None):
     with state_lock:
         if not state["leader"]:
             raise HTTPException(status_code=423, detail="Not leader")
-        start = state["next_index"]
-        if start >= N:
+        for lease in leases.expire():
+            print(f"[{WORKER_ID}] lease {lease['lease_id']} of {lease['worker']} expired; will reassign")
+        remaining = max(0, N - state["next_index"]) + leases.orphan_rows()
+        if remaining <= 0:
             raise HTTPException(status_code=204, detail="No work")
-        end = min(N - 1, start + BATCH_SIZE - 1)
-        state["next_index"] = end + 1
+        size = claim_sizer.next_size(worker, remaining)
+        # expired ranges go out again before any fresh rows
+        rng = leases.take_orphan(size)
+        if rng is None:
+            start = state["next_index"]
+            end = min(N - 1, start + size - 1)
+            state["next_index"] = end + 1
+        else:
+            start, end = rng
+        claim_sizer.record_claim(worker, end - start + 1)
+        lease = leases.grant(start, end, worker, state["epoch"])
+        state["lease_table"] = leases.to_dict()
         save_state()
-        print(f"[{WORKER_ID}] claim -> {start}-{end}")
-        return ClaimResp(epoch=state["epoch"], start=start, end=end)
+        print(f"[{WORKER_ID}] claim -> {start}-{end} ({worker or 'unknown'})")
+        return ClaimResp(epoch=state["epoch"], start=start, end=end,
+                         lease_id=lease["lease_id"], deadline=lease["deadline"])
+
+@app.post("/renew")
+def renew(lease_id: str, worker: Optional[str] = None):
+    with state_lock:
+        if not state["leader"]:
+            raise HTTPException(status_code=423, detail="Not leader")
+        lease = leases.renew(lease_id, worker)
+        if lease is None:
+            raise HTTPException(status_code=404, detail="unknown lease or not its holder")
+        return {"lease_id": lease_id, "deadline": lease["deadline"]}
+
+@app.post("/complete")
+def complete(lease_id: str, worker: Optional[str] = None):
+    with state_lock:
+        if not state["leader"]:
+            raise HTTPException(status_code=423, detail="Not leader")
+        lease = leases.complete(lease_id, worker)
+        state["lease_table"] = leases.to_dict()
+        save_state()
+        # unknown ids / other holders are fine: the range expired and went to someone else
+        return {"lease_id": lease_id, "known": lease is not None}
+
+@app.get("/leases")
+def get_leases():
+    with state_lock:
+        if not state["leader"]:
+            raise HTTPException(status_code=423, detail="Not leader")
+        return {"epoch": state["epoch"], "next_index": state["next_index"], **leases.to_dict()}
 
 # advertise completed shards only (immutable)
+# ?since=<cursor> returns only shards sealed after that manifest seq;
+# ?replicas_since=<cursor> does the same for the replicas this node holds
 @app.get("/shards")
-def shards():
-    return {"files": list_completed_local_shards()}
-
-# allow streaming shard by name
+def shards(since: int = 0, replicas_since: int = 0):
+    entries = manifest.entries(since)
+    all_entries = manifest.entries()
+    cursor = all_entries[-1]["seq"] if all_entries else 0
+    held_entries = held.entries()
+    return {"worker_id": WORKER_ID, "files": [e["name"] for e in entries], "shards": entries, "cursor": cursor,
+            "replicas": held.entries(replicas_since),
+            "replicas_cursor": held_entries[-1]["seq"] if held_entries else 0}
+
+_RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)$")
+
+def _gzip_stream(path: str):
+    # one gzip stream compressed on the fly; the client decodes it transparently
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024*256), b""):
+            out = z.compress(chunk)
+            if out: yield out
+    yield z.flush()
+
+# allow streaming shard by name; honours "Range: bytes=start-[end]" for resumed pulls.
+# Raw (uncompressed) shards are gzip'd on the fly for full-body requests that accept it;
+# sealed .gz/.zst shards are already compressed and go out as stored.
 @app.get("/pull")
-def pull(name: str):
+def pull(name: str, request: Request):
     if "/" in name or "\\" in name:
         raise HTTPException(status_code=400, detail="bad name")
     path = os.path.join(OUTPUT_DIR, name)
     if not os.path.isfile(path):
+        path = os.path.join(REPL_DIR, name)  # replicas we hold are served too
+    if not os.path.isfile(path) or name.endswith(".tmp"):
         raise HTTPException(status_code=404, detail="not found")
+    size = os.path.getsize(path)
+    start, end, status = 0, size - 1, 200
+    headers = {"Accept-Ranges": "bytes"}
+    rng = request.headers.get("range")
+    if (not rng and name.endswith(".jsonl") and size > 0
+            and "gzip" in request.headers.get("accept-encoding", "").lower()):
+        headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+        return StreamingResponse(_gzip_stream(path), headers=headers, media_type="application/octet-stream")
+    if rng:
+        m = _RANGE_RE.match(rng.strip())
+        if not m or int(m.group(1)) >= max(size, 1):
+            raise HTTPException(status_code=416, detail="bad range", headers={"Content-Range": f"bytes */{size}"})
+        start = int(m.group(1))
+        end = min(size - 1, int(m.group(2))) if m.group(2) else size - 1
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(max(0, end - start + 1))
     def it():
         with open(path, "rb") as f:
-            while True:
-                chunk = f.read(1024*256)
+            f.seek(start)
+            left = end - start + 1
+            while left > 0:
+                chunk = f.read(min(1024*256, left))
                 if not chunk: break
+                left -= len(chunk)
                 yield chunk
-    return StreamingResponse(it(), media_type="application/octet-stream")
+    return StreamingResponse(it(), status_code=status, headers=headers, media_type="application/octet-stream")
+
+# -------------- HTTP (pooled, keep-alive) ---------
+# One long-lived client per peer, shared by heartbeat, claims, leases and replication,
+# so steady-state gossip reuses TCP connections instead of reconnecting every call.
+_http_lock = threading.Lock()
+_http_clients: Dict[str, httpx.Client] = {}
+
+def peer_client(peer: str) -> httpx.Client:
+    base = peer if peer.startswith("http") else f"http://{peer}"
+    with _http_lock:
+        cli = _http_clients.get(base)
+        if cli is None:
+            cli = httpx.Client(base_url=base, timeout=PEER_TIMEOUT,
+                               limits=httpx.Limits(max_connections=PEER_MAX_CONN,
+                                                   max_keepalive_connections=PEER_MAX_CONN,
+                                                   keepalive_expiry=30.0))
+            _http_clients[base] = cli
+        return cli
+
+def close_http_clients():
+    with _http_lock:
+        for cli in _http_clients.values():
+            cli.close()
+        _http_clients.clear()
 
 # -------------- Gossip & election -----------------
 peer_status: Dict[str, Status] = {}
+peer_urls: Dict[str, str] = {}  # worker_id -> host:port it answered on
 
 def poll_peer_status(peer_url: str):
     try:
-        with httpx.Client(timeout=PEER_TIMEOUT) as cli:
-            r = cli.get(f"http://{peer_url}/status")
-            if r.status_code == 200:
-                st = Status(**r.json())
-                peer_status[st.worker_id] = st
+        r = peer_client(peer_url).get("/status")
+        if r.status_code == 200:
+            st = Status(**r.json())
+            peer_status[st.worker_id] = st
+            peer_urls[st.worker_id] = peer_url
+    except Exception:
+        pass
+
+def sync_lease_table(leader_id: Optional[str]):
+    # followers mirror the leader's lease table so a promotion can pick up where it left off
+    url = peer_urls.get(leader_id) if leader_id else None
+    if not url or leader_id == WORKER_ID:
+        return
+    try:
+        r = peer_client(url).get("/leases")
+        if r.status_code == 200:
+            d = r.json()
+            with state_lock:
+                if not state["leader"]:
+                    state["next_index"] = d["next_index"]
+                    state["lease_table"] = {"leases": d["leases"], "orphans": d["orphans"]}
     except Exception:
         pass
 
+# The mirror is fetched off the heartbeat thread: a dead or slow leader must not stall the
+# round, and it is only refreshed when the leader changes or every LEASE_SYNC_SEC.
+lease_sync_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lease-sync")
+_lease_sync = {"leader": None, "at": 0.0, "fut": None}
+
+def maybe_sync_lease_table(leader_id: Optional[str]):
+    s = _lease_sync
+    if s["fut"] is not None and not s["fut"].done():
+        return
+    now = time.time()
+    if leader_id == s["leader"] and now - s["at"] < LEASE_SYNC_SEC:
+        return
+    s["leader"], s["at"] = leader_id, now
+    s["fut"] = lease_sync_pool.submit(sync_lease_table, leader_id)
+
+# Peers are polled concurrently; a round waits at most PEER_ROUND_DEADLINE, so one dead
+# peer costs the heartbeat its own timeout instead of adding it to everyone else's.
+poll_pool = ThreadPoolExecutor(max_workers=max(1, len(PEERS)), thread_name_prefix="poll")
+_polls_in_flight: Dict[str, Future] = {}
+heartbeat_metrics = {"rounds": 0, "round_sec_last": 0.0, "round_sec_avg": 0.0, "round_sec_max": 0.0}
+
+def poll_all_peers():
+    futs = []
+    for p in PEERS:
+        prev = _polls_in_flight.get(p)
+        if prev is not None and not prev.done():
+            continue  # still waiting on last round's request; don't queue another
+        _polls_in_flight[p] = fut = poll_pool.submit(poll_peer_status, p)
+        futs.append(fut)
+    if futs:
+        wait(futs, timeout=PEER_ROUND_DEADLINE)
+
+def record_heartbeat_round(sec: float):
+    m = heartbeat_metrics
+    m["rounds"] += 1
+    m["round_sec_last"] = round(sec, 4)
+    m["round_sec_avg"] = round(sec if m["rounds"] == 1 else 0.9 * m["round_sec_avg"] + 0.1 * sec, 4)
+    m["round_sec_max"] = round(max(m["round_sec_max"], sec), 4)
+
 def alive_peers() -> Dict[str, Status]:
     now = time.time()
     return {wid: st for wid, st in peer_status.items() if now - st.ts <= STALE_SEC}
@@ -244,14 +481,13 @@ def elect_leader() -> str:
 def heartbeat_loop():
     if args.mode == "auto" and args.prefer_leader:
         with state_lock:
-            state["leader"] = True
-            state["epoch"] += 1
-            state["next_index"] = state["current_index"]
+            become_leader(state["current_index"])
             print(f"[{WORKER_ID}] prefer-leader boot; epoch={state['epoch']}")
             save_state()
     while not stop_flag["stop"]:
-        if args.mode in ("auto","client"):
-            for p in PEERS: poll_peer_status(p)
+        round_start = time.perf_counter()
+        # every mode polls: election needs it, and replication placement needs peer ids/liveness
+        poll_all_peers()
         now = time.time()
         if args.mode == "auto":
             winner = elect_leader()
@@ -259,11 +495,9 @@ def heartbeat_loop():
                 was_leader = state["leader"]
                 if winner == state["worker_id"]:
                     if not state["leader"]:
-                        state["leader"] = True
-                        state["epoch"] += 1
                         ap = alive_peers().values()
                         min_idx = min([state["current_index"]] + [st.current_index for st in ap]) if ap else state["current_index"]
-                        state["next_index"] = min_idx
+                        become_leader(min_idx)
                         print(f"[{WORKER_ID}] PROMOTED leader; epoch={state['epoch']} next_index={state['next_index']}")
                         save_state()
                 else:
@@ -271,12 +505,12 @@ def heartbeat_loop():
                     state["leader"] = False
                     state["known_leader"] = winner
                 state["last_heartbeat"] = now
+            if winner != WORKER_ID:
+                maybe_sync_lease_table(winner)
         elif args.mode == "server":
             with state_lock:
                 if not state["leader"]:
-                    state["leader"] = True
-                    state["epoch"] += 1
-                    state["next_index"] = state["current_index"]
+                    become_leader(state["current_index"])
                     print(f"[{WORKER_ID}] MANUAL leader; epoch={state['epoch']}")
                     save_state()
                 state["last_heartbeat"] = now
@@ -286,52 +520,93 @@ def heartbeat_loop():
                 state["leader"] = False
                 state["known_leader"] = winner
                 state["last_heartbeat"] = now
-        time.sleep(HEARTBEAT_SEC)
+            maybe_sync_lease_table(winner)
+        elapsed = time.perf_counter() - round_start
+        record_heartbeat_round(elapsed)
+        time.sleep(max(0.0, HEARTBEAT_SEC - elapsed))
 
 # -------------- Worker + labeling -----------------
 def process_range(start: int, end: int):
-    shard_path = current_local_shard_path()
-    with open(shard_path, "a", encoding="utf-8") as out:
-        for idx in range(start, end + 1):
-            rec = DATA[idx]
-            txt = rec["text"]
-            dom = rec["domain"]
-
-            # If domain is present, pass it; else call without
-            result = clf.classify(txt, dom) if dom else clf.classify(txt)
-
-            label_id  = int(result.get("search_needed", 0))
-            confidence = float(result.get("confidence", 0.5))
-            label     = "search" if label_id == 1 else "no-search"
-
-            out.write(json.dumps({
-                "id": rec["id"],
-                "idx": idx,
-                "text": txt,
-                "domain": dom or "general",  # fill in for consistency
-                "label": label,
-                "label_id": label_id,
-                "confidence": confidence,
-                "worker": WORKER_ID,
-                "ts": time.time()
-            }, ensure_ascii=False) + "\n")
-            out.flush()
+    # classify_iter pipelines the range: it preprocesses a chunk while up to LLM_CONCURRENCY
+    # requests from earlier chunks are in flight and yields results in idx order.
+    chunk = max(PREPROC_BATCH, LLM_CONCURRENCY * PACK_SIZE)
+    recs = deque()  # records handed to the classifier, not yet written
+
+    def items():
+        for lo in range(start, end + 1, chunk):
+            for rec in DATASET.rows(lo, min(end, lo + chunk - 1)):
+                recs.append(rec)
+                yield rec["text"], rec["domain"] or "general"
+
+    def write_one(idx, rec, result):
+        if result.get("retryable"):
+            # model unreachable: leave the range unfinished so its lease is handed out again
+            raise RuntimeError(f"classification failed at idx {idx}: {result['error']}")
+        dom = rec["domain"]
+
+        label_id  = int(result.get("search_needed", 0))
+        confidence = float(result.get("confidence", 0.5))
+        label     = "search" if label_id == 1 else "no-search"
+
+        shard_writer.write({
+            "id": rec["id"],
+            "idx": idx,
+            "text": rec["text"],
+            "domain": dom or "general",  # fill in for consistency
+            "label": label,
+            "label_id": label_id,
+            "confidence": confidence,
+            "worker": WORKER_ID,
+            "ts": time.time()
+        })
+
+    results = labeler.classify_iter(items(), chunk_size=chunk, executor=llm_pool)
+    for idx, result in zip(range(start, end + 1), results):
+        write_one(idx, recs.popleft(), result)
+
+    # progress only moves once the range's records are durable (per SHARD_FSYNC)
+    shard_writer.end_range()
 
     with state_lock:
         state["current_index"] = max(state["current_index"], end + 1)
         save_state()
 
+pending_acks: List[str] = []  # lease ids finished locally, not yet acknowledged by a leader
+
+def current_leader_url() -> Optional[str]:
+    with state_lock:
+        if state["leader"] and args.mode != "client":
+            return f"http://127.0.0.1:{args.port}"
+        winner = state.get("known_leader")
+    peer = peer_urls.get(winner) if winner else None
+    return f"http://{peer}" if peer else None
+
+def leader_post(path: str, **params) -> Optional[httpx.Response]:
+    url = current_leader_url()
+    if not url:
+        return None
+    try:
+        return peer_client(url).post(path, params=params)
+    except Exception:
+        return None
+
+def renew_lease_loop(lease_id: str, done: threading.Event):
+    # follows leader changes, so a new leader that adopted the lease keeps it alive
+    while not done.wait(LEASE_SEC / 3):
+        leader_post("/renew", lease_id=lease_id, worker=WORKER_ID)
+
+def flush_acks():
+    while pending_acks:
+        r = leader_post("/complete", lease_id=pending_acks[0], worker=WORKER_ID)
+        if r is None or r.status_code != 200:
+            return  # retried before the next claim
+        pending_acks.pop(0)
+
 def worker_loop():
+    failures = 0  # consecutive failed ranges, for the backoff
     while not stop_flag["stop"]:
-        wid_to_url: Dict[str,str] = {}
-        for p in PEERS:
-            try:
-                with httpx.Client(timeout=PEER_TIMEOUT) as cli:
-                    r = cli.get(f"http://{p}/status")
-                    if r.status_code == 200:
-                        st = Status(**r.json()); wid_to_url[st.worker_id] = p; peer_status[st.worker_id] = st
-            except Exception: pass
-
+        flush_acks()
+        # peer_status / peer_urls are kept fresh by heartbeat_loop; no re-polling per claim
         with state_lock:
             i_am_leader = state["leader"]
         if args.mode == "client": i_am_leader = False
@@ -340,58 +615,185 @@ def worker_loop():
             url = f"http://127.0.0.1:{args.port}"
         else:
             winner = elect_leader() if args.mode != "server" else state.get("known_leader")
-            if not winner or winner not in wid_to_url:
+            if not winner or winner not in peer_urls:
                 time.sleep(0.5); continue
-            url = f"http://{wid_to_url[winner]}"
+            url = f"http://{peer_urls[winner]}"
 
         try:
-            with httpx.Client(timeout=5.0) as cli:
-                r = cli.post(f"{url}/claim")
-                if r.status_code in (204, 423):
-                    time.sleep(0.5); continue
-                r.raise_for_status()
-                payload = ClaimResp(**r.json()); start, end = payload.start, payload.end
+            r = peer_client(url).post("/claim", params={"worker": WORKER_ID}, timeout=5.0)
+            if r.status_code in (204, 423):
+                time.sleep(0.5); continue
+            r.raise_for_status()
+            payload = ClaimResp(**r.json()); start, end = payload.start, payload.end
         except Exception:
             time.sleep(0.5); continue
 
-        process_range(start, end)
+        done = threading.Event()
+        if payload.lease_id:
+            threading.Thread(target=renew_lease_loop, args=(payload.lease_id, done), daemon=True).start()
+        error = None
+        try:
+            process_range(start, end)
+        except Exception as e:
+            error = e
+        finally:
+            done.set()
+        if error is not None:
+            # not acked and no longer renewed: the lease expires and the range is handed out again
+            failures += 1
+            print(f"[{WORKER_ID}] range {start}-{end} failed ({error}); backing off")
+            time.sleep(min(LEASE_SEC, 0.5 * 2 ** min(failures, 8)))
+            continue
+        failures = 0
+        if payload.lease_id:
+            pending_acks.append(payload.lease_id)
+        flush_acks()
         time.sleep(0.01)
 
+# -------------- Replica placement -----------------
+# Each shard goes to REPL_FACTOR nodes picked by rendezvous hashing of its name over the
+# live members (producer excluded), so every node computes the same owners without
+# coordination, and a member leaving only moves the shards it owned.
+def replica_owners(shard_name: str, producer: str, members) -> List[str]:
+    cands = sorted(m for m in members if m != producer)
+    if REPL_FACTOR <= 0:
+        return cands
+    cands.sort(key=lambda m: hashlib.sha1(f"{shard_name}|{m}".encode("utf-8")).digest(), reverse=True)
+    return cands[:REPL_FACTOR]
+
+def cluster_members() -> List[str]:
+    return sorted(set(alive_peers()) | {WORKER_ID})
+
+def _members_fingerprint(members: List[str]) -> int:
+    return int(hashlib.sha1(",".join(members).encode("utf-8")).hexdigest()[:12], 16)
+
 # -------------- Replication -----------------------
-def list_peer_shards(peer_url: str) -> List[str]:
+# Each peer is asked only for shards sealed after our cursor into its manifest, and
+# interrupted downloads resume from the size of their .tmp file via HTTP Range.
+# Full-body pulls of raw shards arrive gzip-encoded and are decoded by httpx, so the
+# .tmp always holds the shard's stored bytes and Range offsets stay valid.
+def load_repl_cursors() -> Dict[str, int]:
     try:
-        with httpx.Client(timeout=PEER_TIMEOUT) as cli:
-            r = cli.get(f"http://{peer_url}/shards")
-            if r.status_code == 200:
-                return r.json().get("files", [])
+        with open(REPL_STATE_PATH, "r", encoding="utf-8") as f:
+            return {k: int(v) for k, v in json.load(f).items()}
+    except Exception:
+        return {}
+
+def save_repl_cursors(cursors: Dict[str, int]):
+    tmp = REPL_STATE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cursors, f)
+    os.replace(tmp, REPL_STATE_PATH)
+
+def list_peer_shards(peer_url: str, since: int = 0, replicas_since: int = 0) -> Optional[dict]:
+    try:
+        r = peer_client(peer_url).get("/shards", params={"since": since, "replicas_since": replicas_since})
+        if r.status_code == 200:
+            d = r.json()
+            if "shards" not in d:  # peer without a manifest: names only, no cursor
+                d["shards"] = [{"name": n} for n in d.get("files", [])]
+            return d
     except Exception: pass
-    return []
+    return None
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024*1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
-def download_peer_shard(peer_url: str, name: str):
+def download_peer_shard(peer_url: str, entry: dict) -> bool:
+    """Fetches one shard into REPL_DIR, resuming a partial .tmp. True once the shard is present."""
+    name = entry["name"]
     if os.path.exists(os.path.join(OUTPUT_DIR, name)) or os.path.exists(os.path.join(REPL_DIR, name)):
-        return
+        return True
+    tmp = os.path.join(REPL_DIR, name + ".tmp")
+    have = os.path.getsize(tmp) if os.path.exists(tmp) else 0
+    if entry.get("bytes") is not None and have > entry["bytes"]:
+        os.remove(tmp); have = 0
     try:
-        with httpx.Client(timeout=None) as cli:
-            with cli.stream("GET", f"http://{peer_url}/pull", params={"name": name}) as r:
+        headers = {"Range": f"bytes={have}-"} if have else {}
+        if not (have and have == entry.get("bytes")):
+            with peer_client(peer_url).stream("GET", "/pull", params={"name": name}, headers=headers, timeout=None) as r:
+                if r.status_code == 416:
+                    os.remove(tmp); return False  # our partial file is bogus; start over next round
                 r.raise_for_status()
-                tmp = os.path.join(REPL_DIR, name + ".tmp")
-                with open(tmp, "wb") as f:
+                mode = "ab" if r.status_code == 206 else "wb"  # 200: server ignored Range, full body
+                with open(tmp, mode) as f:
                     for chunk in r.iter_bytes(1024*256):
                         if chunk: f.write(chunk)
-                os.replace(tmp, os.path.join(REPL_DIR, name))
-                print(f"[{WORKER_ID}] replicated {name} from {peer_url}")
-    except Exception: pass
+        if entry.get("sha256") and _sha256_file(tmp) != entry["sha256"]:
+            print(f"[{WORKER_ID}] checksum mismatch for {name} from {peer_url}; discarding")
+            os.remove(tmp); return False
+        os.replace(tmp, os.path.join(REPL_DIR, name))
+        print(f"[{WORKER_ID}] replicated {name} from {peer_url}" + (f" (resumed at {have} bytes)" if have else ""))
+        return True
+    except Exception:
+        return False
+
+def fetch_replica(peer_url: str, entry: dict, producer: str, members: List[str]) -> bool:
+    """Pulls `entry` if this node is one of its owners. True if there is nothing left to do for it."""
+    if producer == WORKER_ID or WORKER_ID not in replica_owners(entry["name"], producer, members):
+        return True
+    if not download_peer_shard(peer_url, entry):
+        return False
+    if entry["name"] not in held:
+        rec = {k: v for k, v in entry.items() if k != "seq"}
+        held.append({**rec, "producer": producer})
+    return True
+
+def replicate_from_peer(peer_url: str, cursors: Dict[str, int], members: List[str]) -> bool:
+    """
+    Pulls the shards placed on this node from the peer: its own newly sealed shards in
+    manifest order, then replicas it holds of other producers' shards (which is how a
+    shard is re-replicated once its producer is gone). Returns True if a cursor moved.
+    """
+    since = cursors.get(peer_url, 0)
+    rkey = peer_url + "|replicas"
+    rsince = cursors.get(rkey, 0)
+    listing = list_peer_shards(peer_url, since, rsince)
+    if listing is None:
+        return False
+    # the listing names its producer; older peers don't, so fall back to what /status told us
+    wid = listing.get("worker_id") or next((w for w, u in peer_urls.items() if u == peer_url), None)
+    if wid is None or wid == WORKER_ID:
+        return False  # producer unknown (placement needs its id), or ourselves
+    if listing.get("cursor", since) < since or listing.get("replicas_cursor", rsince) < rsince:
+        cursors[peer_url] = cursors[rkey] = since = rsince = 0  # peer's manifests were reset; rescan
+        listing = list_peer_shards(peer_url, 0, 0)
+        if listing is None:
+            return True
+    moved = False
+    for entry in listing["shards"]:
+        if not fetch_replica(peer_url, entry, wid, members):
+            break  # keep the cursor here; this shard resumes next round
+        if "seq" in entry:
+            cursors[peer_url] = entry["seq"]; moved = True
+    for entry in listing.get("replicas", []):
+        if not fetch_replica(peer_url, entry, entry.get("producer", ""), members):
+            break
+        cursors[rkey] = entry["seq"]; moved = True
+    return moved
 
 def replication_loop():
+    cursors = load_repl_cursors()
     while not stop_flag["stop"]:
-        peer_map = {p: list_peer_shards(p) for p in PEERS}
-        names = set()
-        for files in peer_map.values(): names.update(files)
-        for name in sorted(names):
-            if name.startswith(f"labels_{WORKER_ID.replace(':','_')}"): continue
-            for p, files in peer_map.items():
-                if name in files:
-                    download_peer_shard(p, name); break
+        shard_writer.rotate_if_due()  # seal an idle node's open shard so peers can pull it
+        if heartbeat_metrics["rounds"] == 0:
+            time.sleep(HEARTBEAT_SEC); continue  # placement needs to know who is alive
+        members = cluster_members()
+        fp = _members_fingerprint(members)
+        if REPL_FACTOR > 0 and cursors.get("#members") != fp:
+            # owners moved: rescan every listing (already-held shards are skipped cheaply)
+            cursors = {"#members": fp}
+            moved = True
+        else:
+            moved = False
+        for p in PEERS:
+            moved = replicate_from_peer(p, cursors, members) or moved
+        if moved:
+            save_repl_cursors(cursors)
         time.sleep(REPL_INTERVAL)
 
 # -------------- Startup ---------------------------
@@ -399,5 +801,8 @@ def main():
     threading.Thread(target=heartbeat_loop, daemon=True).start()
     threading.Thread(target=worker_loop, daemon=True).start()
     threading.Thread(target=replication_loop, daemon=True).start()
-    uvicorn.run(app, host="0.0.0.0", port=args.port, log_level="info")
+    try:
+        uvicorn.run(app, host="0.0.0.0", port=args.port, log_level="info")
+    finally:
+        close_http_clients()
 if __name__ == "__main__": main()
@@ -0,0 +1,120 @@
+import json
+from typing import Dict, List, Tuple
+
+Example = Tuple[str, dict]
+
+# ---------- classification prompt template ----------
+# Static instructions first, then the per-domain examples header; everything that depends
+# on the question (its closest examples and the question itself) comes last, so requests
+# for one domain share the whole prefix and the server can reuse its KV cache for it.
+_HEADER = """
+    You are a highly accurate text classifier.
+
+    TASK:
+    - Decide if the input question REQUIRES an external web search.
+    - 1 means search needed, 0 means not needed. return as integer.
+    - Output ONLY valid JSON with fields EXACTLY as specified:
+    - "search_needed": 1 or 0
+    - "confidence": float between 0 and 0.7
+
+    RULES:
+    - DO NOT include any field other than the two specified.
+    - Ignore any 'Reason:' lines in the examples; they are for illustration only.
+    - KEEP FORMAT CONSISTENT. ONE line ONLY. THIS EXACT SCHEMA. {"search_needed":0,"confidence":0.2}
+    - Heuristics:
+    - 1: needs fresh or volatile info (weather, news, prices, schedules, leadership, “latest”, “current”, release dates).
+    - 0: stable facts, definitions, math, basic programming or best-practice guidance you can answer without lookup.
+    - Confidence: start at 0.50, adjust up/down in 0.05 or 0.10 increments based on certainty.
+    Examples ({domain_tag} domain; closest in length to the input):
+    """.strip()
+
+_QUESTION = "\n\n    Now classify this:\n    "
+_TRAILER = "\n    A(PICK THE CORRECT CLASSIFICATION BUT PICK A LOWER CONFIDANCE SCORE):"
+
+# packed mode: K numbered questions, one JSON array of K objects back
+_PACKED_QUESTIONS = "\n\n    Now classify each of these {k} questions separately:\n"
+_PACKED_TRAILER = ("\n    Answer with ONE line: a JSON array of exactly {k} objects, one per question, in the"
+                   " same order, each with THIS EXACT SCHEMA {{\"search_needed\":0,\"confidence\":0.2}}."
+                   "\n    A(PICK THE CORRECT CLASSIFICATION BUT PICK A LOWER CONFIDANCE SCORE):")
+
+# single-token label mode: the answer is one digit, scored from its log-probabilities
+_LABEL_HEADER = """
+    You are a highly accurate text classifier.
+
+    TASK:
+    - Decide if the input question REQUIRES an external web search.
+    - Answer with a single digit and nothing else: 1 if a search is needed, 0 if not.
+    - Heuristics:
+    - 1: needs fresh or volatile info (weather, news, prices, schedules, leadership, “latest”, “current”, release dates).
+    - 0: stable facts, definitions, math, basic programming or best-practice guidance you can answer without lookup.
+    Examples ({domain_tag} domain; closest in length to the input):
+    """.strip()
+_LABEL_TRAILER = "\n    A:"
+
+def render_example(q: str, meta: dict) -> str:
+    # only the schema fields go in the example JSON; the reason is shown separately
+    ej = {"search_needed": int(meta.get("search_needed", 0)),
+          "confidence": float(meta.get("confidence", 0.0))}
+    return f"Q: {q}\nA: {json.dumps(ej, ensure_ascii=False)}\nReason: {meta.get('reason', '')}"
+
+def _example_key(ex: Example) -> tuple:
+    # by content, so equal examples share a block whichever tuple object carries them
+    q, meta = ex
+    return (q, meta.get("search_needed", 0), meta.get("confidence", 0.0), meta.get("reason", ""))
+
+def render_label_example(q: str, meta: dict) -> str:
+    return f"Q: {q}\nA: {1 if int(meta.get('search_needed', 0)) == 1 else 0}"
+
+class PromptCompiler:
+    """
+    Renders classification prompts from pieces formatted once: a frozen prefix per
+    domain, a cached block per example and per example pair, and the static trailer.
+    Output is byte-for-byte what the former inline f-string produced.
+    """
+
+    MAX_CACHED_PAIRS = 50_000
+
+    def __init__(self, bank: Dict[str, List[Example]]):
+        self._prefixes: Dict[str, str] = {}
+        self._blocks: Dict[tuple, str] = {_example_key(ex): render_example(*ex) for items in bank.values() for ex in items}
+        self._pairs: Dict[Tuple[tuple, ...], str] = {}
+        self._label_prefixes: Dict[str, str] = {}
+
+    def prefix(self, domain_tag: str) -> str:
+        """The part of every prompt for `domain_tag` that does not depend on the question."""
+        p = self._prefixes.get(domain_tag)
+        if p is None:
+            p = self._prefixes[domain_tag] = _HEADER.replace("{domain_tag}", domain_tag, 1) + "\n    "
+        return p
+
+    def label_prefix(self, domain_tag: str) -> str:
+        """prefix() for single-token label prompts."""
+        p = self._label_prefixes.get(domain_tag)
+        if p is None:
+            p = self._label_prefixes[domain_tag] = _LABEL_HEADER.replace("{domain_tag}", domain_tag, 1) + "\n    "
+        return p
+
+    def examples(self, shots: List[Example]) -> str:
+        key = tuple(_example_key(ex) for ex in shots)
+        s = self._pairs.get(key)
+        if s is None:
+            s = "\n\n".join(self._blocks.get(k) or render_example(*ex) for k, ex in zip(key, shots))
+            if len(self._pairs) < self.MAX_CACHED_PAIRS and all(k in self._blocks for k in key):
+                self._pairs[key] = s
+        return s
+
+    def render(self, question: str, domain_tag: str, shots: List[Example]) -> str:
+        return "".join((self.prefix(domain_tag), self.examples(shots), _QUESTION, question, _TRAILER))
+
+    def render_packed(self, questions: List[str], domain_tag: str, shots: List[Example]) -> str:
+        """Same prefix and examples as render(), followed by the questions numbered 1..K."""
+        k = len(questions)
+        # one line per question so the numbering stays unambiguous
+        numbered = "".join(f"    {i}. {' '.join(q.split())}\n" for i, q in enumerate(questions, 1))
+        return "".join((self.prefix(domain_tag), self.examples(shots),
+                        _PACKED_QUESTIONS.format(k=k), numbered, _PACKED_TRAILER.format(k=k)))
+
+    def render_label(self, question: str, domain_tag: str, shots: List[Example]) -> str:
+        """Label-mode prompt: examples answered with a bare 0/1, then the question."""
+        examples = "\n\n".join(render_label_example(*ex) for ex in shots)
+        return "".join((self.label_prefix(domain_tag), examples, _QUESTION, question, _LABEL_TRAILER))
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+# ---------- key helpers ----------
+def text_id(text: str) -> str:
+    # same id node.py writes into every output row
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def stable_hash(obj) -> str:
+    blob = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+# ---------- cache ----------
+class ResultCache:
+    """
+    Persistent classification cache keyed by (text id, model, prompt hash, options hash).
+
+    Stores the RAW model output (label + pre-calibration confidence) so refitting
+    calibrators never invalidates entries. Backed by SQLite in WAL mode so several
+    node processes on one host can share the file; once more than `max_entries`
+    rows exist the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1_000_000):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self._evict_slack = max(1, self.max_entries // 20)  # evict in chunks, not per put
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                text_id      TEXT NOT NULL,
+                model        TEXT NOT NULL,
+                prompt_hash  TEXT NOT NULL,
+                options_hash TEXT NOT NULL,
+                search_needed INTEGER NOT NULL,
+                raw_confidence REAL NOT NULL,
+                last_used    REAL NOT NULL,
+                PRIMARY KEY (text_id, model, prompt_hash, options_hash)
+            ) WITHOUT ROWID""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_lru ON results(last_used)")
+        self._count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, key: Tuple[str, str, str, str]) -> Optional[Tuple[int, float]]:
+        """Returns (search_needed, raw_confidence) or None; a hit refreshes the entry's LRU stamp."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT search_needed, raw_confidence FROM results "
+                "WHERE text_id=? AND model=? AND prompt_hash=? AND options_hash=?", key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute(
+                "UPDATE results SET last_used=? "
+                "WHERE text_id=? AND model=? AND prompt_hash=? AND options_hash=?", (time.time(), *key))
+            return int(row[0]), float(row[1])
+
+    def put(self, key: Tuple[str, str, str, str], search_needed: int, raw_confidence: float):
+        row = (int(search_needed), float(raw_confidence), time.time())
+        with self._lock:
+            # insert-or-nothing first so only genuinely new rows count towards _count;
+            # an existing key is then overwritten in place
+            cur = self._db.execute(
+                "INSERT INTO results VALUES (?,?,?,?,?,?,?) "
+                "ON CONFLICT(text_id, model, prompt_hash, options_hash) DO NOTHING", (*key, *row))
+            if cur.rowcount == 1:
+                self._count += 1
+            else:
+                self._db.execute(
+                    "UPDATE results SET search_needed=?, raw_confidence=?, last_used=? "
+                    "WHERE text_id=? AND model=? AND prompt_hash=? AND options_hash=?", (*row, *key))
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        # caller holds the lock; recount since other processes may share the file
+        self._count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        excess = self._count - self.max_entries
+        if excess <= 0:
+            return
+        n = excess + self._evict_slack
+        self._db.execute(
+            "DELETE FROM results WHERE (text_id, model, prompt_hash, options_hash) IN "
+            "(SELECT text_id, model, prompt_hash, options_hash FROM results ORDER BY last_used LIMIT ?)", (n,))
+        self._count = max(0, self._count - n)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,363 @@
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from typing import List, Optional
+
+try:
+    import zstandard
+except ImportError:  # optional; only needed for SHARD_COMPRESSION=zstd
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.json as pa_json
+except ImportError:  # optional; only needed for Arrow sidecars
+    pa = None
+
+FSYNC_POLICIES = ("none", "group", "range")
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}  # codec -> file suffix
+BLOCK_BYTES = 1 << 20  # uncompressed bytes per gzip member / zstd frame
+
+def _fsync_file(path: str):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+# ---------- compression ----------
+def compress_shard(src: str, dst: str, codec: str) -> str:
+    """
+    Compresses a sealed JSONL shard into `dst` as a sequence of independent
+    gzip members / zstd frames of ~BLOCK_BYTES each, cut on line boundaries,
+    so readers can stream it (and plain gunzip/zstd -d still work).
+    Returns the SHA-256 of the compressed file.
+    """
+    if codec == "zstd" and zstandard is None:
+        raise RuntimeError("SHARD_COMPRESSION=zstd needs the 'zstandard' package")
+    cctx = zstandard.ZstdCompressor(level=3) if codec == "zstd" else None
+    sha = hashlib.sha256()
+    tmp = dst + ".tmp"
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        while True:
+            block = fin.read(BLOCK_BYTES)
+            if not block:
+                break
+            block += fin.readline()  # finish the current line so every frame holds whole records
+            frame = cctx.compress(block) if cctx else gzip.compress(block, compresslevel=6, mtime=0)
+            sha.update(frame)
+            fout.write(frame)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, dst)
+    return sha.hexdigest()
+
+# ---------- Arrow IPC sidecars ----------
+def _arrow_schema():
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([("id", pa.string()), ("idx", pa.int64()), ("text", pa.string()),
+                      ("domain", dict_str), ("label", dict_str), ("label_id", pa.int64()),
+                      ("confidence", pa.float64()), ("worker", dict_str), ("ts", pa.float64())])
+
+def write_arrow_sidecar(src: str, dst: str):
+    """
+    Writes the JSONL shard `src` as an Arrow IPC file with a fixed schema (domain, label and
+    worker dictionary-encoded), so analytics can mmap shards instead of re-parsing JSON.
+    """
+    if pa is None:
+        raise RuntimeError("Arrow sidecars need the 'pyarrow' package")
+    schema = _arrow_schema()
+    plain = pa.schema([f.with_type(pa.string()) if pa.types.is_dictionary(f.type) else f for f in schema])
+    table = pa_json.read_json(src, parse_options=pa_json.ParseOptions(
+        explicit_schema=plain, unexpected_field_behavior="ignore")).cast(schema)
+    tmp = dst + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, dst)
+
+def open_shard(path: str):
+    """Opens a shard (raw, .gz or .zst) for reading as a binary line stream."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"reading {path} needs the 'zstandard' package")
+        raw = open(path, "rb")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True))
+    return open(path, "rb")
+
+# ---------- manifest of sealed shards ----------
+class ShardManifest:
+    """
+    Append-only JSONL list of sealed shards, one entry per shard:
+    {seq, name, rows, bytes, sha256, idx_min, idx_max, sealed_ts}.
+    `seq` increases by one per entry, so it doubles as a listing cursor.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: List[dict] = []
+        if os.path.exists(path):
+            self._load()
+        self._names = {e["name"] for e in self._entries}
+
+    def _load(self):
+        good = 0  # end of the last intact, newline-terminated entry
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # a crash cut the last write short
+                if line.strip():
+                    try:
+                        self._entries.append(json.loads(line))
+                    except ValueError:
+                        break
+                good += len(line)
+        if good < os.path.getsize(self.path):
+            # drop the torn tail; otherwise the next append would glue onto it and be lost
+            # with it on the following load. Its shard is simply resealed.
+            with open(self.path, "r+b") as f:
+                f.truncate(good)
+                os.fsync(f.fileno())
+
+    def append(self, entry: dict) -> dict:
+        with self._lock:
+            entry = {"seq": (self._entries[-1]["seq"] + 1) if self._entries else 1, **entry}
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._entries.append(entry)
+            self._names.add(entry["name"])
+            return entry
+
+    def entries(self, since: int = 0) -> List[dict]:
+        with self._lock:
+            return [e for e in self._entries if e["seq"] > since]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+# ---------- rotating, group-commit shard writer ----------
+class ShardWriter:
+    """
+    Buffers JSONL records and appends them to the current shard in groups.
+
+    A group is committed once it holds `group_rows` records, `group_bytes` bytes,
+    or its oldest record is `group_sec` old. fsync policy:
+      none   -> commits are flushed to the OS only
+      group  -> every committed group is fsync'd
+      range  -> fsync once per claimed range, in end_range()
+    end_range() always commits what is buffered and returns only once the range
+    is as durable as the policy promises, so callers advance progress after it.
+
+    Shards rotate at group boundaries once they reach `max_rows`, `max_bytes` or
+    `max_sec` of age. A rotated shard is sealed: fsync'd, closed and recorded in
+    the manifest with its row count, size, SHA-256 and idx range. Shard files are
+    only created when their first group is committed, so idle nodes leave no
+    empty files behind.
+
+    With `compression` set to "gzip" or "zstd" a sealed shard is rewritten as
+    <name>.gz / <name>.zst (see compress_shard) and only the compressed file is
+    kept; its manifest entry describes the compressed bytes and also records
+    `raw_bytes` / `raw_sha256` of the JSONL it holds.
+
+    With `arrow_sidecar` each sealed shard also gets a local <shard>.arrow IPC copy
+    (write_arrow_sidecar), named in the manifest entry's "arrow" field.
+    """
+
+    def __init__(self, out_dir: str, prefix: str, manifest: ShardManifest,
+                 group_rows: int = 256, group_bytes: int = 1 << 20, group_sec: float = 1.0,
+                 fsync: str = "range", max_rows: int = 50_000, max_bytes: int = 64 << 20,
+                 max_sec: float = 60.0, compression: str = "none", arrow_sidecar: bool = False):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, got '{fsync}'")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {tuple(COMPRESSIONS)}, got '{compression}'")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("compression='zstd' needs the 'zstandard' package")
+        if arrow_sidecar and pa is None:
+            raise RuntimeError("arrow_sidecar needs the 'pyarrow' package")
+        self.compression = compression
+        self.arrow_sidecar = arrow_sidecar
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.manifest = manifest
+        self.group_rows = max(1, int(group_rows))
+        self.group_bytes = max(1, int(group_bytes))
+        self.group_sec = float(group_sec)
+        self.fsync = fsync
+        self.max_rows = max(1, int(max_rows))
+        self.max_bytes = max(1, int(max_bytes))
+        self.max_sec = float(max_sec)
+
+        self._lock = threading.RLock()
+        self._name_re = re.compile(re.escape(prefix) + r"_\d{8}T\d{4,6}(_\d+)?\.jsonl(\.gz|\.zst)?$")
+        self._buf: List[bytes] = []
+        self._buf_bytes = 0
+        self._buf_since: Optional[float] = None
+        self._f = None
+        self._pending_idx: List[int] = []  # idx values of the buffered records
+        self._dirty = False  # written but not fsync'd
+        self._seq = 0
+        self._reset_shard_stats()
+        self.recover()
+
+    # --- public API ---
+    def write(self, record: dict):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if not self._buf:
+                self._buf_since = time.monotonic()
+            self._buf.append(line)
+            self._buf_bytes += len(line)
+            idx = record.get("idx")
+            if isinstance(idx, int):
+                self._pending_idx.append(idx)
+            if (len(self._buf) >= self.group_rows or self._buf_bytes >= self.group_bytes
+                    or time.monotonic() - self._buf_since >= self.group_sec):
+                self.commit()
+
+    def commit(self):
+        """Writes the buffered group to the current shard in a single write call."""
+        with self._lock:
+            if not self._buf:
+                return
+            data = b"".join(self._buf)
+            f = self._file()
+            f.write(data)
+            f.flush()
+            self._sha.update(data)
+            self._rows += len(self._buf)
+            self._bytes += len(data)
+            if self._pending_idx:
+                lo, hi = min(self._pending_idx), max(self._pending_idx)
+                self._idx_min = lo if self._idx_min is None else min(self._idx_min, lo)
+                self._idx_max = hi if self._idx_max is None else max(self._idx_max, hi)
+            self._buf.clear()
+            self._pending_idx.clear()
+            self._buf_bytes = 0
+            self._buf_since = None
+            self._dirty = True
+            if self.fsync == "group":
+                self._sync()
+            if (self._rows >= self.max_rows or self._bytes >= self.max_bytes
+                    or time.time() - self._opened_ts >= self.max_sec):
+                self.seal()
+
+    def end_range(self):
+        with self._lock:
+            self.commit()
+            if self.fsync != "none":
+                self._sync()
+
+    def rotate_if_due(self):
+        """Seals the open shard once it is older than max_sec (safe to call from any thread)."""
+        with self._lock:
+            if self._f is not None and time.time() - self._opened_ts >= self.max_sec:
+                self.commit()
+                if self._f is not None:
+                    self.seal()
+
+    def seal(self) -> Optional[dict]:
+        with self._lock:
+            if self._f is None:
+                return None
+            self._sync()  # sealed shards are immutable; always durable before the manifest says so
+            self._f.close()
+            self._f = None
+            self._dirty = False
+            entry = self._publish(self._name, self._rows, self._bytes, self._sha.hexdigest(),
+                                  self._idx_min, self._idx_max)
+            self._reset_shard_stats()
+            return entry
+
+    def _publish(self, name: str, rows: int, size: int, sha256: str,
+                 idx_min: Optional[int], idx_max: Optional[int]) -> dict:
+        """Compresses the sealed shard if configured and records it in the manifest."""
+        entry = {"name": name, "rows": rows, "bytes": size, "sha256": sha256,
+                 "idx_min": idx_min, "idx_max": idx_max, "encoding": "identity"}
+        raw_path = os.path.join(self.out_dir, name)
+        if self.arrow_sidecar:
+            entry["arrow"] = name[:-len(".jsonl")] + ".arrow"
+            write_arrow_sidecar(raw_path, os.path.join(self.out_dir, entry["arrow"]))
+        if self.compression != "none":
+            cname = name + COMPRESSIONS[self.compression]
+            cpath = os.path.join(self.out_dir, cname)
+            csha = compress_shard(raw_path, cpath, self.compression)
+            entry.update({"name": cname, "bytes": os.path.getsize(cpath), "sha256": csha,
+                          "encoding": self.compression, "raw_bytes": size, "raw_sha256": sha256})
+        entry["sealed_ts"] = time.time()
+        entry = self.manifest.append(entry)
+        if entry["name"] != name:
+            os.remove(raw_path)  # the manifest now points at the compressed copy
+        return entry
+
+    def close(self):
+        with self._lock:
+            self.end_range()
+            self.seal()
+
+    def recover(self):
+        """Seals shards left open by a previous run (present on disk, missing from the manifest)."""
+        for name in sorted(os.listdir(self.out_dir)):
+            if not self._name_re.match(name) or name in self.manifest or not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(self.out_dir, name)
+            if any(name + sfx in self.manifest for sfx in (".gz", ".zst")):
+                os.remove(path)  # crashed after publishing the compressed copy
+                continue
+            sha, rows, size, lo, hi = hashlib.sha256(), 0, 0, None, None
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # torn tail from a crash; never acknowledged, drop it
+                    sha.update(line); rows += 1; size += len(line)
+                    try:
+                        idx = json.loads(line).get("idx")
+                    except ValueError:
+                        idx = None
+                    if isinstance(idx, int):
+                        lo = idx if lo is None else min(lo, idx)
+                        hi = idx if hi is None else max(hi, idx)
+            if size != os.path.getsize(path):
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+            if rows == 0:
+                os.remove(path)
+                continue
+            _fsync_file(path)
+            self._publish(name, rows, size, sha.hexdigest(), lo, hi)
+        # continue the sequence after the highest shard we have ever sealed
+        for e in self.manifest.entries():
+            m = self._name_re.match(e["name"])
+            if m and m.group(1):
+                self._seq = max(self._seq, int(m.group(1)[1:]))
+
+    # --- internals ---
+    def _reset_shard_stats(self):
+        self._name: Optional[str] = None
+        self._opened_ts = 0.0
+        self._sha = hashlib.sha256()
+        self._rows = 0
+        self._bytes = 0
+        self._idx_min: Optional[int] = None
+        self._idx_max: Optional[int] = None
+
+    def _file(self):
+        if self._f is None:
+            self._seq += 1
+            stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+            self._name = f"{self.prefix}_{stamp}_{self._seq:06d}.jsonl"
+            self._opened_ts = time.time()
+            self._f = open(os.path.join(self.out_dir, self._name), "ab")
+        return self._f
+
+    def _sync(self):
+        if self._f is not None and self._dirty:
+            os.fsync(self._f.fileno())
+            self._dirty = False
@@ -0,0 +1,164 @@
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# ---------- adaptive claim sizing (leader side) ----------
+class ClaimSizer:
+    """
+    Sizes each claim so the requesting worker spends about `target_sec` on it.
+
+    A worker's throughput is estimated from claim-to-next-claim timing: when it
+    comes back for more work, the rows of its previous claim divided by the time
+    since that claim is one rows/sec sample, smoothed with an EWMA. Unknown
+    workers get `default_size`. Near the end of the job claims shrink so the
+    remaining rows are spread over all active workers instead of one slow node
+    holding the tail.
+    """
+
+    def __init__(self, default_size: int, target_sec: float = 30.0,
+                 min_size: int = 8, max_size: int = 4096, alpha: float = 0.3):
+        self.default_size = max(1, int(default_size))
+        self.target_sec = float(target_sec)
+        self.min_size = max(1, int(min_size))
+        self.max_size = max(self.min_size, int(max_size))
+        self.alpha = float(alpha)
+        self._lock = threading.Lock()
+        # worker -> {"rate": rows/sec or None, "last_ts": float, "last_size": int}
+        self._workers: Dict[str, dict] = {}
+
+    def _active_workers(self, now: float) -> int:
+        horizon = max(2 * self.target_sec, 60.0)
+        return max(1, sum(1 for w in self._workers.values() if now - w["last_ts"] <= horizon))
+
+    def next_size(self, worker: Optional[str], remaining: int, now: Optional[float] = None) -> int:
+        """Claim size for `worker` given `remaining` unassigned rows; also updates its rate estimate."""
+        now = time.time() if now is None else now
+        with self._lock:
+            w = self._workers.get(worker) if worker else None
+            if w is not None:
+                dt = now - w["last_ts"]
+                if dt > 0 and w["last_size"] > 0:
+                    sample = w["last_size"] / dt
+                    w["rate"] = sample if w["rate"] is None else (1 - self.alpha) * w["rate"] + self.alpha * sample
+
+            if w is None or w["rate"] is None:
+                size = self.default_size
+            else:
+                size = int(w["rate"] * self.target_sec)
+            size = max(self.min_size, min(self.max_size, size))
+
+            # tail: leave something for every active worker (about two claims each)
+            fair_share = math.ceil(remaining / (2 * self._active_workers(now)))
+            size = min(size, max(self.min_size, fair_share))
+            return max(1, min(size, remaining))
+
+    def record_claim(self, worker: Optional[str], size: int, now: Optional[float] = None):
+        if not worker:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            w = self._workers.setdefault(worker, {"rate": None, "last_ts": now, "last_size": 0})
+            w["last_ts"] = now
+            w["last_size"] = int(size)
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return {wid: {"rows_per_sec": round(w["rate"], 3) if w["rate"] is not None else None,
+                          "last_claim_size": w["last_size"], "last_claim_ts": w["last_ts"]}
+                    for wid, w in self._workers.items()}
+
+# ---------- claim leases (leader side) ----------
+class LeaseTable:
+    """
+    Leader-side record of every range handed out and not yet acknowledged.
+
+    Each lease carries (start, end, worker, epoch, deadline) and an id unique to
+    that grant (epoch + sequence number), so a range handed out again gets a new
+    id. Only the holder extends the deadline with renewals while it processes and
+    drops the lease with a completion ack; a late renew/complete from a previous
+    holder of the same range matches nothing. Leases that miss their deadline become orphans: ranges that
+    the next claims hand out again (split to the requested size) before any
+    fresh rows, so a dead worker costs exactly its unfinished range.
+
+    Everything below the leader's next_index is therefore either leased,
+    orphaned or done; the table (plus next_index) is plain JSON so it can be
+    persisted in the node state and mirrored by followers for failover.
+    """
+
+    def __init__(self, lease_sec: float = 60.0):
+        self.lease_sec = float(lease_sec)
+        self.leases: Dict[str, dict] = {}        # lease_id -> lease dict
+        self.orphans: List[Tuple[int, int]] = []  # expired [start, end] ranges, lowest first
+        self.seq = 0                              # grants so far; part of every lease id
+
+    # --- grant / renew / complete ---
+    def grant(self, start: int, end: int, worker: Optional[str], epoch: int,
+              now: Optional[float] = None) -> dict:
+        now = time.time() if now is None else now
+        self.seq += 1
+        lease = {"lease_id": f"{epoch}.{self.seq}:{start}-{end}", "start": start, "end": end,
+                 "worker": worker, "epoch": epoch, "deadline": now + self.lease_sec}
+        self.leases[lease["lease_id"]] = lease
+        return lease
+
+    def _held(self, lease_id: str, worker: Optional[str]) -> Optional[dict]:
+        lease = self.leases.get(lease_id)
+        return lease if lease is not None and lease["worker"] == worker else None
+
+    def renew(self, lease_id: str, worker: Optional[str] = None,
+              now: Optional[float] = None) -> Optional[dict]:
+        """Extends the lease if `worker` holds it; None for unknown ids and other workers."""
+        lease = self._held(lease_id, worker)
+        if lease is not None:
+            now = time.time() if now is None else now
+            lease["deadline"] = now + self.lease_sec
+        return lease
+
+    def complete(self, lease_id: str, worker: Optional[str] = None) -> Optional[dict]:
+        """Drops the lease if `worker` holds it; None for unknown ids and other workers."""
+        if self._held(lease_id, worker) is None:
+            return None
+        return self.leases.pop(lease_id)
+
+    # --- expiry / reassignment ---
+    def expire(self, now: Optional[float] = None) -> List[dict]:
+        """Moves leases past their deadline to the orphan list and returns them."""
+        now = time.time() if now is None else now
+        expired = [l for l in self.leases.values() if l["deadline"] < now]
+        for lease in expired:
+            del self.leases[lease["lease_id"]]
+            self.orphans.append((lease["start"], lease["end"]))
+        if expired:
+            self.orphans.sort()
+        return expired
+
+    def take_orphan(self, size: int) -> Optional[Tuple[int, int]]:
+        """Pops up to `size` rows from the lowest orphaned range, or None if there are none."""
+        if not self.orphans:
+            return None
+        start, end = self.orphans.pop(0)
+        cut = min(end, start + max(1, size) - 1)
+        if cut < end:
+            self.orphans.insert(0, (cut + 1, end))
+        return start, cut
+
+    def orphan_rows(self) -> int:
+        return sum(e - s + 1 for s, e in self.orphans)
+
+    def extend_all(self, now: Optional[float] = None):
+        """Gives every lease a fresh deadline (used when a new leader adopts a mirrored table)."""
+        now = time.time() if now is None else now
+        for lease in self.leases.values():
+            lease["deadline"] = now + self.lease_sec
+
+    # --- persistence ---
+    def to_dict(self) -> dict:
+        return {"leases": list(self.leases.values()), "orphans": [list(r) for r in self.orphans],
+                "seq": self.seq}
+
+    def load(self, d: Optional[dict]):
+        d = d or {}
+        self.leases = {l["lease_id"]: dict(l) for l in d.get("leases", [])}
+        self.orphans = sorted((int(s), int(e)) for s, e in d.get("orphans", []))
+        self.seq = max(self.seq, int(d.get("seq", 0)))
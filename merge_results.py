@@ -1,59 +1,550 @@
+import argparse
 import glob
+import gzip
+import hashlib
+import heapq
+import io
 import json
 import os
-import hashlib
-import pandas as pd
+import shutil
+import sqlite3
+import struct
+import tempfile
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # only needed for .jsonl.zst shards
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as pads
+except ImportError:  # only needed for --parquet
+    pa = None
+
+try:
+    import orjson  # optional, several times faster than json for shard lines
+    _loads = orjson.loads
+    def _dumps_line(obj):
+        return orjson.dumps(obj) + b"\n"
+except ImportError:
+    orjson = None
+    _loads = json.loads
+    def _dumps_line(obj):
+        return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
 
 # Where shards are located
 SHARD_DIRS = ["output", "replicated"]
 OUTPUT_PATH = "output/gold.jsonl"
+# --incremental bookkeeping (processed shards, id -> ts/gold line); reseeded by full rebuilds
+STATE_PATH = "output/gold_state.sqlite"
+
+# Keys buffered in memory before a sorted run is spilled to disk (~120 bytes each)
+RUN_ROWS = int(os.getenv("MERGE_RUN_ROWS", "500000"))
+# Processes parsing shards (one shard per task)
+WORKERS = int(os.getenv("MERGE_WORKERS", str(os.cpu_count() or 1)))
+# --incremental compacts gold once this fraction of its lines are superseded
+COMPACT_RATIO = float(os.getenv("MERGE_COMPACT_RATIO", "0.25"))
+
+# Keep only relevant columns (expand if you want more)
+KEEP_COLS = [
+    "id", "idx", "text", "domain",
+    "label", "label_id", "confidence",
+    "worker", "ts"
+]
+
+# One sort key per shard line: SHA1(id) | ts | shard number | line number, all big-endian so
+# plain byte order is (id, ts, shard, line) order. ts is non-negative, and non-negative IEEE
+# doubles compare like unsigned ints.
+KEY = struct.Struct(">20sdIQ")
+# (SHA1(id), ts) of each emitted gold line, in output order
+META = struct.Struct(">20sd")
+
+def _open_shard(path):
+    # sealed shards may be stored raw, gzip'd or zstd-compressed (SHARD_COMPRESSION)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed; pip install zstandard")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader)
+    return open(path, "rb")
+
+def _shard_paths(root):
+    return sorted(p for p in glob.glob(os.path.join(root, "labels_*.jsonl*"))
+                  if p.endswith((".jsonl", ".jsonl.gz", ".jsonl.zst")))
+
+def _id_digest(_id):
+    # ids are SHA1 hex; anything else is hashed so every key has the same width
+    if isinstance(_id, str) and len(_id) == 40:
+        try:
+            return bytes.fromhex(_id)
+        except ValueError:
+            pass
+    return hashlib.sha1(str(_id).encode("utf-8")).digest()
+
+def _ts(rec):
+    try:
+        return max(0.0, float(rec.get("ts") or 0.0))
+    except (TypeError, ValueError):
+        return 0.0
+
+# ---------- pass 1: sorted runs of (id, ts, shard, line) keys ----------
+def _spill(keys, tmp_dir, runs):
+    """Sorts buffered keys, keeps the newest per id, and writes them as one run file."""
+    keys.sort()
+    path = os.path.join(tmp_dir, f"run_{len(runs):05d}.bin")
+    with open(path, "wb") as f:
+        for i, k in enumerate(keys):
+            if i + 1 < len(keys) and keys[i + 1][:20] == k[:20]:
+                continue  # a newer key for the same id follows
+            f.write(k)
+    runs.append(path)
+    keys.clear()
+
+def _read_keys(path, size):
+    with open(path, "rb") as f:
+        while True:
+            blob = f.read(size * 4096)
+            if not blob:
+                return
+            for off in range(0, len(blob), size):
+                yield blob[off:off + size]
+
+def _ordered_map(pool, fn, tasks, window):
+    # like pool.map, but with at most `window` tasks in flight so finished results
+    # (up to a shard's worth of data each) can't pile up ahead of the consumer
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(fn, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _summarize_shard(task):
+    """
+    Worker: parses one shard and returns (rows, corrupt, keys, size, sha256) where keys is
+    the packed KEY of every valid line, already reduced to the newest per id within the
+    shard, size is the stored file size and sha256 covers the (decompressed) lines read.
+    Blank lines are ignored; lines that don't parse or carry no id count as corrupt.
+    """
+    fi, path = task
+    best = {}
+    rows = corrupt = 0
+    size = os.path.getsize(path)
+    sha = hashlib.sha256()
+    with _open_shard(path) as f:
+        for ln, line in enumerate(f):
+            sha.update(line)
+            if not line.strip():
+                continue
+            try:
+                rec = _loads(line)
+                digest = _id_digest(rec["id"])
+            except Exception:
+                corrupt += 1
+                continue
+            rows += 1
+            key = KEY.pack(digest, _ts(rec), fi, ln)
+            if key > best.get(digest, b""):
+                best[digest] = key
+    return rows, corrupt, b"".join(best.values()), size, sha.hexdigest()
+
+def _scan(paths, tmp_dir, pool, window):
+    runs, keys = [], []
+    total, corrupt, seen = 0, {}, {}
+    tasks = list(enumerate(paths))
+    for (fi, path), (rows, bad, blob, size, sha) in zip(tasks, _ordered_map(pool, _summarize_shard, tasks, window)):
+        total += rows
+        seen[path] = (size, sha)
+        if bad:
+            corrupt[path] = bad
+        keys.extend(blob[off:off + KEY.size] for off in range(0, len(blob), KEY.size))
+        if len(keys) >= RUN_ROWS:
+            _spill(keys, tmp_dir, runs)
+    if keys:
+        _spill(keys, tmp_dir, runs)
+    return runs, total, corrupt, seen
+
+# ---------- pass 2: pick winners, then emit them shard by shard ----------
+def _winner_runs(runs, tmp_dir, accept=None):
+    """
+    Merges the runs and keeps the last (newest) key per id, optionally filtered by
+    accept(key). Winners are spilled as sorted runs of shard<<40|line so the writer can
+    visit shards sequentially.
+    """
+    out, buf = [], array("Q")
+
+    def flush():
+        path = os.path.join(tmp_dir, f"win_{len(out):05d}.bin")
+        with open(path, "wb") as f:
+            array("Q", sorted(buf)).tofile(f)
+        out.append(path)
+        del buf[:]
+
+    def take(key):
+        if accept is None or accept(key):
+            _, _, fi, ln = KEY.unpack(key)
+            buf.append(fi << 40 | ln)
+            if len(buf) >= RUN_ROWS:
+                flush()
+
+    prev = None
+    for k in heapq.merge(*(_read_keys(r, KEY.size) for r in runs)):
+        if prev is not None and prev[:20] != k[:20]:
+            take(prev)
+        prev = k
+    if prev is not None:
+        take(prev)
+    if buf:
+        flush()
+    return out
+
+def _read_u64(path):
+    with open(path, "rb") as f:
+        while True:
+            block = array("Q")
+            try:
+                block.fromfile(f, 65536)
+            except EOFError:
+                pass  # short final block; fromfile keeps what it read
+            if not block:
+                return
+            yield from block
+
+def _iter_winners(win_runs):
+    return heapq.merge(*(_read_u64(p) for p in win_runs))
+
+def _emit_shard(task):
+    """
+    Worker: returns (lines, count, metas) for the given (sorted) line numbers of a shard:
+    the projected output lines and the packed META of each.
+    """
+    path, lines = task
+    out, metas, want = [], [], iter(lines)
+    nxt = next(want, None)
+    with _open_shard(path) as f:
+        for ln, line in enumerate(f):
+            if nxt is None:
+                break
+            if ln != nxt:
+                continue
+            rec = _loads(line)
+            out.append(_dumps_line({c: rec.get(c) for c in KEEP_COLS}))
+            metas.append(META.pack(_id_digest(rec["id"]), _ts(rec)))
+            nxt = next(want, None)
+    return b"".join(out), len(out), b"".join(metas)
+
+def _winners_by_shard(paths, win_runs):
+    # winners arrive sorted by shard<<40|line; group them into one task per shard
+    shard, lines = None, array("Q")
+    for w in _iter_winners(win_runs):
+        fi = w >> 40
+        if fi != shard and lines:
+            yield paths[shard], lines
+            lines = array("Q")
+        shard = fi
+        lines.append(w & ((1 << 40) - 1))
+    if lines:
+        yield paths[shard], lines
 
-def main():
+def _write(paths, win_runs, out_path, pool, window, st=None):
+    # with `st` (an empty GoldState inside a transaction) the written lines are indexed too
+    written = 0
+    tmp = out_path + ".tmp"
+    with open(tmp, "wb") as out:
+        for blob, n, metas in _ordered_map(pool, _emit_shard, _winners_by_shard(paths, win_runs), window):
+            out.write(blob)
+            if st is not None:
+                st.db.executemany("INSERT OR REPLACE INTO ids VALUES (?,?,?)",
+                                  [(*META.unpack_from(metas, off), written + j)
+                                   for j, off in enumerate(range(0, len(metas), META.size))])
+            written += n
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, out_path)
+    return written
+
+# ---------- incremental mode ----------
+class GoldState:
+    """
+    SQLite bookkeeping for --incremental builds:
+      shards(name, size, sha256)  shards already folded into gold
+      ids(id, ts, line)           newest ts per id and the gold line holding it
+      meta                        gold_bytes / gold_lines as of the last commit
+    Gold lines not referenced from `ids` are stale (superseded by a later append).
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, isolation_level=None)  # explicit BEGIN/COMMIT
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS shards (name TEXT PRIMARY KEY, size INTEGER, sha256 TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS ids (id BLOB PRIMARY KEY, ts REAL, line INTEGER) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS ids_line ON ids(line)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v INTEGER)")
+
+    def get(self, k):
+        row = self.db.execute("SELECT v FROM meta WHERE k=?", (k,)).fetchone()
+        return row[0] if row else 0
+
+    def set(self, k, v):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES (?,?)", (k, v))
+
+    def reset(self):
+        self.db.execute("BEGIN")
+        for table in ("shards", "ids", "meta"):
+            self.db.execute(f"DELETE FROM {table}")
+        self.db.execute("COMMIT")
+
+    def shard_size(self, name):
+        row = self.db.execute("SELECT size FROM shards WHERE name=?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def ts_of(self, digest):
+        row = self.db.execute("SELECT ts FROM ids WHERE id=?", (digest,)).fetchone()
+        return row[0] if row else None
+
+    def live(self):
+        return self.db.execute("SELECT COUNT(*) FROM ids").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+def _sync_gold(st, gold_path):
+    """Brings gold and its state back in step after an interrupted run."""
+    committed = st.get("gold_bytes")
+    actual = os.path.getsize(gold_path) if os.path.exists(gold_path) else 0
+    if actual < committed or (actual and not st.get("gold_lines")):
+        # gold rewritten outside --incremental, or a crash mid-compaction: start over
+        print("⚠️ Gold and its incremental state disagree; rebuilding from all shards.")
+        st.reset()
+        open(gold_path, "wb").close()
+    elif actual > committed:
+        with open(gold_path, "r+b") as f:
+            f.truncate(committed)  # appended by a run that never committed
+
+def _compact(st, gold_path):
+    """Rewrites gold without superseded lines and renumbers `ids` to match."""
+    tmp = gold_path + ".tmp"
+    written = 0
+    st.db.execute("BEGIN")
+    st.db.execute("CREATE TABLE ids_new (id BLOB PRIMARY KEY, ts REAL, line INTEGER) WITHOUT ROWID")
+    live = st.db.execute("SELECT id, ts, line FROM ids ORDER BY line")
+    nxt = live.fetchone()
+    batch = []
+    with open(gold_path, "rb") as src, open(tmp, "wb") as out:
+        for ln, line in enumerate(src):
+            if nxt is None:
+                break
+            if ln != nxt[2]:
+                continue
+            out.write(line)
+            batch.append((nxt[0], nxt[1], written))
+            written += 1
+            if len(batch) >= 10_000:
+                st.db.executemany("INSERT INTO ids_new VALUES (?,?,?)", batch); batch.clear()
+            nxt = live.fetchone()
+        out.flush()
+        os.fsync(out.fileno())
+    live.close()
+    st.db.executemany("INSERT INTO ids_new VALUES (?,?,?)", batch)
+    st.db.execute("DROP TABLE ids")
+    st.db.execute("ALTER TABLE ids_new RENAME TO ids")
+    st.db.execute("CREATE INDEX ids_line ON ids(line)")
+    st.set("gold_bytes", os.path.getsize(tmp))
+    st.set("gold_lines", written)
+    os.replace(tmp, gold_path)  # a crash before COMMIT leaves gold smaller than recorded -> rebuild
+    st.db.execute("COMMIT")
+    return written
+
+def _incremental(paths, tmp_dir, pool, window):
+    """
+    Folds only shards not seen before (or that grew since, e.g. a still-open shard) into
+    gold. Their winners are appended when strictly newer than what gold holds for the id;
+    the state commits after the appended lines are fsync'd, so an interrupted run is rolled
+    back by truncating gold to the last committed size. Returns (new_shards, total, appended,
+    corrupt, compacted_rows or None).
+    """
+    st = GoldState(STATE_PATH)
+    try:
+        _sync_gold(st, OUTPUT_PATH)
+        new = [p for p in paths if st.shard_size(os.path.basename(p)) != os.path.getsize(p)]
+        if not new:
+            return 0, 0, 0, {}, None
+        runs, total, corrupt, seen = _scan(new, tmp_dir, pool, window)
+
+        def newer(key):
+            digest, ts, _, _ = KEY.unpack(key)
+            old = st.ts_of(digest)
+            return old is None or ts > old
+
+        win_runs = _winner_runs(runs, tmp_dir, accept=newer)
+        line = st.get("gold_lines")
+        st.db.execute("BEGIN")
+        with open(OUTPUT_PATH, "ab") as out:
+            for blob, n, metas in _ordered_map(pool, _emit_shard, _winners_by_shard(new, win_runs), window):
+                out.write(blob)
+                rows = []
+                for off in range(0, len(metas), META.size):
+                    digest, ts = META.unpack_from(metas, off)
+                    rows.append((digest, ts, line))
+                    line += 1
+                st.db.executemany("INSERT OR REPLACE INTO ids VALUES (?,?,?)", rows)
+            out.flush()
+            os.fsync(out.fileno())
+        appended = line - st.get("gold_lines")
+        st.db.executemany("INSERT OR REPLACE INTO shards VALUES (?,?,?)",
+                          [(os.path.basename(p), size, sha) for p, (size, sha) in seen.items()])
+        st.set("gold_bytes", os.path.getsize(OUTPUT_PATH))
+        st.set("gold_lines", line)
+        st.db.execute("COMMIT")
+
+        compacted = None
+        if line and (line - st.live()) / line > COMPACT_RATIO:
+            compacted = _compact(st, OUTPUT_PATH)
+        return len(new), total, appended, corrupt, compacted
+    finally:
+        st.close()
+
+def _full(paths, tmp_dir, pool, window):
+    """
+    Rebuilds gold from every shard and seeds a fresh incremental state from it, so the next
+    --incremental run only folds in what comes after. No shards with rows give an empty gold.
+    The state commits after gold is replaced; a crash in between leaves gold without state,
+    which the next incremental run detects and rebuilds. Returns (total, written, corrupt).
+    """
+    if os.path.exists(STATE_PATH):
+        os.remove(STATE_PATH)  # gold is about to be rewritten; the old index no longer matches
+    runs, total, corrupt, seen = _scan(paths, tmp_dir, pool, window)
+    win_runs = _winner_runs(runs, tmp_dir)
+    st = GoldState(STATE_PATH)
+    try:
+        st.db.execute("BEGIN")
+        written = _write(paths, win_runs, OUTPUT_PATH, pool, window, st)
+        st.db.executemany("INSERT OR REPLACE INTO shards VALUES (?,?,?)",
+                          [(os.path.basename(p), size, sha) for p, (size, sha) in seen.items()])
+        st.set("gold_bytes", os.path.getsize(OUTPUT_PATH))
+        st.set("gold_lines", written)
+        st.db.execute("COMMIT")
+    finally:
+        st.close()
+    return total, written, corrupt
+
+# ---------- Parquet export ----------
+def _parquet_schema():
+    # domain/label are hive partition keys (directory names), so they aren't stored in the
+    # files; worker is dictionary-encoded like they come back when reading the dataset
+    return pa.schema([("id", pa.string()), ("idx", pa.int64()), ("text", pa.string()),
+                      ("domain", pa.string()), ("label", pa.string()), ("label_id", pa.int64()),
+                      ("confidence", pa.float64()), ("worker", pa.dictionary(pa.int32(), pa.string())),
+                      ("ts", pa.float64())])
+
+def _live_lines():
+    # gold lines that are current in --incremental mode (the rest are superseded)
+    db = sqlite3.connect(STATE_PATH)
+    try:
+        for (line,) in db.execute("SELECT line FROM ids ORDER BY line"):
+            yield line
+    finally:
+        db.close()
+
+def _gold_batches(gold_path, schema, live=None, batch_rows=100_000):
+    nxt = next(live, None) if live is not None else None
     rows = []
+    with open(gold_path, "rb") as f:
+        for ln, line in enumerate(f):
+            if live is not None:
+                if nxt is None:
+                    break
+                if ln != nxt:
+                    continue
+                nxt = next(live, None)
+            rows.append(_loads(line))
+            if len(rows) >= batch_rows:
+                yield pa.RecordBatch.from_pylist(rows, schema=schema)
+                rows = []
+    if rows:
+        yield pa.RecordBatch.from_pylist(rows, schema=schema)
 
-    # Load all shard files
-    for root in SHARD_DIRS:
-        for path in glob.glob(os.path.join(root, "labels_*.jsonl")):
-            with open(path, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        rows.append(json.loads(line))
-                    except Exception:
-                        continue
-
-    if not rows:
-        print("⚠️ No shard files found.")
-        return
+def export_parquet(gold_path, out_dir, incremental=False):
+    """
+    Writes the gold set as a Parquet dataset under out_dir, hive-partitioned by
+    domain=<d>/label=<l>, streaming gold in batches. The new dataset is built next to
+    out_dir and swapped in, so readers never see a half-written tree.
+    Read it back with pyarrow.dataset.dataset(out_dir, partitioning="hive").
+    """
+    schema = _parquet_schema()
+    parts = pads.partitioning(pa.schema([("domain", pa.string()), ("label", pa.string())]), flavor="hive")
+    tmp = out_dir.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    live = _live_lines() if incremental else None
+    pads.write_dataset(_gold_batches(gold_path, schema, live), tmp, schema=schema, format="parquet",
+                       partitioning=parts, max_rows_per_group=100_000,
+                       file_options=pads.ParquetFileFormat().make_write_options(compression="zstd"))
+    old = out_dir.rstrip("/\\") + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old)
+    os.replace(tmp, out_dir)
+    shutil.rmtree(old, ignore_errors=True)
+
+def main(argv=None):
+    """
+    Dedups every shard by id, keeping the most recent (highest ts) record, into OUTPUT_PATH.
 
-    # Deduplicate by id: keep the most recent (highest ts)
-    df = pd.DataFrame(rows)
-    if "id" not in df.columns:
-        raise RuntimeError("Shard entries must include an 'id' field.")
+    Memory stays bounded by RUN_ROWS keys: pass 1 streams the shards into sorted runs of
+    fixed-size (id, ts, shard, line) keys on disk, a k-way merge of the runs picks the
+    winner per id, and pass 2 streams the shards once more, in order, writing the winning
+    lines. The output is in shard/line order.
 
-    # Sort so latest ts per id is last
-    if "ts" in df.columns:
-        df = df.sort_values("ts")
+    Shards are parsed one per task in a process pool (--workers), with orjson when it
+    is installed; lines that fail to parse are counted and reported per shard.
 
-    # Drop duplicates, keeping last
-    df = df.drop_duplicates("id", keep="last")
+    --incremental only folds in shards added since the last incremental build (see
+    _incremental); a full build reseeds that state (see _full).
+    """
+    ap = argparse.ArgumentParser(description="Merge labeled shards into the deduplicated gold set.")
+    ap.add_argument("--workers", type=int, default=WORKERS, help="parser processes (env MERGE_WORKERS)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="only merge shards not processed by the previous --incremental run")
+    ap.add_argument("--parquet", metavar="DIR",
+                    help="also write gold as Parquet under DIR, partitioned by domain and label")
+    args = ap.parse_args(argv)
+    if args.parquet and pa is None:
+        raise SystemExit("--parquet needs pyarrow (pip install pyarrow)")
+
+    paths = [p for root in SHARD_DIRS for p in _shard_paths(root)]
+    if not paths:
+        print("⚠️ No shard files found.")
+        return
 
-    # Keep only relevant columns (expand if you want more)
-    keep_cols = [
-        "id", "idx", "text", "domain",
-        "label", "label_id", "confidence",
-        "worker", "ts"
-    ]
-    for c in keep_cols:
-        if c not in df.columns:
-            df[c] = None
+    os.makedirs(os.path.dirname(OUTPUT_PATH) or ".", exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix=".merge_", dir=os.path.dirname(OUTPUT_PATH) or ".") as tmp_dir, \
+            ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        window = 2 * max(1, args.workers)
+        if args.incremental:
+            n_new, total, appended, corrupt, compacted = _incremental(paths, tmp_dir, pool, window)
+        else:
+            total, written, corrupt = _full(paths, tmp_dir, pool, window)
 
-    # Write JSONL
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as out:
-        for _, row in df.iterrows():
-            record = {c: row[c] for c in keep_cols}
-            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    for path, bad in corrupt.items():
+        print(f"⚠️ {path}: {bad} corrupt lines skipped")
+    if not args.incremental:
+        print(f"✅ Wrote {written} unique rows to {OUTPUT_PATH} (from {total} rows in {len(paths)} shards)")
+    elif not n_new:
+        print(f"✅ {OUTPUT_PATH} is up to date ({len(paths)} shards already merged)")
+    else:
+        print(f"✅ Appended {appended} rows to {OUTPUT_PATH} (from {total} rows in {n_new} new shards)"
+              + (f"; compacted to {compacted} rows" if compacted is not None else ""))
 
-    print(f"✅ Wrote {len(df)} unique rows to {OUTPUT_PATH}")
+    if args.parquet and (not args.incremental or n_new or not os.path.exists(args.parquet)):
+        export_parquet(OUTPUT_PATH, args.parquet, incremental=args.incremental)
+        print(f"✅ Wrote Parquet dataset to {args.parquet}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# app/ modules import each other by bare name; merge_results.py lives at the repo root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "app")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,56 @@
+import hashlib
+import os
+
+import pytest
+
+from dataset_index import CsvRowIndex, open_dataset
+
+CSV = (
+    'text,domain\n'
+    'what is the weather today,General\n'
+    '"a question\nover two lines, with a comma",programming\n'
+    '\n'
+    '"quoted ""word"" inside",\n'
+    'last row,mental_health\n'
+)
+
+@pytest.fixture
+def csv_path(tmp_path):
+    (tmp_path / "index").mkdir()  # node.py passes its existing STATE_DIR
+    path = tmp_path / "questions.csv"
+    path.write_bytes(CSV.encode("utf-8"))
+    return str(path)
+
+@pytest.mark.parametrize("layout", ["offsets", "columnar"])
+def test_rows_with_multiline_and_quoted_fields(csv_path, tmp_path, layout):
+    ds = open_dataset(csv_path, str(tmp_path / "index"), layout)
+    assert len(ds) == 4
+    rows = ds.rows(0, 3)
+    assert [r["text"] for r in rows] == ["what is the weather today", "a question\nover two lines, with a comma",
+                                         'quoted "word" inside', "last row"]
+    assert [r["domain"] for r in rows] == ["general", "programming", "", "mental_health"]
+    assert rows[1]["id"] == hashlib.sha1(rows[1]["text"].encode("utf-8")).hexdigest()
+    assert ds[3] == rows[3]
+    with pytest.raises(IndexError):
+        ds.rows(2, 4)
+
+def test_index_is_reused_and_rebuilt_on_content_change(csv_path, tmp_path):
+    index_dir = str(tmp_path / "index")
+    first = CsvRowIndex(csv_path, index_dir)
+    st = os.stat(csv_path)
+    # same size and mtime, different content: only the fingerprint can tell
+    with open(csv_path, "r+b") as f:
+        f.write(b"TEXT")
+    os.utime(csv_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    with pytest.raises(ValueError):
+        CsvRowIndex(csv_path, index_dir)  # rebuilt, and the header no longer has "text"
+    with open(csv_path, "r+b") as f:
+        f.write(b"text")
+    os.utime(csv_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    again = CsvRowIndex(csv_path, index_dir)
+    assert again.sha1 == first.sha1
+    assert not [n for n in os.listdir(index_dir) if n.endswith(".tmp")]
+
+def test_missing_csv_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        CsvRowIndex(str(tmp_path / "nope.csv"), str(tmp_path))
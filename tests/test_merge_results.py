@@ -0,0 +1,62 @@
+import gzip
+import json
+
+import pytest
+
+import merge_results
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(merge_results, "RUN_ROWS", 2)  # several spilled runs even for tiny inputs
+    (tmp_path / "output").mkdir()
+    (tmp_path / "replicated").mkdir()
+    return tmp_path
+
+def _shard(workdir, name, rows, raw=b""):
+    data = b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in rows) + raw
+    path = workdir / name
+    path.write_bytes(gzip.compress(data) if name.endswith(".gz") else data)
+
+def _gold(workdir):
+    with open(workdir / "output" / "gold.jsonl", "rb") as f:
+        return {r["id"]: r for r in map(json.loads, f)}
+
+def _merge(*args):
+    merge_results.main(["--workers", "1", *args])
+
+def test_newest_record_per_id_wins_across_shards(workdir):
+    _shard(workdir, "output/labels_a_1.jsonl", [{"id": "x", "ts": 1, "label": "old"}, {"id": "y", "ts": 5}])
+    _shard(workdir, "replicated/labels_b_1.jsonl.gz", [{"id": "x", "ts": 3, "label": "new"}, {"id": "z", "ts": 2}],
+           raw=b'{"not json\n{"no_id": 1}\n')
+    _merge()
+    gold = _gold(workdir)
+    assert sorted(gold) == ["x", "y", "z"]
+    assert gold["x"]["label"] == "new"
+
+def test_incremental_after_full_build_only_folds_new_shards(workdir, capsys):
+    _shard(workdir, "output/labels_a_1.jsonl", [{"id": "x", "ts": 1, "label": "old"}, {"id": "y", "ts": 1}])
+    _merge()
+    _merge("--incremental")
+    out = capsys.readouterr().out
+    assert "disagree" not in out and "up to date" in out
+
+    _shard(workdir, "output/labels_a_2.jsonl", [{"id": "x", "ts": 2, "label": "new"}, {"id": "y", "ts": 0}])
+    _merge("--incremental")
+    gold = _gold(workdir)
+    assert gold["x"]["label"] == "new"
+    assert gold["y"]["ts"] == 1  # an older record never replaces a newer one
+
+def test_incremental_rolls_back_an_uncommitted_append(workdir):
+    _shard(workdir, "output/labels_a_1.jsonl", [{"id": "x", "ts": 1}])
+    _merge("--incremental")
+    with open(workdir / "output" / "gold.jsonl", "ab") as f:
+        f.write(b'{"id": "ghost", "ts": 9}\n')  # appended by a run that crashed before committing
+    _shard(workdir, "output/labels_a_2.jsonl", [{"id": "y", "ts": 1}])
+    _merge("--incremental")
+    assert sorted(_gold(workdir)) == ["x", "y"]
+
+def test_empty_shards_give_an_empty_gold(workdir):
+    _shard(workdir, "output/labels_a_1.jsonl", [])
+    _merge()
+    assert _gold(workdir) == {}
@@ -0,0 +1,74 @@
+import json
+import os
+
+from shard_store import ShardManifest, ShardWriter
+
+def _writer(tmp_path, manifest, **kw):
+    return ShardWriter(str(tmp_path), "labels_w1", manifest, group_rows=2, max_sec=3600, **kw)
+
+def _rows(path):
+    with open(path, "rb") as f:
+        return [json.loads(line) for line in f]
+
+# ---------- ShardManifest ----------
+def test_manifest_truncates_a_torn_tail(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    m = ShardManifest(path)
+    m.append({"name": "a"})
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 2, "name": "b"')  # crash mid-append
+    m = ShardManifest(path)
+    assert [e["name"] for e in m.entries()] == ["a"]
+    m.append({"name": "b"})
+    m.append({"name": "c"})
+    reloaded = ShardManifest(path)
+    assert [(e["seq"], e["name"]) for e in reloaded.entries()] == [(1, "a"), (2, "b"), (3, "c")]
+    assert "c" in reloaded
+
+def test_manifest_cursor(tmp_path):
+    m = ShardManifest(str(tmp_path / "manifest.jsonl"))
+    for name in "abc":
+        m.append({"name": name})
+    assert [e["name"] for e in m.entries(since=1)] == ["b", "c"]
+
+# ---------- ShardWriter ----------
+def test_groups_commit_and_seal_into_the_manifest(tmp_path):
+    m = ShardManifest(str(tmp_path / "manifest.jsonl"))
+    w = _writer(tmp_path, m)
+    for i in range(3):
+        w.write({"id": str(i), "idx": i})
+    w.end_range()
+    entry = w.seal()
+    assert (entry["rows"], entry["idx_min"], entry["idx_max"]) == (3, 0, 2)
+    assert [r["idx"] for r in _rows(tmp_path / entry["name"])] == [0, 1, 2]
+    assert w.seal() is None  # nothing open
+
+def test_recover_seals_a_crashed_shard_and_drops_the_torn_line(tmp_path):
+    m = ShardManifest(str(tmp_path / "manifest.jsonl"))
+    w = _writer(tmp_path, m)
+    for i in range(4):
+        w.write({"id": str(i), "idx": i})
+    w.end_range()
+    name = w._name
+    w._f.close()  # simulate a crash: shard left open, unsealed
+    with open(tmp_path / name, "ab") as f:
+        f.write(b'{"id": "4", "idx"')
+
+    m = ShardManifest(str(tmp_path / "manifest.jsonl"))
+    w = _writer(tmp_path, m)
+    [entry] = m.entries()
+    assert entry["name"] == name
+    assert (entry["rows"], entry["idx_min"], entry["idx_max"]) == (4, 0, 3)
+    assert entry["bytes"] == os.path.getsize(tmp_path / name)
+    # new shards continue the sequence instead of reusing the recovered name
+    w.write({"id": "5", "idx": 5})
+    w.end_range()
+    assert w.seal()["name"] != name
+
+def test_recover_removes_a_shard_without_complete_rows(tmp_path):
+    m = ShardManifest(str(tmp_path / "manifest.jsonl"))
+    torn = tmp_path / "labels_w1_20250101T000000_000001.jsonl"
+    torn.write_bytes(b'{"id": "0"')
+    _writer(tmp_path, m)
+    assert not torn.exists()
+    assert m.entries() == []
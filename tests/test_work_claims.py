@@ -0,0 +1,64 @@
+from work_claims import ClaimSizer, LeaseTable
+
+# ---------- LeaseTable ----------
+def test_only_the_holder_renews_and_completes():
+    t = LeaseTable(lease_sec=10)
+    lease = t.grant(0, 9, "a", epoch=1, now=100.0)
+    assert t.renew(lease["lease_id"], "b", now=105.0) is None
+    assert t.complete(lease["lease_id"], "b") is None
+    assert t.renew(lease["lease_id"], "a", now=105.0)["deadline"] == 115.0
+    assert t.complete(lease["lease_id"], "a") is not None
+    assert t.leases == {}
+
+def test_unknown_lease_is_ignored():
+    t = LeaseTable()
+    assert t.renew("1.1:0-9", "a") is None
+    assert t.complete("1.1:0-9", "a") is None
+
+def test_regranted_range_gets_a_new_id():
+    t = LeaseTable(lease_sec=10)
+    old = t.grant(0, 9, "a", epoch=1, now=100.0)
+    assert t.expire(now=111.0) == [old]
+    start, end = t.take_orphan(10)
+    new = t.grant(start, end, "b", epoch=1, now=111.0)
+    assert new["lease_id"] != old["lease_id"]
+    # the previous holder's late ack must not drop the new holder's lease
+    assert t.complete(old["lease_id"], "a") is None
+    assert t.renew(old["lease_id"], "a") is None
+    assert new["lease_id"] in t.leases
+
+def test_ids_stay_unique_across_reload():
+    t = LeaseTable()
+    first = t.grant(0, 9, "a", epoch=1)
+    t.complete(first["lease_id"], "a")
+    mirror = LeaseTable()
+    mirror.load(t.to_dict())
+    assert mirror.grant(0, 9, "a", epoch=1)["lease_id"] != first["lease_id"]
+
+def test_expired_ranges_are_reissued_lowest_first_and_split():
+    t = LeaseTable(lease_sec=10)
+    t.grant(20, 29, "a", epoch=1, now=0.0)
+    t.grant(0, 9, "b", epoch=1, now=0.0)
+    t.grant(10, 19, "c", epoch=1, now=5.0)
+    assert len(t.expire(now=12.0)) == 2
+    assert t.orphan_rows() == 20
+    assert t.take_orphan(4) == (0, 3)
+    assert t.take_orphan(100) == (4, 9)
+    assert t.take_orphan(100) == (20, 29)
+    assert t.take_orphan(100) is None
+
+# ---------- ClaimSizer ----------
+def test_claims_follow_the_worker_rate():
+    s = ClaimSizer(default_size=100, target_sec=10, min_size=1, max_size=10_000)
+    assert s.next_size("a", remaining=100_000, now=0.0) == 100
+    s.record_claim("a", 100, now=0.0)
+    # 100 rows in 5s -> 20 rows/s -> 200 rows for a 10s claim
+    assert s.next_size("a", remaining=100_000, now=5.0) == 200
+
+def test_claims_shrink_at_the_tail():
+    s = ClaimSizer(default_size=100, target_sec=10, min_size=1)
+    s.record_claim("a", 100, now=0.0)
+    s.record_claim("b", 100, now=0.0)
+    # 40 rows left over two active workers: about two claims each
+    assert s.next_size("a", remaining=40, now=1.0) == 10
+    assert s.next_size("a", remaining=3, now=1.0) == 1  # ceil(3 / (2 * 2))